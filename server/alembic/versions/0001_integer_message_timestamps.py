@@ -0,0 +1,75 @@
+"""integer microsecond timestamps in message tables
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MESSAGE_TABLES = ("twitch_chat_messages", "youtube_chat_messages")
+TIMESTAMP_COLUMNS = ("timestamp", "created_at")
+
+
+# SQLAlchemy stored naive local datetimes as 'YYYY-MM-DD HH:MM:SS.ffffff'
+def _text_to_micros(column: str) -> str:
+    return (
+        f"CASE WHEN typeof({column}) = 'text' THEN "
+        f"CAST(strftime('%s', {column}, 'utc') AS INTEGER) * 1000000 "
+        f"+ CAST(COALESCE(NULLIF(substr({column}, 21, 6), ''), '0') AS INTEGER) "
+        f"ELSE {column} END"
+    )
+
+
+def _micros_to_text(column: str) -> str:
+    return (
+        f"CASE WHEN typeof({column}) = 'integer' THEN "
+        f"strftime('%Y-%m-%d %H:%M:%S', {column} / 1000000, 'unixepoch', 'localtime') "
+        f"|| printf('.%06d', {column} % 1000000) "
+        f"ELSE {column} END"
+    )
+
+
+def _existing_tables():
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    return [table for table in MESSAGE_TABLES if table in tables]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in _existing_tables():
+        assignments = ", ".join(
+            f"{column} = {_text_to_micros(column)}" for column in TIMESTAMP_COLUMNS
+        )
+        op.execute(f"UPDATE {table} SET {assignments}")
+        with op.batch_alter_table(table) as batch_op:
+            for column in TIMESTAMP_COLUMNS:
+                batch_op.alter_column(
+                    column, type_=sa.BigInteger(), existing_type=sa.DateTime()
+                )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in _existing_tables():
+        # batch copies rows with CAST(... AS DATETIME), which would truncate the
+        # text form to its year, so the values are rewritten after the copy
+        with op.batch_alter_table(table) as batch_op:
+            for column in TIMESTAMP_COLUMNS:
+                batch_op.alter_column(
+                    column, type_=sa.DateTime(), existing_type=sa.BigInteger()
+                )
+        assignments = ", ".join(
+            f"{column} = {_micros_to_text(column)}" for column in TIMESTAMP_COLUMNS
+        )
+        op.execute(f"UPDATE {table} SET {assignments}")
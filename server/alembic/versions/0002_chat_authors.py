@@ -0,0 +1,133 @@
+"""normalized chat_authors dictionary referenced by message rows
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# table -> (platform, display name column, colour column, author indexes)
+MESSAGE_TABLES = {
+    "twitch_chat_messages": (
+        1,
+        "author_display_name",
+        "colour",
+        {
+            "ix_twitch_chat_author_name": "author_name",
+            "ix_twitch_chat_author_display_name": "author_display_name",
+        },
+        "ix_twitch_chat_author_ref",
+    ),
+    "youtube_chat_messages": (
+        2,
+        None,
+        None,
+        {
+            "ix_youtube_chat_author_name": "author_name",
+            "ix_youtube_chat_author_id": "author_id",
+        },
+        "ix_youtube_chat_author_ref",
+    ),
+}
+
+
+def _existing_tables():
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    return [table for table in MESSAGE_TABLES if table in tables]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    tables = _existing_tables()
+    if not tables:
+        return
+
+    op.create_table(
+        "chat_authors",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("platform", sa.Integer(), nullable=False),
+        sa.Column("author_id", sa.String(), nullable=True),
+        sa.Column("name", sa.String(), nullable=True),
+        sa.Column("display_name", sa.String(), nullable=True),
+        sa.Column("colour", sa.String(), nullable=True),
+    )
+    op.execute(
+        "CREATE UNIQUE INDEX ux_chat_authors_key ON chat_authors "
+        "(platform, coalesce(author_id, ''), coalesce(name, ''))"
+    )
+    op.create_index("ix_chat_authors_name", "chat_authors", ["name"])
+
+    for table in tables:
+        platform, display_column, colour_column, indexes, ref_index = MESSAGE_TABLES[table]
+        display_name = f"max({display_column})" if display_column else "NULL"
+        colour = f"max({colour_column})" if colour_column else "NULL"
+        op.execute(
+            f"INSERT INTO chat_authors (platform, author_id, name, display_name, colour) "
+            f"SELECT {platform}, author_id, author_name, {display_name}, {colour} "
+            f"FROM {table} WHERE author_id IS NOT NULL OR author_name IS NOT NULL "
+            f"GROUP BY coalesce(author_id, ''), coalesce(author_name, '')"
+        )
+
+        op.add_column(table, sa.Column("author_ref", sa.Integer(), nullable=True))
+        op.execute(
+            f"UPDATE {table} SET author_ref = ("
+            f"SELECT id FROM chat_authors a WHERE a.platform = {platform} "
+            f"AND coalesce(a.author_id, '') = coalesce({table}.author_id, '') "
+            f"AND coalesce(a.name, '') = coalesce({table}.author_name, ''))"
+        )
+
+        with op.batch_alter_table(table) as batch_op:
+            for index_name in indexes:
+                batch_op.drop_index(index_name)
+            batch_op.drop_column("author_name")
+            batch_op.drop_column("author_id")
+            if display_column:
+                batch_op.drop_column(display_column)
+            if colour_column:
+                batch_op.drop_column(colour_column)
+            batch_op.create_foreign_key(
+                f"fk_{table}_author_ref", "chat_authors", ["author_ref"], ["id"]
+            )
+            batch_op.create_index(ref_index, ["author_ref"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    tables = _existing_tables()
+    if not tables:
+        return
+
+    for table in tables:
+        platform, display_column, colour_column, indexes, ref_index = MESSAGE_TABLES[table]
+        op.add_column(table, sa.Column("author_name", sa.String(), nullable=True))
+        op.add_column(table, sa.Column("author_id", sa.String(), nullable=True))
+        assignments = ["author_name = a.name", "author_id = a.author_id"]
+        if display_column:
+            op.add_column(table, sa.Column(display_column, sa.String(), nullable=True))
+            assignments.append(f"{display_column} = a.display_name")
+        if colour_column:
+            op.add_column(table, sa.Column(colour_column, sa.String(), nullable=True))
+            assignments.append(f"{colour_column} = a.colour")
+        op.execute(
+            f"UPDATE {table} SET {', '.join(assignments)} "
+            f"FROM chat_authors a WHERE a.id = {table}.author_ref"
+        )
+
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_index(ref_index)
+            batch_op.drop_column("author_ref")
+            for index_name, column in indexes.items():
+                batch_op.create_index(index_name, [column])
+
+    op.drop_table("chat_authors")
@@ -0,0 +1,99 @@
+"""drop message indexes the query layer never uses, add staging tables
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, Sequence[str], None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# table -> (indexes dropped, indexes added); name -> columns
+INDEX_CHANGES = {
+    "twitch_chat_messages": (
+        {
+            "ix_twitch_chat_timestamp": ["timestamp"],
+            "ix_twitch_chat_message_group_id": ["message_group_id"],
+            "ix_twitch_chat_stream_id": ["stream_id"],
+            "ix_twitch_chat_message": ["message"],
+            "ix_twitch_chat_is_moderator": ["is_moderator"],
+        },
+        {
+            "ix_twitch_chat_stream_timestamp": ["stream_id", "timestamp"],
+            "ix_twitch_chat_stream_group": ["stream_id", "message_group_id"],
+        },
+    ),
+    "youtube_chat_messages": (
+        {
+            "ix_youtube_chat_timestamp": ["timestamp"],
+            "ix_youtube_chat_message_group_id": ["message_group_id"],
+            "ix_youtube_chat_stream_id": ["stream_id"],
+            "ix_youtube_chat_target_message_id": ["target_message_id"],
+            "ix_youtube_chat_message": ["message"],
+            "ix_youtube_chat_deleted": ["deleted"],
+            "ix_youtube_chat_is_moderator": ["is_moderator"],
+            "ix_youtube_chat_is_member": ["is_member"],
+        },
+        {
+            "ix_youtube_chat_stream_timestamp": ["stream_id", "timestamp"],
+            "ix_youtube_chat_stream_group": ["stream_id", "message_group_id"],
+            "ix_youtube_chat_message_id": ["message_id"],
+        },
+    ),
+}
+
+
+def _existing_tables():
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def _create_staging_table(table: str):
+    columns = sa.inspect(op.get_bind()).get_columns(table)
+    op.create_table(
+        f"{table}_staging",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        *[
+            sa.Column(column["name"], column["type"], nullable=True)
+            for column in columns
+            if column["name"] != "id"
+        ],
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    tables = _existing_tables()
+    for table, (dropped, added) in INDEX_CHANGES.items():
+        if table not in tables:
+            continue
+        for index_name in dropped:
+            op.drop_index(index_name, table_name=table, if_exists=True)
+        for index_name, columns in added.items():
+            op.create_index(index_name, table, columns, if_not_exists=True)
+
+        # copy without indexes or constraints that bulk downloads write into
+        if f"{table}_staging" not in tables:
+            _create_staging_table(table)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    tables = _existing_tables()
+    for table, (dropped, added) in INDEX_CHANGES.items():
+        if table not in tables:
+            continue
+        if f"{table}_staging" in tables:
+            op.drop_table(f"{table}_staging")
+        for index_name in added:
+            op.drop_index(index_name, table_name=table, if_exists=True)
+        for index_name, columns in dropped.items():
+            op.create_index(index_name, table, columns, if_not_exists=True)
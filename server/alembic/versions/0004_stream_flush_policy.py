@@ -0,0 +1,41 @@
+"""per-stream flush policy overrides
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, Sequence[str], None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# shard files have no streams table
+def _has_streams() -> bool:
+    return "streams" in sa.inspect(op.get_bind()).get_table_names()
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not _has_streams():
+        return
+    with op.batch_alter_table("streams") as batch_op:
+        batch_op.add_column(sa.Column("flush_max_delay", sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column("flush_max_batch", sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not _has_streams():
+        return
+    with op.batch_alter_table("streams") as batch_op:
+        batch_op.drop_column("flush_max_batch")
+        batch_op.drop_column("flush_max_delay")
@@ -0,0 +1,41 @@
+"""spool checkpoint per stream
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, Sequence[str], None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# shard files have no streams table
+def _has_streams() -> bool:
+    return "streams" in sa.inspect(op.get_bind()).get_table_names()
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not _has_streams():
+        return
+    with op.batch_alter_table("streams") as batch_op:
+        batch_op.add_column(sa.Column("spool_segment", sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column("spool_offset", sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not _has_streams():
+        return
+    with op.batch_alter_table("streams") as batch_op:
+        batch_op.drop_column("spool_offset")
+        batch_op.drop_column("spool_segment")
@@ -0,0 +1,61 @@
+"""leased download jobs
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 23:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006"
+down_revision: Union[str, Sequence[str], None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _tables():
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # shard files have no streams table
+    tables = _tables()
+    if "streams" not in tables or "download_jobs" in tables:
+        return
+    op.create_table(
+        "download_jobs",
+        sa.Column("stream_id", sa.Integer(), sa.ForeignKey("streams.id"), primary_key=True),
+        sa.Column("desired_state", sa.String(), nullable=False),
+        sa.Column("owner", sa.String(), nullable=True),
+        sa.Column("lease_expires_at", sa.DateTime(), nullable=True),
+        sa.Column("heartbeat_at", sa.DateTime(), nullable=True),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index(
+        "ix_download_jobs_claim", "download_jobs", ["desired_state", "lease_expires_at"]
+    )
+    # downloads that were running before the upgrade are claimed again,
+    # paused ones keep waiting for a resume
+    op.execute(
+        """
+        INSERT INTO download_jobs (stream_id, desired_state, attempts, updated_at)
+        SELECT id, CASE download_status WHEN 'downloading' THEN 'run' ELSE 'pause' END,
+               0, CURRENT_TIMESTAMP
+        FROM streams WHERE download_status IN ('downloading', 'paused')
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if "download_jobs" not in _tables():
+        return
+    op.drop_index("ix_download_jobs_claim", table_name="download_jobs")
+    op.drop_table("download_jobs")
@@ -0,0 +1,86 @@
+"""author to streams index and full-text index over messages
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-20 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0007"
+down_revision: Union[str, Sequence[str], None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MESSAGE_TABLES = ["twitch_chat_messages", "youtube_chat_messages"]
+
+
+def _tables():
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def _full_text_statements(table: str):
+    fts = f"{table}_fts"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(message, content='{table}', "
+        "content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} "
+        f"WHEN new.message IS NOT NULL BEGIN "
+        f"INSERT INTO {fts} (rowid, message) VALUES (new.id, new.message); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} "
+        f"WHEN old.message IS NOT NULL BEGIN "
+        f"INSERT INTO {fts} ({fts}, rowid, message) VALUES ('delete', old.id, old.message); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF message ON {table} BEGIN "
+        f"INSERT INTO {fts} ({fts}, rowid, message) "
+        f"SELECT 'delete', old.id, old.message WHERE old.message IS NOT NULL; "
+        f"INSERT INTO {fts} (rowid, message) "
+        f"SELECT new.id, new.message WHERE new.message IS NOT NULL; END",
+        # index what is already stored
+        f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')",
+    ]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    tables = _tables()
+    # shard files have no streams table, the author index lives in the catalog;
+    # streams stored before this revision are indexed on startup
+    if "streams" in tables and "author_streams" not in tables:
+        op.create_table(
+            "author_streams",
+            sa.Column("stream_id", sa.Integer(), sa.ForeignKey("streams.id"), primary_key=True),
+            sa.Column("platform", sa.Integer(), primary_key=True),
+            sa.Column("author_id", sa.String(), primary_key=True),
+            sa.Column("name", sa.String(), primary_key=True),
+            sa.Column("display_name", sa.String(), nullable=True),
+            sa.Column("message_count", sa.Integer(), nullable=False),
+            sa.Column("first_timestamp", sa.BigInteger(), nullable=True),
+            sa.Column("last_timestamp", sa.BigInteger(), nullable=True),
+        )
+        op.create_index("ix_author_streams_author_id", "author_streams", ["author_id"])
+        op.execute("CREATE INDEX ix_author_streams_name ON author_streams (lower(name))")
+        op.execute(
+            "CREATE INDEX ix_author_streams_display_name ON author_streams (lower(display_name))"
+        )
+
+    for table in MESSAGE_TABLES:
+        if table in tables:
+            for statement in _full_text_statements(table):
+                op.execute(statement)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    tables = _tables()
+    for table in MESSAGE_TABLES:
+        if f"{table}_fts" in tables:
+            for trigger in ("insert", "delete", "update"):
+                op.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{trigger}")
+            op.execute(f"DROP TABLE {table}_fts")
+    if "author_streams" in tables:
+        op.drop_table("author_streams")
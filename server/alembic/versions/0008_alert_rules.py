@@ -0,0 +1,62 @@
+"""alert rules and their hits
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-20 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0008"
+down_revision: Union[str, Sequence[str], None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _tables():
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # shard files have no streams table
+    tables = _tables()
+    if "streams" not in tables or "alert_rules" in tables:
+        return
+    op.create_table(
+        "alert_rules",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("pattern", sa.String(), nullable=False),
+        sa.Column("field", sa.String(), nullable=False),
+        sa.Column("platform", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+    )
+    op.create_table(
+        "alert_hits",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("rule_id", sa.Integer(), sa.ForeignKey("alert_rules.id"), nullable=False),
+        sa.Column("stream_id", sa.Integer(), sa.ForeignKey("streams.id"), nullable=False),
+        sa.Column("message_id", sa.String(), nullable=True),
+        sa.Column("timestamp", sa.BigInteger(), nullable=True),
+        sa.Column("author", sa.String(), nullable=True),
+        sa.Column("message", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index("ix_alert_hits_rule", "alert_hits", ["rule_id", "id"])
+    op.create_index("ix_alert_hits_stream", "alert_hits", ["stream_id", "id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if "alert_rules" not in _tables():
+        return
+    op.drop_index("ix_alert_hits_stream", table_name="alert_hits")
+    op.drop_index("ix_alert_hits_rule", table_name="alert_hits")
+    op.drop_table("alert_hits")
+    op.drop_table("alert_rules")
@@ -0,0 +1,56 @@
+"""near-duplicate cluster id on messages
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-20 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0009"
+down_revision: Union[str, Sequence[str], None] = "0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# table -> index on (stream_id, cluster_id), None for staging tables
+TABLES = {
+    "twitch_chat_messages": "ix_twitch_chat_stream_cluster",
+    "youtube_chat_messages": "ix_youtube_chat_stream_cluster",
+    "twitch_chat_messages_staging": None,
+    "youtube_chat_messages_staging": None,
+}
+
+
+def _tables():
+    inspector = sa.inspect(op.get_bind())
+    return {
+        table: {column["name"] for column in inspector.get_columns(table)}
+        for table in inspector.get_table_names()
+        if table in TABLES
+    }
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # a plain add column, rebuilding the table would drop the full-text triggers
+    for table, columns in _tables().items():
+        if "cluster_id" in columns:
+            continue
+        op.add_column(table, sa.Column("cluster_id", sa.BigInteger(), nullable=True))
+        if TABLES[table]:
+            op.create_index(TABLES[table], table, ["stream_id", "cluster_id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table, columns in _tables().items():
+        if "cluster_id" not in columns:
+            continue
+        if TABLES[table]:
+            op.drop_index(TABLES[table], table_name=table)
+        op.drop_column(table, "cluster_id")
@@ -0,0 +1,119 @@
+"""typed paid message and subscription columns, stream revenue totals
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-21 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0010"
+down_revision: Union[str, Sequence[str], None] = "0009"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# table -> (new columns, index on them, None for staging tables)
+TABLES = {
+    "twitch_chat_messages": (
+        (("sub_tier", sa.Integer()), ("sub_prime", sa.Boolean())),
+        ("ix_twitch_chat_stream_sub_tier", "sub_tier"),
+    ),
+    "youtube_chat_messages": (
+        (("money_amount", sa.BigInteger()), ("money_currency", sa.String())),
+        ("ix_youtube_chat_stream_currency", "money_currency"),
+    ),
+    "twitch_chat_messages_staging": (
+        (("sub_tier", sa.Integer()), ("sub_prime", sa.Boolean())),
+        None,
+    ),
+    "youtube_chat_messages_staging": (
+        (("money_amount", sa.BigInteger()), ("money_currency", sa.String())),
+        None,
+    ),
+}
+
+# rows stored before, filled from the json money and the twitch system message;
+# gift bomb announcements stand for no subscription of their own
+BACKFILL = {
+    "youtube_chat_messages": """
+        UPDATE youtube_chat_messages
+        SET money_amount = CAST(round(json_extract(money, '$.amount') * 100) AS INTEGER),
+            money_currency = json_extract(money, '$.currency')
+        WHERE money IS NOT NULL
+          AND json_valid(money)
+          AND json_extract(money, '$.amount') IS NOT NULL
+          AND coalesce(json_extract(money, '$.currency'), '') != ''
+    """,
+    "twitch_chat_messages": """
+        UPDATE twitch_chat_messages
+        SET sub_tier = CASE
+                WHEN system_message LIKE '%with Prime%' THEN 1
+                WHEN system_message LIKE '%Tier 1%' THEN 1
+                WHEN system_message LIKE '%Tier 2%' THEN 2
+                WHEN system_message LIKE '%Tier 3%' THEN 3
+            END,
+            sub_prime = system_message LIKE '%with Prime%'
+        WHERE message_group_id = 3
+          AND system_message IS NOT NULL
+          AND system_message NOT LIKE '% is gifting %'
+          AND (system_message LIKE '%with Prime%' OR system_message LIKE '%Tier _%')
+    """,
+}
+
+
+def _tables():
+    inspector = sa.inspect(op.get_bind())
+    return {
+        table: {column["name"] for column in inspector.get_columns(table)}
+        for table in inspector.get_table_names()
+    }
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    tables = _tables()
+    # a plain add column, rebuilding the table would drop the full-text triggers
+    for table, (columns, index) in TABLES.items():
+        if table not in tables or columns[0][0] in tables[table]:
+            continue
+        for name, type_ in columns:
+            op.add_column(table, sa.Column(name, type_, nullable=True))
+        if index:
+            op.create_index(index[0], table, ["stream_id", index[1]])
+        if table in BACKFILL:
+            op.execute(BACKFILL[table])
+
+    # shard files have no streams table
+    if "streams" not in tables or "stream_revenue" in tables:
+        return
+    # filled per stream at the next startup, see models.revenue.index_missing_revenue
+    op.create_table(
+        "stream_revenue",
+        sa.Column("stream_id", sa.Integer(), sa.ForeignKey("streams.id"), primary_key=True),
+        sa.Column("currency", sa.String(), primary_key=True),
+        sa.Column("tier", sa.Integer(), primary_key=True),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("prime_count", sa.Integer(), nullable=False),
+        sa.Column("amount", sa.BigInteger(), nullable=False),
+        sa.Column("first_timestamp", sa.BigInteger(), nullable=True),
+        sa.Column("last_timestamp", sa.BigInteger(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    tables = _tables()
+    if "stream_revenue" in tables:
+        op.drop_table("stream_revenue")
+    for table, (columns, index) in TABLES.items():
+        if table not in tables or columns[0][0] not in tables[table]:
+            continue
+        if index:
+            op.drop_index(index[0], table_name=table)
+        for name, _ in columns:
+            op.drop_column(table, name)
@@ -0,0 +1,69 @@
+# Alert rule matching cost per message as the number of rules grows: the
+# compiled matcher against checking every rule with `in`.
+#
+#   cd server && python -m benchmarks.bench_alerts [messages]
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from models.alerts import AlertMatcher  # noqa: E402
+from models.schema import AlertRule  # noqa: E402
+
+WORDS = ["kappa", "pog", "lul", "gg", "nice", "what", "chat", "is", "this", "real"]
+RULE_COUNTS = [10, 100, 1000, 5000]
+
+
+def _rules(count: int, rng: random.Random):
+    rules = []
+    for i in range(count):
+        field = "author" if i % 4 == 0 else "message"
+        pattern = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 12)))
+        rules.append(AlertRule(id=i + 1, pattern=pattern, field=field, platform=None))
+    return rules
+
+
+def _messages(count: int, rng: random.Random):
+    return [
+        (" ".join(rng.choices(WORDS, k=rng.randint(3, 15))), f"chatter_{rng.randrange(20_000)}")
+        for _ in range(count)
+    ]
+
+
+def _per_message_us(match, messages) -> float:
+    started = time.perf_counter()
+    for text, name in messages:
+        match(text, name)
+    return (time.perf_counter() - started) / len(messages) * 1e6
+
+
+def run(count: int):
+    rng = random.Random(1)
+    messages = _messages(count, rng)
+    print(f"{count} messages")
+    print(f"{'rules':>8}{'compile ms':>12}{'matcher us/msg':>16}{'naive us/msg':>14}")
+    for rule_count in RULE_COUNTS:
+        rules = _rules(rule_count, rng)
+        started = time.perf_counter()
+        matcher = AlertMatcher(rules)
+        compile_ms = (time.perf_counter() - started) * 1000
+
+        def naive(text, name):
+            text, name = text.casefold(), name.casefold()
+            return [
+                rule.id
+                for rule in rules
+                if (rule.pattern in text if rule.field == "message" else rule.pattern == name)
+            ]
+
+        compiled = _per_message_us(lambda text, name: matcher.match(1, text, (name,)), messages)
+        # the naive loop gets slow enough that a sample says as much
+        baseline = _per_message_us(naive, messages[: max(1, count // 10)])
+        print(f"{rule_count:8}{compile_ms:12.1f}{compiled:16.2f}{baseline:14.2f}")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
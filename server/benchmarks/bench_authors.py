@@ -0,0 +1,123 @@
+# Compares inline author columns (before migration 0002) against the
+# chat_authors dictionary: file size and username-filter speed.
+#
+#   cd server && python -m benchmarks.bench_authors [rows] [authors]
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import database  # noqa: E402
+
+STREAMS = 5
+START_US = 1_735_725_600_000_000
+
+INLINE_FILTER = (
+    "SELECT id FROM twitch_chat_messages WHERE stream_id = ? "
+    "AND (author_name LIKE ? OR author_display_name LIKE ?) "
+    "ORDER BY timestamp DESC LIMIT 500"
+)
+DICTIONARY_FILTER = (
+    "SELECT id FROM twitch_chat_messages WHERE stream_id = ? "
+    "AND author_ref IN (SELECT id FROM chat_authors WHERE platform = 1 "
+    "AND (name LIKE ? OR display_name LIKE ?)) "
+    "ORDER BY timestamp DESC LIMIT 500"
+)
+
+
+def _fill(path: str, rows: int, authors: int):
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    database.init_db()
+    database.engine.dispose()
+
+    rng = random.Random(1)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO chat_authors (id, platform, author_id, name, display_name, colour) "
+        "VALUES (?, 1, ?, ?, ?, ?)",
+        (
+            (i + 1, str(10_000_000 + i), f"chatter_{i}", f"Chatter_{i}", f"#{i % 0xFFFFFF:06X}")
+            for i in range(authors)
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO twitch_chat_messages (message_group_id, timestamp, stream_id, "
+        "author_ref, message, created_at) VALUES (1, ?, ?, ?, ?, ?)",
+        (
+            (
+                START_US + i * 50_000,
+                i % STREAMS + 1,
+                rng.randrange(authors) + 1,
+                "some chat message " * rng.randrange(1, 4),
+                START_US + i * 50_000 + 1_000_000,
+            )
+            for i in range(rows)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def _downgrade(path: str, revision: str):
+    from alembic import command
+    from sqlalchemy import create_engine
+
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.connect() as conn:
+        command.downgrade(database._alembic_config(conn), revision)
+        conn.commit()
+    engine.dispose()
+
+
+def _size(path: str) -> int:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("VACUUM")
+    conn.close()
+    return os.path.getsize(path)
+
+
+def _filter_query(path: str, sql: str, authors: int, repeats: int = 20) -> float:
+    conn = sqlite3.connect(path)
+    rng = random.Random(2)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        pattern = f"%ter_{rng.randrange(authors)}%"
+        conn.execute(sql, (1, pattern, pattern)).fetchall()
+    elapsed = (time.perf_counter() - started) / repeats
+    conn.close()
+    return elapsed
+
+
+def main(rows: int, authors: int):
+    workdir = tempfile.mkdtemp()
+    try:
+        after = os.path.join(workdir, "dictionary.db")
+        before = os.path.join(workdir, "inline.db")
+        _fill(after, rows, authors)
+        shutil.copy(after, before)
+        _downgrade(before, "0001")
+
+        print(f"{rows} twitch rows from {authors} authors across {STREAMS} streams")
+        print(f"{'':12}{'size (MB)':>12}{'username filter (ms)':>24}")
+        for label, path, sql in (
+            ("inline", before, INLINE_FILTER),
+            ("dictionary", after, DICTIONARY_FILTER),
+        ):
+            size = _size(path) / 1024 / 1024
+            query_ms = _filter_query(path, sql, authors) * 1000
+            print(f"{label:12}{size:12.2f}{query_ms:24.2f}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 500_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 50_000,
+    )
@@ -0,0 +1,143 @@
+# Ingest throughput of the data handler: normal inserts with the indexes from
+# before migration 0003, normal inserts with the trimmed index set, and bulk
+# mode (unindexed staging table, merged in timestamp order on close).
+#
+#   cd server && python -m benchmarks.bench_bulk_import [rows] [existing_rows]
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import database  # noqa: E402
+from models.flush_policy import FixedFlushPolicy  # noqa: E402
+from models.tw_data_handler import TwitchDataHandler  # noqa: E402
+
+START_US = 1_735_725_600_000_000
+AUTHORS = 20_000
+WORDS = ["kappa", "pog", "lul", "gg", "nice", "what", "chat", "is", "this", "real"]
+
+
+def _messages(rows: int, seed: int):
+    rng = random.Random(seed)
+    for i in range(rows):
+        author = rng.randrange(AUTHORS)
+        yield {
+            "message_id": f"{seed}-{i}",
+            "message_type": "text_message",
+            "timestamp": START_US + i * 20_000,
+            "message": " ".join(rng.choice(WORDS) for _ in range(rng.randrange(1, 12))),
+            "author": {
+                "id": str(author),
+                "name": f"chatter_{author}",
+                "display_name": f"Chatter_{author}",
+                "colour": "#FF0000",
+                "is_moderator": author % 50 == 0,
+                "is_subscriber": author % 3 == 0,
+            },
+        }
+
+
+def _prepare(path: str, existing_rows: int):
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    database.init_db()
+    database.engine.dispose()
+
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO streams (id, url, platform, download_status, message_count) "
+        "VALUES (?, 'https://www.twitch.tv/videos/1', 1, 'completed', 0)",
+        [(1,), (2,)],
+    )
+    conn.executemany(
+        "INSERT INTO chat_authors (id, platform, author_id, name) VALUES (?, 1, ?, ?)",
+        ((i + 1, str(i), f"chatter_{i}") for i in range(AUTHORS)),
+    )
+    rng = random.Random(0)
+    conn.executemany(
+        "INSERT INTO twitch_chat_messages (message_group_id, timestamp, stream_id, "
+        "author_ref, message, is_moderator, created_at) VALUES (1, ?, 1, ?, ?, 0, ?)",
+        (
+            (
+                START_US + i * 20_000,
+                rng.randrange(AUTHORS) + 1,
+                " ".join(rng.choice(WORDS) for _ in range(rng.randrange(1, 12))),
+                START_US,
+            )
+            for i in range(existing_rows)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def _downgrade(path: str, revision: str):
+    from alembic import command
+    from sqlalchemy import create_engine
+
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.connect() as conn:
+        command.downgrade(database._alembic_config(conn), revision)
+        conn.commit()
+    engine.dispose()
+
+
+def _ingest(path: str, rows: int, bulk: bool) -> float:
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    database.init_db()
+    db = database.SessionLocal()
+    # shuffle within small windows, like chat arriving slightly out of order
+    messages = list(_messages(rows, seed=2))
+    rng = random.Random(3)
+    for start in range(0, rows, 50):
+        window = messages[start:start + 50]
+        rng.shuffle(window)
+        messages[start:start + 50] = window
+
+    handler = TwitchDataHandler(db, bulk=bulk, policy=FixedFlushPolicy(1000))
+    started = time.perf_counter()
+    for message in messages:
+        handler.save_message(message, stream_id=2)
+    handler.close()
+    elapsed = time.perf_counter() - started
+
+    db.close()
+    database.engine.dispose()
+    return rows / elapsed
+
+
+def main(rows: int, existing_rows: int):
+    workdir = tempfile.mkdtemp()
+    try:
+        template = os.path.join(workdir, "template.db")
+        _prepare(template, existing_rows)
+
+        old_indexes = os.path.join(workdir, "old_indexes.db")
+        shutil.copy(template, old_indexes)
+        _downgrade(old_indexes, "0002")
+
+        print(f"{rows} twitch messages into a table holding {existing_rows}")
+        print(f"{'':24}{'rows/sec':>12}")
+        for label, bulk, source in (
+            ("normal (old indexes)", False, old_indexes),
+            ("normal", False, template),
+            ("bulk", True, template),
+        ):
+            path = os.path.join(workdir, "run.db")
+            shutil.copy(source, path)
+            rate = _ingest(path, rows, bulk)
+            os.remove(path)
+            print(f"{label:24}{rate:12.0f}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000,
+    )
@@ -0,0 +1,58 @@
+# Near-duplicate clustering cost per message and the memory it holds, for chat
+# with spam waves mixed in.
+#
+#   cd server && python -m benchmarks.bench_duplicates [messages]
+import os
+import random
+import string
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from models.duplicates import DuplicateDetector  # noqa: E402
+
+_words = random.Random(0)
+WORDS = [
+    "".join(_words.choices(string.ascii_lowercase, k=_words.randint(2, 8))) for _ in range(2000)
+]
+WAVES = [
+    "COPY THIS IF YOU LOVE THE STREAM PogChamp PogChamp PogChamp",
+    "free nitro at discord-gift.example claim now before it runs out",
+    "RAID RAID RAID welcome raiders from the other stream",
+]
+
+
+def _messages(count: int, rng: random.Random):
+    for _ in range(count):
+        if rng.random() < 0.3:
+            # a wave message with some noise at the end
+            yield rng.choice(WAVES) + " " + "!" * rng.randrange(4)
+        else:
+            yield " ".join(rng.choices(WORDS, k=rng.randint(3, 15)))
+
+
+def run(count: int):
+    messages = list(_messages(count, random.Random(1)))
+    detector = DuplicateDetector()
+    started = time.perf_counter()
+    clusters = {detector.assign(text) for text in messages}
+    elapsed = time.perf_counter() - started
+
+    # measured apart, tracing slows the clustering down several times
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    detector = DuplicateDetector()
+    for text in messages:
+        detector.assign(text)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    print(f"{count} messages, {len(detector.buckets)} buckets held")
+    print(f"{elapsed / count * 1e6:.2f} us/msg, {count / elapsed:.0f} msg/s")
+    print(f"{len(clusters)} clusters, {len(WAVES)} waves and the random chat")
+    print(f"peak memory {peak / 1024 / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,103 @@
+# Filter panel counts of one stream: a count() query per facet against the
+# single pass of models.facets, and the cached answer between flushes.
+#
+#   cd server && python -m benchmarks.bench_facets [rows] [authors]
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import database  # noqa: E402
+from models import facets  # noqa: E402
+from models.dicts import MessageGroup  # noqa: E402
+from models.queries import build_messages_query  # noqa: E402
+from models.schema import Stream  # noqa: E402
+
+START_US = 1_735_725_600_000_000
+REPEATS = 5
+
+
+def _fill(path: str, rows: int, authors: int):
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    database.init_db()
+    database.engine.dispose()
+
+    rng = random.Random(1)
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "INSERT INTO streams (id, url, platform, download_status, message_count) "
+        "VALUES (1, 'https://www.twitch.tv/videos/1', 1, 'completed', ?)",
+        (rows,),
+    )
+    conn.executemany(
+        "INSERT INTO chat_authors (id, platform, author_id, name) VALUES (?, 1, ?, ?)",
+        ((i + 1, str(i), f"chatter_{i}") for i in range(authors)),
+    )
+    conn.executemany(
+        "INSERT INTO twitch_chat_messages (message_group_id, timestamp, stream_id, author_ref, "
+        "is_moderator, is_subscriber, message) VALUES (?, ?, 1, ?, ?, ?, 'some chat message')",
+        (
+            (
+                MessageGroup.bans.value if rng.random() < 0.001 else rng.choice((1, 1, 1, 3)),
+                START_US + i * 50_000,
+                rng.randrange(authors) + 1,
+                rng.random() < 0.02,
+                rng.random() < 0.3,
+            )
+            for i in range(rows)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def _separate(message_db, stream):
+    # what the panel needed before: one query per number it shows
+    counts = [
+        build_messages_query(message_db, stream, [group.value]).count() for group in MessageGroup
+    ]
+    counts.append(build_messages_query(message_db, stream, [], moderators=True).count())
+    counts.append(build_messages_query(message_db, stream, [], includeBannedUsers=False).count())
+    return counts
+
+
+def _time(fn) -> float:
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        fn()
+    return (time.perf_counter() - started) / REPEATS
+
+
+def run(rows: int, authors: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        _fill(os.path.join(tmp, "sql_app.db"), rows, authors)
+        database.init_db()
+        db = database.SessionLocal()
+        try:
+            stream = db.get(Stream, 1)
+            separate = _time(lambda: _separate(db, stream))
+            one_pass = _time(lambda: facets.count_facets(db, stream, []))
+
+            cache = facets.FacetCache()
+            key, mark = (stream.id,), facets.watermark(stream)
+            cache.put(key, mark, facets.count_facets(db, stream, []))
+            cached = _time(lambda: cache.get(key, mark))
+        finally:
+            db.close()
+            database.close_db()
+
+    print(f"{rows} messages, {authors} authors")
+    print(f"separate count queries {separate * 1000:.1f} ms")
+    print(f"single pass            {one_pass * 1000:.1f} ms")
+    print(f"cached                 {cached * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 500_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 20_000,
+    )
@@ -0,0 +1,127 @@
+# Concurrent downloads in thread and process ingest mode: total messages per
+# second, and how late a 1 ms sleep on another thread wakes up while they run
+# (what an API request waiting for the GIL sees).
+#
+#   cd server && python -m benchmarks.bench_ingest_process [streams] [messages]
+import functools
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import database  # noqa: E402
+import main  # noqa: E402
+from models import ingest_process  # noqa: E402
+from models.schema import Stream  # noqa: E402
+
+START_US = 1_735_725_600_000_000
+AUTHORS = 20_000
+WORDS = ["kappa", "pog", "lul", "gg", "nice", "what", "chat", "is", "this", "real"]
+MESSAGES = int(os.environ.get("BENCH_MESSAGES", "50000"))
+
+
+class SyntheticChat:
+    title = "bench"
+    id = "bench"
+    status = "live"
+    duration = None
+
+    def __init__(self, seed: int, count: int):
+        self.seed = seed
+        self.count = count
+
+    def __iter__(self):
+        rng = random.Random(self.seed)
+        for i in range(self.count):
+            author = rng.randrange(AUTHORS)
+            yield {
+                "message_id": f"{self.seed}-{i}",
+                "message_type": "text_message",
+                "timestamp": START_US + i * 1000,
+                "message": " ".join(rng.choices(WORDS, k=8)),
+                "author": {
+                    "id": str(author),
+                    "name": f"chatter_{author}",
+                    "display_name": f"Chatter{author}",
+                    "badges": [{"name": "subscriber", "title": "Subscriber"}],
+                },
+                "colour": "#1E90FF",
+            }
+
+
+def synthetic_chat(url: str, platform: int):
+    return SyntheticChat(int(url.rsplit("/", 1)[1]), MESSAGES)
+
+
+def _lateness(stop: threading.Event, samples: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        time.sleep(0.001)
+        samples.append(time.perf_counter() - started - 0.001)
+
+
+def _measure(mode: str, streams: int):
+    directory = tempfile.mkdtemp(prefix="bench-ingest-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    database.init_db()
+    db = database.SessionLocal()
+    stream_ids = []
+    for i in range(streams):
+        stream = Stream(url=f"https://www.twitch.tv/videos/{i}", platform=1, download_status="downloading")
+        db.add(stream)
+        db.commit()
+        stream_ids.append(stream.id)
+    db.close()
+
+    ingest_process.INGEST_MODE = mode
+    threads = [
+        threading.Thread(target=main.start_download, args=(stream_id, threading.Event()))
+        for stream_id in stream_ids
+    ]
+    stop = threading.Event()
+    samples = []
+    probe = threading.Thread(target=_lateness, args=(stop, samples))
+    probe.start()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    probe.join()
+
+    database.close_db()
+    shutil.rmtree(directory)
+    samples.sort()
+    return (
+        streams * MESSAGES / elapsed,
+        statistics.median(samples) * 1000,
+        samples[int(len(samples) * 0.99)] * 1000,
+    )
+
+
+def run(streams: int):
+    # thread mode fetches through ChatDownloader in this process
+    main.ChatDownloader.get_chat = lambda self, url, **kwargs: synthetic_chat(url, 1)
+    ingest_process.ProcessIngest = functools.partial(
+        ingest_process.ProcessIngest, chat_factory=synthetic_chat
+    )
+    print(f"{streams} streams x {MESSAGES} messages, {os.cpu_count()} cpus")
+    print(f"{'mode':10}{'msg/s':>12}{'late p50 ms':>14}{'late p99 ms':>14}")
+    for mode in ("thread", "process"):
+        rate, p50, p99 = _measure(mode, streams)
+        print(f"{mode:10}{rate:12.0f}{p50:14.2f}{p99:14.2f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        MESSAGES = int(sys.argv[2])
+        os.environ["BENCH_MESSAGES"] = sys.argv[2]
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 4)
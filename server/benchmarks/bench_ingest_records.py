@@ -0,0 +1,169 @@
+# Per-message cost of the ingest path on the server/data fixtures: queuing
+# full ORM objects (with the old two-pass YouTube badge scan) against slotted
+# records, then writing a batch with session.add_all against a Core insert.
+#
+#   cd server && python -m benchmarks.bench_ingest_records [repeat]
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from models.author_cache import AuthorInfo  # noqa: E402
+from models.dicts import PlatformType, message_types  # noqa: E402
+from models.records import (  # noqa: E402
+    TwitchMessageRecord,
+    YouTubeMessageRecord,
+    badge_flags,
+    rows_by_model,
+)
+from models.schema import Base, TwitchChatMessage, YouTubeChatMessage  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+TWITCH = PlatformType.TWITCH.value
+YOUTUBE = PlatformType.YOUTUBE.value
+
+
+def _load(*names):
+    messages = []
+    for name in names:
+        with open(os.path.join(DATA_DIR, name)) as f:
+            messages.extend(
+                m for m in json.load(f) if message_types.get(m.get("message_type", ""))
+            )
+    return messages
+
+
+def _legacy_twitch(data):
+    author = data.get("author", {})
+    message_type = data.get("message_type", "")
+    return TwitchChatMessage(
+        message_id=data.get("message_id"),
+        message_group_id=message_types[message_type].value,
+        timestamp=data.get("timestamp", 0),
+        stream_id=1,
+        is_moderator=author.get("is_moderator"),
+        is_subscriber=author.get("is_subscriber"),
+        message=data.get("message"),
+        cumulative_months=data.get("cumulative_months") if "subscription" in message_type else None,
+        system_message=data.get("system_message") if "subscription" in message_type else None,
+    ), AuthorInfo(author.get("id"), author.get("name"), author.get("display_name"), data.get("colour"))
+
+
+def _legacy_youtube(data):
+    author = data.get("author", {})
+    badges = author.get("badges", [])
+    is_moderator = any(badge.get("icon_name") == "moderator" for badge in badges)
+    is_member = any("Member" in badge.get("title") for badge in badges)
+    return YouTubeChatMessage(
+        message_id=data.get("message_id"),
+        message_group_id=message_types[data.get("message_type", "")].value,
+        timestamp=data.get("timestamp", 0),
+        stream_id=1,
+        is_moderator=is_moderator,
+        is_member=is_member,
+        message=data.get("message"),
+        header_primary_text=data.get("header_primary_text"),
+        header_secondary_text=data.get("header_secondary_text"),
+        money=data.get("money"),
+    ), AuthorInfo(author.get("id"), author.get("name"))
+
+
+def _record_twitch(data):
+    author = data.get("author", {})
+    message_type = data.get("message_type", "")
+    is_subscription = "subscription" in message_type
+    return TwitchMessageRecord(
+        message_id=data.get("message_id"),
+        message_group_id=message_types[message_type].value,
+        timestamp=data.get("timestamp", 0),
+        stream_id=1,
+        author=AuthorInfo(author.get("id"), author.get("name"), author.get("display_name"), data.get("colour")),
+        is_moderator=author.get("is_moderator"),
+        is_subscriber=author.get("is_subscriber"),
+        message=data.get("message"),
+        cumulative_months=data.get("cumulative_months") if is_subscription else None,
+        system_message=data.get("system_message") if is_subscription else None,
+    )
+
+
+def _record_youtube(data):
+    author = data.get("author", {})
+    flags = badge_flags(YOUTUBE, author.get("badges", ()))
+    return YouTubeMessageRecord(
+        message_id=data.get("message_id"),
+        message_group_id=message_types[data.get("message_type", "")].value,
+        timestamp=data.get("timestamp", 0),
+        stream_id=1,
+        author=AuthorInfo(author.get("id"), author.get("name")),
+        is_moderator=flags["is_moderator"],
+        is_member=flags["is_member"],
+        message=data.get("message"),
+        header_primary_text=data.get("header_primary_text"),
+        header_secondary_text=data.get("header_secondary_text"),
+        money=data.get("money"),
+    )
+
+
+def _queue(make, messages, repeat):
+    batch = []
+    blocks = sys.getallocatedblocks()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for data in messages:
+            batch.append(make(data))
+    elapsed = time.perf_counter() - started
+    # blocks still alive per queued message, what a batch keeps in memory
+    retained = (sys.getallocatedblocks() - blocks) / len(batch)
+    return batch, elapsed / len(batch) * 1_000_000, retained
+
+
+def _write_orm(factory, batch):
+    session = factory()
+    started = time.perf_counter()
+    session.add_all([message for message, _ in batch])
+    session.commit()
+    elapsed = time.perf_counter() - started
+    session.close()
+    return elapsed
+
+
+def _write_records(factory, batch):
+    session = factory()
+    started = time.perf_counter()
+    for model, rows in rows_by_model(batch).items():
+        session.execute(insert(model.__table__), rows)
+    session.commit()
+    elapsed = time.perf_counter() - started
+    session.close()
+    return elapsed
+
+
+def main(repeat: int):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+
+    print(f"{'':22}{'queue us/msg':>14}{'blocks/msg':>12}{'write us/msg':>14}")
+    for platform, files, legacy, record in (
+        ("twitch", ("tw_messages.json", "tw_subscriptions.json"), _legacy_twitch, _record_twitch),
+        ("youtube", ("yt_messages.json", "yt_superchats.json"), _legacy_youtube, _record_youtube),
+    ):
+        messages = _load(*files)
+        for label, make, write in (
+            ("orm objects", legacy, _write_orm),
+            ("records", record, _write_records),
+        ):
+            batch, queue_us, blocks = _queue(make, messages, repeat)
+            write_us = write(factory, batch) / len(batch) * 1_000_000
+            print(f"{platform + ' ' + label:22}{queue_us:14.2f}{blocks:12.1f}{write_us:14.2f}")
+            del batch
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
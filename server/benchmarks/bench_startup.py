@@ -0,0 +1,117 @@
+# Startup cost of the API: how long importing main takes, and for a spawned
+# server how long until /health answers and until the startup steps are done.
+#
+#   cd server && python -m benchmarks.bench_startup [runs]
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+STARTUP_TIMEOUT = 60
+
+IMPORT_SCRIPT = (
+    "import sys, time; started = time.perf_counter(); import main; "
+    "print(time.perf_counter() - started, 'chat_downloader' in sys.modules)"
+)
+
+
+def _env(db_path: str, port: int = 0) -> dict:
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{db_path}"
+    env["UVI_PORT"] = str(port)
+    env["DOWNLOAD_WORKERS"] = "0"
+    return env
+
+
+def import_time(db_path: str):
+    # (seconds, whether chat_downloader got imported with main)
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT],
+        cwd=SERVER_DIR,
+        env=_env(db_path),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    return float(output[-2]), output[-1] == "True"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _health(port: int):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+            return json.load(response)
+    except (urllib.error.URLError, ConnectionError, OSError):
+        return None
+
+
+def serve_times(db_path: str) -> dict:
+    # seconds from spawning the server until /health answers and until it says ok
+    port = _free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "main.py"],
+        cwd=SERVER_DIR,
+        env=_env(db_path, port),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    times = {}
+    try:
+        while time.perf_counter() - started < STARTUP_TIMEOUT:
+            health = _health(port)
+            if health is not None:
+                times.setdefault("healthy", time.perf_counter() - started)
+                if health["status"] == "ok":
+                    times["ready"] = time.perf_counter() - started
+                    times["steps"] = health.get("startup")
+                    return times
+                if health["status"] == "error":
+                    raise RuntimeError("server failed to start")
+            time.sleep(0.01)
+        raise TimeoutError("server did not start")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run(runs: int) -> dict:
+    imports, healthy, ready = [], [], []
+    deferred = True
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "sql_app.db")
+            seconds, loaded = import_time(db_path)
+            imports.append(seconds)
+            deferred = deferred and not loaded
+            times = serve_times(db_path)
+            healthy.append(times["healthy"])
+            ready.append(times["ready"])
+    result = {
+        "import": statistics.median(imports),
+        "healthy": statistics.median(healthy),
+        "ready": statistics.median(ready),
+        "chat_downloader_deferred": deferred,
+    }
+    print(f"{runs} runs, medians on a fresh database")
+    print(f"import main     {result['import'] * 1000:.0f} ms")
+    print(f"/health answers {result['healthy'] * 1000:.0f} ms after spawn")
+    print(f"startup done    {result['ready'] * 1000:.0f} ms after spawn")
+    print(f"chat_downloader deferred: {deferred}")
+    return result
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
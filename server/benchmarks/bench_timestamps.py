@@ -0,0 +1,124 @@
+# Compares DATETIME text timestamps (before migration 0001) against integer
+# microsecond timestamps: file size and range-query speed.
+#
+#   cd server && python -m benchmarks.bench_timestamps [rows]
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import database  # noqa: E402
+from models.timestamps import from_micros  # noqa: E402
+
+STREAMS = 5
+AUTHORS = 5000
+START_US = 1_735_725_600_000_000
+
+
+def _fill(path: str, rows: int):
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    database.init_db()
+    database.engine.dispose()
+
+    rng = random.Random(1)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO chat_authors (id, platform, name) VALUES (?, 1, ?)",
+        ((i + 1, f"user{i}") for i in range(AUTHORS)),
+    )
+    conn.executemany(
+        "INSERT INTO twitch_chat_messages (message_group_id, timestamp, stream_id, "
+        "author_ref, message, created_at) VALUES (1, ?, ?, ?, ?, ?)",
+        (
+            (
+                START_US + i * 50_000 + rng.randrange(50_000),
+                i % STREAMS + 1,
+                rng.randrange(AUTHORS) + 1,
+                "some chat message " * rng.randrange(1, 4),
+                START_US + i * 50_000 + 1_000_000,
+            )
+            for i in range(rows)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def _downgrade(path: str, revision: str):
+    from alembic import command
+    from sqlalchemy import create_engine
+
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.connect() as conn:
+        command.downgrade(database._alembic_config(conn), revision)
+        conn.commit()
+    engine.dispose()
+
+
+def _size(path: str) -> int:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("VACUUM")
+    conn.close()
+    return os.path.getsize(path)
+
+
+def _range_query(path: str, as_text: bool, repeats: int = 20) -> float:
+    conn = sqlite3.connect(path)
+    span_us = 60 * 60 * 1_000_000
+    windows = [START_US + k * span_us // 4 for k in range(repeats)]
+    sql = (
+        "SELECT id, timestamp FROM twitch_chat_messages "
+        "WHERE stream_id = ? AND timestamp > ? AND timestamp < ? "
+        "ORDER BY timestamp DESC LIMIT 500"
+    )
+    started = time.perf_counter()
+    for window in windows:
+        low, high = window, window + span_us
+        if as_text:
+            low = str(from_micros(low))
+            high = str(from_micros(high))
+            rows = conn.execute(sql, (1, low, high)).fetchall()
+            [datetime.fromisoformat(ts) for _, ts in rows]
+        else:
+            rows = conn.execute(sql, (1, low, high)).fetchall()
+            [ts for _, ts in rows]
+        conn.execute(
+            "SELECT COUNT(*) FROM twitch_chat_messages "
+            "WHERE stream_id = ? AND timestamp > ? AND timestamp < ?",
+            (1, low, high),
+        ).fetchone()
+    elapsed = (time.perf_counter() - started) / repeats
+    conn.close()
+    return elapsed
+
+
+def main(rows: int):
+    workdir = tempfile.mkdtemp()
+    try:
+        after = os.path.join(workdir, "integer.db")
+        before = os.path.join(workdir, "datetime.db")
+        _fill(after, rows)
+        shutil.copy(after, before)
+        # keep the author columns inline on both sides so only timestamps differ
+        _downgrade(after, "0001")
+        _downgrade(before, "base")
+
+        print(f"{rows} twitch rows across {STREAMS} streams")
+        print(f"{'':10}{'size (MB)':>12}{'range query (ms)':>20}")
+        for label, path, as_text in (("datetime", before, True), ("integer", after, False)):
+            size = _size(path) / 1024 / 1024
+            query_ms = _range_query(path, as_text) * 1000
+            print(f"{label:10}{size:12.2f}{query_ms:20.2f}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500_000)
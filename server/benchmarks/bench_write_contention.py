@@ -0,0 +1,130 @@
+# Write latency under contention: the old string-matching retry loop on
+# deferred transactions against the write coordinator (fair lock, BEGIN
+# IMMEDIATE, jittered backoff). Several threads write small batches, like
+# download handlers flushing while API requests update streams.
+#
+#   cd server && python -m benchmarks.bench_write_contention [threads] [writes]
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+import database  # noqa: E402
+from write_coordinator import WriteCoordinator  # noqa: E402
+
+BATCH = 50
+
+
+def _legacy_retry(func, max_retries=5, base_delay=0.1):
+    for attempt in range(max_retries):
+        try:
+            return func()
+        except Exception as e:
+            if "database is locked" in str(e).lower() and attempt < max_retries - 1:
+                time.sleep(base_delay * (10 * attempt))
+                continue
+            raise
+
+
+def _write(session, n):
+    # read first, then write: the shape of a handler flush
+    session.execute(text("SELECT COUNT(*) FROM counters WHERE id = 1")).scalar()
+    session.execute(
+        text("INSERT INTO items (value) VALUES (:value)"),
+        [{"value": n} for _ in range(BATCH)],
+    )
+    session.execute(text("UPDATE counters SET value = value + :n WHERE id = 1"), {"n": BATCH})
+
+
+def _run(path: str, threads: int, writes: int, coordinated: bool):
+    engine = database._create_sqlite_engine(
+        f"sqlite:///{path}", dict(database.WRITE_ENGINE_DEFAULTS, busy_timeout=1)
+    )
+    factory = sessionmaker(bind=engine)
+    coordinator = WriteCoordinator("bench")
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def worker(n):
+        session = factory()
+        try:
+            for _ in range(writes):
+                started = time.perf_counter()
+                try:
+                    if coordinated:
+                        coordinator.run(session, lambda: _write(session, n))
+                    else:
+                        def attempt():
+                            try:
+                                _write(session, n)
+                                session.commit()
+                            except Exception:
+                                session.rollback()
+                                raise
+                        _legacy_retry(attempt)
+                except Exception as e:
+                    with lock:
+                        failures.append(e)
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+        finally:
+            session.close()
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    engine.dispose()
+    return sorted(latencies), len(failures), elapsed
+
+
+def _prepare(path: str):
+    engine = database._create_sqlite_engine(f"sqlite:///{path}")
+    with engine.connect() as conn:
+        conn.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY, value INTEGER)"))
+        conn.execute(text("CREATE TABLE counters (id INTEGER PRIMARY KEY, value INTEGER)"))
+        conn.execute(text("INSERT INTO counters VALUES (1, 0)"))
+        conn.commit()
+    engine.dispose()
+
+
+def _ms(latencies, fraction):
+    if not latencies:
+        return float("nan")
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000
+
+
+def main(threads: int, writes: int):
+    workdir = tempfile.mkdtemp()
+    try:
+        print(f"{threads} threads x {writes} writes of {BATCH} rows")
+        print(f"{'':14}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'failed':>8}{'total s':>10}")
+        for label, coordinated in (("string retry", False), ("coordinator", True)):
+            path = os.path.join(workdir, f"{label.replace(' ', '_')}.db")
+            _prepare(path)
+            latencies, failed, elapsed = _run(path, threads, writes, coordinated)
+            print(
+                f"{label:14}{_ms(latencies, 0.5):10.1f}{_ms(latencies, 0.99):10.1f}"
+                f"{_ms(latencies, 1.0):10.1f}{failed:8}{elapsed:10.2f}"
+            )
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 16,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 200,
+    )
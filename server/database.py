@@ -1,13 +1,68 @@
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
-from models.schema import Base
+from sqlalchemy import create_engine, event, inspect, make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker, Session
+from models.schema import (
+    Base,
+    ChatAuthor,
+    TwitchChatMessage,
+    TwitchChatMessageStaging,
+    YouTubeChatMessage,
+    YouTubeChatMessageStaging,
+)
+from collections import OrderedDict
+from contextlib import contextmanager
+from write_coordinator import WriteCoordinator, backoff_delay, is_lock_error
+import metrics
+import query_log
 
+import pathlib
 import sys
 import os
+import tempfile
+import threading
 import time
 
 engine = None
 SessionLocal = None
+read_engine = None
+ReadSessionLocal = None
+shards = None
+# per-stream message spools, see models.spool
+spool_dir = None
+
+_coordinators = {}
+_coordinators_lock = threading.Lock()
+
+STORAGE_MODE_SINGLE = "single"
+STORAGE_MODE_SHARDED = "sharded"
+
+# tables that move into per-stream files in sharded mode
+SHARDED_TABLES = [
+    ChatAuthor.__table__,
+    TwitchChatMessage.__table__,
+    YouTubeChatMessage.__table__,
+    TwitchChatMessageStaging,
+    YouTubeChatMessageStaging,
+]
+
+# every value can be overridden per engine, e.g. DB_READ_POOL_SIZE or DB_WRITE_CACHE_SIZE
+WRITE_ENGINE_DEFAULTS = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "busy_timeout": 30,
+    "cache_size": 10000,
+    "mmap_size": 134217728,
+}
+READ_ENGINE_DEFAULTS = {
+    "pool_size": 8,
+    "max_overflow": 8,
+    "busy_timeout": 30,
+    "cache_size": 20000,
+    "mmap_size": 268435456,
+}
+# shard engines stay small, one is open per cached stream
+SHARD_WRITE_SETTINGS = dict(WRITE_ENGINE_DEFAULTS, pool_size=1, max_overflow=4)
+SHARD_READ_SETTINGS = dict(READ_ENGINE_DEFAULTS, pool_size=1, max_overflow=4)
 
 def get_db():
     db = SessionLocal()
@@ -16,54 +71,304 @@ def get_db():
     finally:
         db.close()
 
-def init_db():
-    global engine, SessionLocal
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
 
-    SQLALCHEMY_DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./../sql_app.db")
+def engine_settings(prefix: str, defaults: dict) -> dict:
+    return {
+        name: int(os.environ.get(f"{prefix}{name.upper()}", value))
+        for name, value in defaults.items()
+    }
+
+def _sqlite_pragmas(settings: dict, read_only: bool):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        else:
+            # only takes effect on a fresh file, so it has to run before journal_mode
+            # writes the first page
+            cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA cache_size={settings['cache_size']}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute(f"PRAGMA mmap_size={settings['mmap_size']}")
+        cursor.close()
+    return set_pragmas
 
-    print(f"Using database: {SQLALCHEMY_DATABASE_URL}")
+def _begin_read_snapshot(conn):
+    # one snapshot per session, so a page and its total count agree
+    conn.exec_driver_sql("BEGIN")
 
-    engine = create_engine(
-        SQLALCHEMY_DATABASE_URL,
-        connect_args={
-            "check_same_thread": False,
-            "timeout": 30,
-            "isolation_level": None
-        },
+def _is_file_url(url: str) -> bool:
+    database = make_url(url).database
+    return bool(database) and database != ":memory:"
+
+def _create_sqlite_engine(url: str, settings: dict = None, read_only: bool = False):
+    settings = settings or WRITE_ENGINE_DEFAULTS
+    connect_args = {
+        "check_same_thread": False,
+        "timeout": settings["busy_timeout"],
+    }
+    # writers keep the driver's transaction handling: BEGIN is issued before
+    # the first write, so reads earlier in a session never pin an old snapshot
+    if read_only:
+        connect_args["isolation_level"] = None
+    pool_args = (
+        {"pool_size": settings["pool_size"], "max_overflow": settings["max_overflow"]}
+        if _is_file_url(url)
+        else {}
+    )
+    new_engine = create_engine(
+        url,
+        connect_args=connect_args,
         pool_pre_ping=True,
         pool_recycle=3600,
-        echo=False
+        echo=False,
+        **pool_args
     )
+    event.listen(new_engine, "connect", _sqlite_pragmas(settings, read_only))
+    if read_only:
+        event.listen(new_engine, "begin", _begin_read_snapshot)
+    query_log.log.install(new_engine)
+    return new_engine
 
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def read_only_url(url: str):
+    if not _is_file_url(url):
+        return None
+    uri = pathlib.Path(make_url(url).database).resolve().as_uri()
+    return f"sqlite:///{uri}?mode=ro&uri=true"
+
+def _alembic_config(connection):
+    from alembic.config import Config
+
+    base_dir = getattr(sys, "_MEIPASS", os.path.dirname(os.path.abspath(__file__)))
+    config = Config(os.path.join(base_dir, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(base_dir, "alembic"))
+    config.attributes["connection"] = connection
+    return config
+
+def _init_schema(target_engine, tables=None):
+    from alembic import command
+
+    with target_engine.connect() as conn:
+        existing_tables = set(inspect(conn).get_table_names())
+        config = _alembic_config(conn)
+
+        if existing_tables:
+            # files created before migrations existed have no alembic_version
+            # table and are upgraded from the base revision
+            command.upgrade(config, "head")
+
+        Base.metadata.create_all(bind=conn, tables=tables)
+
+        if not existing_tables:
+            command.stamp(config, "head")
+        conn.commit()
+
+
+class ShardCache:
+    def __init__(self, directory: str, capacity: int):
+        self.directory = directory
+        self.capacity = capacity
+        self.handles = OrderedDict()
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, stream_id: int) -> str:
+        return os.path.join(self.directory, f"stream_{stream_id}.db")
+
+    def sessionmaker(self, stream_id: int, read_only: bool = False):
+        with self.lock:
+            handle = self.handles.get(stream_id)
+            if handle:
+                self.handles.move_to_end(stream_id)
+                return handle[3] if read_only else handle[1]
+
+            url = f"sqlite:///{self.path(stream_id)}"
+            shard_engine = _create_sqlite_engine(url, SHARD_WRITE_SETTINGS)
+            _init_schema(shard_engine, SHARDED_TABLES)
+            factory = sessionmaker(autocommit=False, autoflush=False, bind=shard_engine)
+            shard_read_engine = _create_sqlite_engine(
+                read_only_url(url), SHARD_READ_SETTINGS, read_only=True
+            )
+            read_factory = sessionmaker(autocommit=False, autoflush=False, bind=shard_read_engine)
+            self.handles[stream_id] = (shard_engine, factory, shard_read_engine, read_factory)
+
+            while len(self.handles) > self.capacity:
+                _, old_handle = self.handles.popitem(last=False)
+                _dispose_handle(old_handle)
+            return read_factory if read_only else factory
+
+    def drop(self, stream_id: int, max_retries: int = 10, delay: float = 0.5):
+        with self.lock:
+            handle = self.handles.pop(stream_id, None)
+        if handle:
+            _dispose_handle(handle)
 
+        for suffix in ("", "-wal", "-shm"):
+            path = self.path(stream_id) + suffix
+            for attempt in range(max_retries):
+                try:
+                    os.remove(path)
+                    break
+                except FileNotFoundError:
+                    break
+                except PermissionError:
+                    # windows refuses to unlink while a stopping download still has it open
+                    if attempt == max_retries - 1:
+                        raise
+                    time.sleep(delay)
+
+    def close(self):
+        with self.lock:
+            for handle in self.handles.values():
+                _dispose_handle(handle)
+            self.handles.clear()
+
+
+def _dispose_handle(handle):
+    handle[2].dispose()
+    handle[0].dispose()
+
+
+def is_sharded() -> bool:
+    return shards is not None
+
+def open_message_db(stream_id: int, read_only: bool = False):
+    if shards is None:
+        return None
+    return shards.sessionmaker(stream_id, read_only)()
+
+@contextmanager
+def message_session(stream_id: int, db: Session, read_only: bool = False):
+    shard_db = open_message_db(stream_id, read_only)
+    if shard_db is None:
+        yield db
+        return
     try:
-        Base.metadata.create_all(bind=engine)
+        yield shard_db
+    finally:
+        shard_db.close()
+
+def init_db():
+    global engine, SessionLocal, read_engine, ReadSessionLocal, shards, spool_dir
+
+    SQLALCHEMY_DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./../sql_app.db")
+    storage_mode = os.environ.get("STORAGE_MODE", STORAGE_MODE_SINGLE).lower()
+
+    print(f"Using database: {SQLALCHEMY_DATABASE_URL} ({storage_mode} storage)")
 
-        with engine.connect() as conn:
-            conn.execute(text("PRAGMA journal_mode=WAL"))
-            conn.execute(text("PRAGMA synchronous=NORMAL"))
-            conn.execute(text("PRAGMA cache_size=10000"))
-            conn.execute(text("PRAGMA temp_store=MEMORY"))
-            conn.execute(text("PRAGMA mmap_size=134217728"))
-            conn.commit()
+    engine = _create_sqlite_engine(
+        SQLALCHEMY_DATABASE_URL, engine_settings("DB_WRITE_", WRITE_ENGINE_DEFAULTS)
+    )
+
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    if shards:
+        shards.close()
+    shards = None
+    if storage_mode == STORAGE_MODE_SHARDED:
+        db_path = make_url(SQLALCHEMY_DATABASE_URL).database
+        shard_dir = os.environ.get(
+            "SHARD_DIR",
+            os.path.join(os.path.dirname(os.path.abspath(db_path)), "shards"),
+        )
+        shards = ShardCache(shard_dir, int(os.environ.get("SHARD_CACHE_SIZE", "32")))
+
+    db_path = make_url(SQLALCHEMY_DATABASE_URL).database
+    if "SPOOL_DIR" in os.environ:
+        spool_dir = os.environ["SPOOL_DIR"]
+    elif db_path and db_path != ":memory:":
+        spool_dir = os.path.join(os.path.dirname(os.path.abspath(db_path)), "spool")
+    else:
+        # nothing to replay into after a restart, the spool only has to outlive the batch
+        spool_dir = tempfile.mkdtemp(prefix="chat-spool-")
+
+    try:
+        catalog_tables = (
+            [t for t in Base.metadata.sorted_tables if t not in SHARDED_TABLES]
+            if shards
+            else None
+        )
+        _init_schema(engine, catalog_tables)
 
         print("Db init success")
     except Exception as e:
         print(f"Db init error {e}")
+
+    # created after the schema exists, read-only connections cannot create the file
+    url = read_only_url(SQLALCHEMY_DATABASE_URL)
+    read_engine = (
+        _create_sqlite_engine(
+            url, engine_settings("DB_READ_", READ_ENGINE_DEFAULTS), read_only=True
+        )
+        if url
+        else engine
+    )
+    ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
     return
 
-def db_retry_on_lock(func, max_retries=5, base_delay=0.1):
+def close_db():
+    global shards
+    if shards:
+        shards.close()
+    shards = None
+    if read_engine is not None and read_engine is not engine:
+        read_engine.dispose()
+    if engine is not None:
+        engine.dispose()
+
+def write_coordinator(session: Session) -> WriteCoordinator:
+    # one coordinator per database file, shards each get their own
+    name = session.get_bind().engine.url.database or ":memory:"
+    with _coordinators_lock:
+        coordinator = _coordinators.get(name)
+        if coordinator is None:
+            coordinator = WriteCoordinator(name)
+            _coordinators[name] = coordinator
+        return coordinator
+
+def run_write(session: Session, operation, owner=None, on_rollback=None):
+    return write_coordinator(session).run(session, operation, owner, on_rollback)
+
+def write_stats() -> dict:
+    with _coordinators_lock:
+        return {name: c.stats() for name, c in _coordinators.items()}
+
+def file_sizes() -> dict:
+    sizes = {}
+    path = engine.url.database if engine is not None else None
+    if path and path != ":memory:":
+        for label, suffix in (("main", ""), ("wal", "-wal")):
+            try:
+                sizes[label] = os.path.getsize(path + suffix)
+            except OSError:
+                sizes[label] = 0
+    if shards is not None:
+        total = 0
+        with os.scandir(shards.directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    total += entry.stat().st_size
+        sizes["shards"] = total
+    return sizes
+
+def db_retry_on_lock(func, max_retries=5, base_delay=0.05, max_delay=1.0):
+    # for reads only, writes go through run_write
     for attempt in range(max_retries):
         try:
             return func()
-        except Exception as e:
-            if "database is locked" in str(e).lower() and attempt < max_retries - 1:
-                delay = base_delay * (10 * attempt)
-                print(f"Database locked, retrying in {delay}s (attempt {attempt + 1}/{max_retries})")
-                sys.stdout.flush()
-                time.sleep(delay)
-                continue
-            else:
-                raise e
-    return None
+        except OperationalError as e:
+            if not is_lock_error(e) or attempt == max_retries - 1:
+                raise
+            delay = backoff_delay(attempt + 1, base_delay, max_delay)
+            metrics.read_retries.inc()
+            print(f"Database locked, retrying in {delay:.2f}s (attempt {attempt + 1}/{max_retries})")
+            sys.stdout.flush()
+            time.sleep(delay)
@@ -0,0 +1,76 @@
+# Imports chat_downloader JSON or NDJSON dumps as streams, without downloading
+# them again. Files are parsed incrementally, so size does not matter.
+#
+#   cd server && python -m import_chat dump.json [--url URL] [--platform twitch|youtube] [--title TITLE]
+import argparse
+import os
+import sys
+import time
+
+import database
+from models.dicts import PlatformType, get_platform
+from models.importer import MessageReader, run_import
+
+
+def _progress(total_bytes: int):
+    started = time.monotonic()
+
+    def report(reader: MessageReader, imported: int):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        share = f"{reader.bytes_read / total_bytes:6.1%}" if total_bytes else "     ?"
+        print(
+            f"{share}  {reader.bytes_read / 1024 / 1024:9.1f} MB  "
+            f"{imported:10d} messages  {imported / elapsed:8.0f} msg/s"
+        )
+        sys.stdout.flush()
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import chat_downloader dumps")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--url", help="stream url, also decides the platform")
+    parser.add_argument("--platform", choices=["twitch", "youtube"], help="guessed from the messages when left out")
+    parser.add_argument("--title", help="defaults to the file name")
+    args = parser.parse_args(argv)
+
+    if args.platform:
+        platform = PlatformType[args.platform.upper()]
+    elif args.url:
+        try:
+            platform = get_platform(args.url)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        platform = None
+
+    database.init_db()
+    db = database.SessionLocal()
+    failed = False
+    try:
+        for path in args.paths:
+            print(f"Importing {path}")
+            try:
+                with open(path, "rb") as f:
+                    stream_id = run_import(
+                        db,
+                        f,
+                        url=args.url,
+                        platform=platform,
+                        title=args.title or os.path.basename(path),
+                        progress=_progress(os.path.getsize(path)),
+                    )
+                print(f"Imported {path} as stream {stream_id}")
+            except Exception as e:
+                failed = True
+                print(f"Error importing {path}: {e}", file=sys.stderr)
+                db.rollback()
+    finally:
+        db.close()
+        database.close_db()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,49 +1,89 @@
 from fastapi import FastAPI, Depends, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy import exists, update
 from sqlalchemy.orm import Session
-from chat_downloader import ChatDownloader
 from contextlib import asynccontextmanager
+from anyio import to_thread
 from typing import Dict
 import database
-from models.schema import Stream, TwitchChatMessage, YouTubeChatMessage
+import metrics
+import query_log
+import startup
+from models.schema import AlertHit, AlertRule, DownloadJob, Stream
 from models.dicts import (
     PlatformType,
-    message_groups_by_platform,
     DownloadStatus,
+    JobState,
     MessageGroup,
+    get_platform,
 )
 from typing import List
 from datetime import datetime
 from pydantic import BaseModel
 from models.tw_data_handler import TwitchDataHandler
 from models.yt_data_handler import YouTubeDataHandler
+from models.base_data_handler import BaseDataHandler
+from models.flush_policy import AdaptiveFlushPolicy
+from models.queries import (
+    get_model_class,
+    parse_message_group_ids,
+    build_messages_query,
+)
+from models.timestamps import from_micros
+from models.stream_purge import run_purge
+from models.staging import merge_staged_messages
+from models import alerts, duplicates, facets, importer, ingest_process, jobs, revenue, search, spool, timeline
 from typing import Optional
 
+import asyncio
+import tempfile
 import threading
+import time
 import sys
 import os
-import json
-import csv
-import io
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("starting up...")
-    database.init_db()
-    db = database.SessionLocal()
-    try:
+    # sync endpoints, sync dependencies and streamed exports all share this pool
+    to_thread.current_default_thread_limiter().total_tokens = API_THREADS
+    db = None
+
+    def open_database():
+        nonlocal db
+        database.init_db()
+        db = database.SessionLocal()
         print("Database initialization completed successfully")
-        cleanup_running_streams(db)
+
+    # /health answers while these run, other requests wait for them
+    startup.state.start(
+        [
+            ("database", open_database),
+            ("merge_interrupted_downloads", lambda: merge_interrupted_downloads(db)),
+            ("alert_rules", lambda: alerts.rules.refresh(db, force=True)),
+            ("author_index", lambda: search.index_missing_authors(db)),
+            ("revenue_totals", lambda: revenue.index_missing_revenue(db)),
+            ("replay_spools", lambda: replay_spools(db)),
+            ("cleanup_running_streams", lambda: cleanup_running_streams(db)),
+            ("resume_pending_deletions", lambda: resume_pending_deletions(db)),
+            ("job_worker", job_worker.start),
+        ]
+    )
+    try:
         yield
     finally:
         print("Shutting down...")
-        db.close()
+        await startup.state.wait()
+        job_worker.stop()
+        if db is not None:
+            db.close()
 
 
 app = FastAPI(lifespan=lifespan)
 log_path = os.environ.get("LOG_FILE_PATH")
+app.add_middleware(startup.StartupGateMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -52,15 +92,139 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["filename"],
 )
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
+API_THREADS = int(os.environ.get("API_THREADS", "16"))
+# an alert event stream looks for hits committed by other processes this often
+ALERT_EVENTS_POLL = float(os.environ.get("ALERT_EVENTS_POLL", "1"))
+ALERT_EVENTS_KEEPALIVE = 15
+
+running_handlers: Dict[int, BaseDataHandler] = {}
+# downloads are jobs in the database, any process running a worker may claim them
+job_worker = jobs.JobWorker(
+    lambda: database.SessionLocal(),
+    lambda stream_id, stop_event: start_download(stream_id, stop_event),
+)
+
+
+def _active_downloads():
+    count = sum(1 for t in threading.enumerate() if t.name.startswith("download-"))
+    yield (), count
+
+
+def _pending_messages():
+    pending = {}
+    for handler in list(metrics.pending_handlers):
+        for stream_id, count in dict(handler.stream_message_counts).items():
+            pending[stream_id] = pending.get(stream_id, 0) + count
+    for stream_id, count in sorted(pending.items()):
+        yield (str(stream_id),), count
+
+
+def _write_stat(key):
+    def collect():
+        for name, stats in sorted(database.write_stats().items()):
+            yield (name,), stats[key]
+    return collect
 
-running_chats: Dict[str, threading.Event] = {}
+
+def _flush_policy_state(key):
+    def collect():
+        for stream_id, handler in sorted(running_handlers.items()):
+            yield (str(stream_id),), handler.policy.state()[key]
+    return collect
+
+
+def _file_sizes():
+    for label, size in database.file_sizes().items():
+        yield (label,), size
+
+
+metrics.callback(
+    "chat_active_downloads", "Running download threads", [], _active_downloads
+)
+metrics.callback(
+    "chat_pending_messages",
+    "Messages queued in handlers and not yet flushed",
+    ["stream_id"],
+    _pending_messages,
+)
+metrics.callback(
+    "db_write_attempts_total",
+    "Transactions begun by the write coordinator, retries included",
+    ["database"],
+    _write_stat("attempts"),
+    "counter",
+)
+metrics.callback(
+    "db_write_transactions_total",
+    "Transactions committed through the write coordinator",
+    ["database"],
+    _write_stat("transactions"),
+    "counter",
+)
+metrics.callback(
+    "db_write_retries_total",
+    "Write coordinator retries after SQLITE_BUSY/SQLITE_LOCKED",
+    ["database"],
+    _write_stat("retries"),
+    "counter",
+)
+metrics.callback(
+    "db_write_failures_total",
+    "Write transactions that gave up",
+    ["database"],
+    _write_stat("failures"),
+    "counter",
+)
+metrics.callback(
+    "db_write_lock_wait_seconds_total",
+    "Time spent waiting for the write lock",
+    ["database"],
+    _write_stat("wait_seconds_total"),
+    "counter",
+)
+metrics.callback(
+    "db_write_lock_queue",
+    "Writers waiting for or holding the write lock",
+    ["database"],
+    _write_stat("queued"),
+)
+metrics.callback(
+    "chat_flush_target_batch_size",
+    "Batch size the flush policy currently aims for",
+    ["stream_id"],
+    _flush_policy_state("batch_size"),
+)
+metrics.callback(
+    "chat_flush_linger_seconds",
+    "How long the flush policy currently lets a message wait",
+    ["stream_id"],
+    _flush_policy_state("linger"),
+)
+metrics.callback(
+    "chat_ingest_rate",
+    "Smoothed messages per second seen by the flush policy",
+    ["stream_id"],
+    _flush_policy_state("rate"),
+)
+metrics.callback(
+    "db_file_size_bytes", "Size of the database files", ["file"], _file_sizes
+)
 
 
 def cleanup_running_streams(db: Session):
-    try:
+    def cleanup():
+        # streams with a job to run are claimed again by a worker
         downloading_streams = (
             db.query(Stream)
-            .filter(Stream.download_status == DownloadStatus.DOWNLOADING.value)
+            .filter(
+                Stream.download_status == DownloadStatus.DOWNLOADING.value,
+                ~exists().where(
+                    DownloadJob.stream_id == Stream.id,
+                    DownloadJob.desired_state == JobState.RUN.value,
+                ),
+            )
             .all()
         )
 
@@ -74,19 +238,177 @@ def cleanup_running_streams(db: Session):
                 stream.updated_at = datetime.now()
                 stream.resume_timestamp = None
                 print(f"Stopped past stream on startup: {stream.url}")
+        return len(downloading_streams)
 
-        db.commit()
-        print(f"Cleaned up {len(downloading_streams)} streams on startup")
+    try:
+        cleaned = database.run_write(db, cleanup, "startup")
+        print(f"Cleaned up {cleaned} streams on startup")
     except Exception as e:
         print(f"Error during startup cleanup: {e}", file=sys.stderr)
-        db.rollback()
+    finally:
+        sys.stdout.flush()
+
+
+def merge_interrupted_downloads(db: Session):
+    try:
+        streams = (
+            db.query(Stream)
+            .filter(Stream.download_status == DownloadStatus.DOWNLOADING.value)
+            .all()
+        )
+        for stream in streams:
+            with database.message_session(stream.id, db) as message_db:
+                merged = database.run_write(
+                    message_db,
+                    lambda: merge_staged_messages(
+                        message_db, get_model_class(stream.platform), stream.id
+                    ),
+                    "startup",
+                )
+            if merged:
+                print(f"Merged {merged} staged messages for stream {stream.id}")
+    except Exception as e:
+        print(f"Error merging staged messages: {e}", file=sys.stderr)
+    finally:
+        sys.stdout.flush()
+
+
+def get_handler_class(platform: PlatformType):
+    return TwitchDataHandler if platform == PlatformType.TWITCH else YouTubeDataHandler
+
+
+def replay_spools(db: Session):
+    # messages a crash left in the spool, everything after the stream's checkpoint
+    try:
+        names = os.listdir(database.spool_dir)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if not name.startswith("stream_"):
+            continue
+        stream_id = int(name[len("stream_"):])
+        try:
+            stream = db.get(Stream, stream_id)
+            if not stream or stream.download_status == DownloadStatus.DELETING.value:
+                spool.remove_stream(database.spool_dir, stream_id)
+                continue
+            checkpoint = (
+                (stream.spool_segment, stream.spool_offset)
+                if stream.spool_segment is not None
+                else None
+            )
+            handler_class = get_handler_class(PlatformType(stream.platform))
+            db.expunge(stream)
+            # a worker elsewhere holding the job is consuming this spool itself
+            leased = jobs.get_job(db, stream_id) is not None
+            if leased and not database.run_write(
+                db, lambda: jobs.acquire(db, job_worker.owner, stream_id), "startup"
+            ):
+                continue
+            try:
+                with database.message_session(stream_id, db) as message_db:
+                    handler = handler_class(db, message_db=message_db)
+                    reader = spool.SpoolReader(
+                        spool.stream_directory(database.spool_dir, stream_id), checkpoint
+                    )
+                    replayed = 0
+                    for message, position in reader.read():
+                        handler.track_timestamp(stream_id, message.get("timestamp"))
+                        handler.track_spool_position(stream_id, position)
+                        handler.save_message(message, stream_id)
+                        replayed += 1
+                    handler.close()
+            finally:
+                if leased:
+                    database.run_write(
+                        db,
+                        lambda: jobs.release(db, job_worker.owner, stream_id, finished=False),
+                        "startup",
+                    )
+            if handler.message_batch:
+                print(f"Could not replay the spool of stream {stream_id}, keeping it", file=sys.stderr)
+                continue
+            spool.remove_stream(database.spool_dir, stream_id)
+            if replayed:
+                print(f"Replayed {replayed} spooled messages for stream {stream_id}")
+        except Exception as e:
+            print(f"Error replaying spool for stream {stream_id}: {e}", file=sys.stderr)
+    sys.stdout.flush()
+
+
+def start_purge(stream_id: int):
+    thread = threading.Thread(
+        target=run_purge, args=(database.SessionLocal, stream_id), daemon=True
+    )
+    thread.start()
+
+
+def resume_pending_deletions(db: Session):
+    try:
+        deleting_streams = (
+            db.query(Stream.id)
+            .filter(Stream.download_status == DownloadStatus.DELETING.value)
+            .all()
+        )
+        for (stream_id,) in deleting_streams:
+            print(f"Resuming deletion of stream {stream_id}")
+            start_purge(stream_id)
+    except Exception as e:
+        print(f"Error resuming stream deletions: {e}", file=sys.stderr)
     finally:
         sys.stdout.flush()
 
 
 @app.get("/health")
 async def health_check(request: Request):
-    return {"status": "ok", "log_file": log_path}
+    # "starting" while the startup steps run, the app may show itself already
+    status = startup.state.status
+    body = {"status": status, "log_file": log_path, "startup": startup.state.timings}
+    return JSONResponse(body, status_code=503 if status == "error" else 200)
+
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+class SlowQueryConfig(BaseModel):
+    threshold_ms: Optional[float] = None
+    sample_rate: Optional[float] = None
+    size: Optional[int] = None
+
+
+def slow_query_state():
+    log = query_log.log
+    return {
+        "threshold_ms": log.threshold_ms,
+        "sample_rate": log.sample_rate,
+        "size": log.size,
+        "queries": log.snapshot(),
+    }
+
+
+@app.get("/debug/slow-queries")
+def get_slow_queries():
+    return slow_query_state()
+
+
+@app.patch("/debug/slow-queries")
+def configure_slow_queries(config: SlowQueryConfig):
+    if config.threshold_ms is not None and config.threshold_ms < 0:
+        raise HTTPException(status_code=400, detail="threshold_ms must not be negative")
+    if config.sample_rate is not None and not 0 <= config.sample_rate <= 1:
+        raise HTTPException(status_code=400, detail="sample_rate must be between 0 and 1")
+    if config.size is not None and config.size < 1:
+        raise HTTPException(status_code=400, detail="size must be positive")
+    query_log.log.configure(config.threshold_ms, config.sample_rate, config.size)
+    return slow_query_state()
+
+
+@app.delete("/debug/slow-queries")
+def clear_slow_queries():
+    query_log.log.clear()
+    return {"status": "cleared"}
 
 
 class StreamRequest(BaseModel):
@@ -124,18 +446,51 @@ class MessagesResponse(BaseModel):
     pagination: PaginationInfo
 
 
-def get_platform(url: str) -> PlatformType:
-    url = url.lower()
-    if "twitch.tv" in url:
-        return PlatformType.TWITCH
-    elif "youtube.com" in url:
-        return PlatformType.YOUTUBE
-    else:
-        raise ValueError("Unsupported platform")
+def update_stream(db: Session, stream_id: int, values: dict):
+    db.execute(update(Stream).where(Stream.id == stream_id).values(**values))
+
+
+def download_in_thread(
+    chat,
+    chat_handler: BaseDataHandler,
+    spool_dir: str,
+    checkpoint,
+    first_segment: int,
+    stream_id: int,
+    stop_event: threading.Event,
+):
+    # this thread only appends to the spool, the consumer writes to the
+    # database and is the only one using the sessions until it exits
+    writer = spool.SpoolWriter(spool_dir, first_segment)
+    # reads what a failed run left behind, then goes on into the new segments
+    reader = spool.SpoolReader(spool_dir, checkpoint)
+    consumer_errors = []
+
+    def consume():
+        try:
+            spool.consume(chat_handler, reader, writer, stream_id)
+        except Exception as e:
+            consumer_errors.append(e)
+
+    consumer = threading.Thread(
+        target=consume, name=f"spool-consumer-{stream_id}", daemon=True
+    )
+    consumer.start()
+    try:
+        for message in chat:
+            if stop_event.is_set() or consumer_errors:
+                break
+            writer.append(message)
+    finally:
+        writer.close()
+        consumer.join()
+    if consumer_errors:
+        raise consumer_errors[0]
 
 
 def start_download(stream_id: int, stop_event: threading.Event):
     db = database.SessionLocal()
+    stream_url = None
     try:
         stream = db.query(Stream).filter(Stream.id == stream_id).first()
         if not stream:
@@ -145,69 +500,123 @@ def start_download(stream_id: int, stop_event: threading.Event):
             )
             return
 
+        # the download can run for days, keep plain values instead of the orm row
+        stream_url = stream.url
         platform = PlatformType(stream.platform)
-        chat_handler = (
-            TwitchDataHandler(db)
-            if platform == PlatformType.TWITCH
-            else YouTubeDataHandler(db)
+        policy = AdaptiveFlushPolicy(stream.flush_max_delay, stream.flush_max_batch)
+        checkpoint = (
+            (stream.spool_segment, stream.spool_offset)
+            if stream.spool_segment is not None
+            else None
         )
-
-        chat = ChatDownloader().get_chat(
-            stream.url,
-            message_groups=message_groups_by_platform[platform],
-            interruptible_retry=False,
-            retry_timeout=32,
-            max_attempts=1000,
+        db.expunge(stream)
+        del stream
+
+        spool_dir = spool.stream_directory(database.spool_dir, stream_id)
+        # segments a failed run left behind come first, new ones start after them
+        first_segment = max(
+            [checkpoint[0] + 1 if checkpoint else 0]
+            + [segment + 1 for segment in spool.list_segments(spool_dir)]
         )
-
-        stream.title = chat.title
-        stream.stream_id = chat.id
-        stream.status = chat.status
-        stream.duration = chat.duration
-        stream.download_status = DownloadStatus.DOWNLOADING.value
-        db.commit()
-
-        for message in chat:
-            if stop_event.is_set():
-                break
-            if "timestamp" in message:
-                stream.last_message_timestamp = datetime.fromtimestamp(
-                    message.get("timestamp") / 1_000_000
-                )
-            chat_handler.save_message(message, stream.id)
-
-        if stop_event.is_set():
-            stream.resume_timestamp = stream.last_message_timestamp
-            print("Stream paused")
+        ingest = None
+        if ingest_process.INGEST_MODE == "process":
+            ingest = ingest_process.ProcessIngest(
+                stream_id, stream_url, platform.value, spool_dir, first_segment
+            )
+            chat = ingest.started(stop_event)
+            if chat is None:
+                return
         else:
-            running_chats.pop(stream.url, None)
-            stream.download_status = DownloadStatus.COMPLETED.value
-            print("Stream completed")
+            # chat_downloader is only imported by the first download
+            chat = ingest_process.get_chat(stream_url, platform.value)
+
+        # past broadcasts arrive as fast as we can write them, so they go
+        # through the staging table and get indexed in sorted batches
+        message_db = database.open_message_db(stream_id)
+        chat_handler = get_handler_class(platform)(
+            db, message_db=message_db, bulk=chat.status == "past", policy=policy
+        )
+        running_handlers[stream_id] = chat_handler
+
+        owner = f"download:{stream_id}"
+        database.run_write(
+            db,
+            lambda: update_stream(
+                db,
+                stream_id,
+                {
+                    "title": chat.title,
+                    "stream_id": chat.id,
+                    "status": chat.status,
+                    "duration": chat.duration,
+                    "download_status": DownloadStatus.DOWNLOADING.value,
+                },
+            ),
+            owner,
+        )
 
-        stream.updated_at = datetime.now()
-        db.commit()
+        if ingest:
+            leftover = spool.SpoolReader(spool_dir, checkpoint, until=first_segment)
+            while not spool.drain(chat_handler, leftover, stream_id):
+                chat_handler.flush_batch()
+            # the child fetches, spools and normalizes, we only write
+            ingest.consume(chat_handler, stop_event)
+            ingest.close()
+            finished_cleanly = ingest.finished
+        else:
+            download_in_thread(
+                chat, chat_handler, spool_dir, checkpoint, first_segment, stream_id, stop_event
+            )
+            finished_cleanly = True
+        if finished_cleanly:
+            # everything is committed, the next download starts a new segment
+            spool.remove_stream(database.spool_dir, stream_id)
+        paused = stop_event.is_set()
+
+        finished = {"updated_at": datetime.now()}
+        if paused:
+            finished["resume_timestamp"] = Stream.last_message_timestamp
+        else:
+            finished["download_status"] = DownloadStatus.COMPLETED.value
+        database.run_write(db, lambda: update_stream(db, stream_id, finished), owner)
+        print("Stream paused" if paused else "Stream completed")
 
     except Exception as e:
         error_msg = f"Error in chat downloader for stream {stream_id}: {e}"
         print(error_msg, file=sys.stderr)
-        if stream:
-            running_chats.pop(stream.url, None)
-            stream.download_status = DownloadStatus.ERROR.value
-            stream.error = str(e)
-            stream.updated_at = datetime.now()
-            db.commit()
+        # whatever is spooled but not committed is replayed on the next start
+        if "ingest" in locals() and ingest:
+            ingest.close()
+        if stream_url:
+            database.run_write(
+                db,
+                lambda: update_stream(
+                    db,
+                    stream_id,
+                    {
+                        "download_status": DownloadStatus.ERROR.value,
+                        "error": str(e),
+                        "updated_at": datetime.now(),
+                    },
+                ),
+                f"download:{stream_id}",
+            )
     finally:
         print(f"Cleaning up resources for stream {stream_id}")
         sys.stdout.flush()
         if "chat_handler" in locals() and chat_handler:
+            running_handlers.pop(stream_id, None)
             chat_handler.close()
         db.close()
 
 
 @app.get("/streams/", response_model=List[StreamResponse])
-async def get_streams(db: Session = Depends(database.get_db)):
+def get_streams(db: Session = Depends(database.get_read_db)):
     return database.db_retry_on_lock(
-        lambda: db.query(Stream).order_by(Stream.created_at.desc()).all()
+        lambda: db.query(Stream)
+        .filter(Stream.download_status != DownloadStatus.DELETING.value)
+        .order_by(Stream.created_at.desc())
+        .all()
     )
 
 
@@ -216,16 +625,21 @@ class StreamUpdateRequest(BaseModel):
 
 
 @app.post("/streams/status", response_model=List[StreamResponse])
-async def update_streams(
-    request: StreamUpdateRequest, db: Session = Depends(database.get_db)
+def update_streams(
+    request: StreamUpdateRequest, db: Session = Depends(database.get_read_db)
 ):
     return database.db_retry_on_lock(
-        lambda: db.query(Stream).filter(Stream.id.in_(request.stream_ids)).all()
+        lambda: db.query(Stream)
+        .filter(
+            Stream.id.in_(request.stream_ids),
+            Stream.download_status != DownloadStatus.DELETING.value,
+        )
+        .all()
     )
 
 
 @app.post("/streams/", response_model=StreamResponse)
-async def create_stream(request: StreamRequest, db: Session = Depends(database.get_db)):
+def create_stream(request: StreamRequest, db: Session = Depends(database.get_db)):
     try:
         platform = get_platform(request.url)
     except ValueError as e:
@@ -247,84 +661,349 @@ async def create_stream(request: StreamRequest, db: Session = Depends(database.g
         created_at=datetime.now(),
         updated_at=datetime.now(),
     )
-    db.add(stream)
-    db.commit()
-    db.refresh(stream)
 
-    stop_event = threading.Event()
-    running_chats[request.url] = stop_event
-    thread = threading.Thread(
-        target=start_download, args=(stream.id, stop_event), daemon=True
-    )
-    thread.start()
+    def add_stream():
+        db.add(stream)
+        db.flush()
+        jobs.request_state(db, stream.id, JobState.RUN)
+
+    database.run_write(db, add_stream, "api:create_stream")
+    db.refresh(stream)
+    job_worker.wake()
 
     return stream
 
 
+# progress of uploaded dumps being imported, by stream id
+imports: Dict[int, dict] = {}
+# finished and failed imports stay readable this long
+IMPORT_PROGRESS_TTL = int(os.environ.get("IMPORT_PROGRESS_TTL", "3600"))
+# the upload is written to its temporary file in pieces of about this size
+IMPORT_WRITE_BYTES = 1024 * 1024
+
+
+def prune_imports():
+    expired = time.time() - IMPORT_PROGRESS_TTL
+    for stream_id, progress in list(imports.items()):
+        if progress["finished_at"] is not None and progress["finished_at"] < expired:
+            imports.pop(stream_id, None)
+
+
+def run_upload_import(path: str, stream_id: int, platform: PlatformType):
+    progress = imports[stream_id]
+
+    def report(reader: importer.MessageReader, imported: int):
+        progress["bytes_read"] = reader.bytes_read
+        progress["messages"] = imported
+
+    db = database.SessionLocal()
+    try:
+        with open(path, "rb") as f:
+            importer.run_import(db, f, platform=platform, stream_id=stream_id, progress=report)
+        progress["done"] = True
+    except Exception as e:
+        progress["error"] = str(e)
+        print(f"Error importing into stream {stream_id}: {e}", file=sys.stderr)
+    finally:
+        progress["finished_at"] = time.time()
+        sys.stdout.flush()
+        db.close()
+        os.remove(path)
+
+
+def start_upload_import(
+    path: str,
+    total_bytes: int,
+    url: Optional[str],
+    platform_name: Optional[str],
+    title: Optional[str],
+):
+    try:
+        if platform_name:
+            platform = PlatformType[platform_name.upper()]
+        elif url:
+            platform = get_platform(url)
+        else:
+            with open(path, "rb") as f:
+                first = next(iter(importer.MessageReader(f)), None)
+            if first is None:
+                raise ValueError("The file holds no messages")
+            platform = importer.guess_platform(first)
+    except KeyError:
+        raise HTTPException(status_code=400, detail="Unsupported platform")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    db = database.SessionLocal()
+    try:
+        stream_id = importer.create_import_stream(
+            db, url or f"import://{title or 'upload'}", platform, title
+        )
+        imports[stream_id] = {
+            "stream_id": stream_id,
+            "total_bytes": total_bytes,
+            "bytes_read": 0,
+            "messages": 0,
+            "done": False,
+            "error": None,
+            "finished_at": None,
+        }
+        threading.Thread(
+            target=run_upload_import,
+            args=(path, stream_id, platform),
+            name=f"import-{stream_id}",
+            daemon=True,
+        ).start()
+        return db.get(Stream, stream_id)
+    finally:
+        db.close()
+
+
+# the body is the raw JSON or NDJSON dump, spooled to a temporary file as it
+# arrives and imported in the background, see GET /streams/{id}/import
+@app.post("/streams/import", response_model=StreamResponse)
+async def import_stream(
+    request: Request,
+    url: Optional[str] = None,
+    platform: Optional[str] = None,
+    title: Optional[str] = None,
+):
+    prune_imports()
+    upload = tempfile.NamedTemporaryFile(prefix="chat-import-", suffix=".json", delete=False)
+    total_bytes = 0
+    pending = []
+    pending_bytes = 0
+    try:
+        # file writes block, they go to the thread pool in larger pieces
+        async for chunk in request.stream():
+            pending.append(chunk)
+            pending_bytes += len(chunk)
+            total_bytes += len(chunk)
+            if pending_bytes >= IMPORT_WRITE_BYTES:
+                await to_thread.run_sync(upload.write, b"".join(pending))
+                pending, pending_bytes = [], 0
+        if pending:
+            await to_thread.run_sync(upload.write, b"".join(pending))
+    finally:
+        await to_thread.run_sync(upload.close)
+    try:
+        return await to_thread.run_sync(
+            start_upload_import, upload.name, total_bytes, url, platform, title
+        )
+    except Exception:
+        os.remove(upload.name)
+        raise
+
+
+@app.get("/streams/{stream_id}/import")
+def get_import_progress(stream_id: int):
+    prune_imports()
+    progress = imports.get(stream_id)
+    if not progress:
+        raise HTTPException(status_code=404, detail="No import for this stream")
+    return progress
+
+
 @app.patch("/streams/{stream_id}/resume")
-async def resume_stream(stream_id: int, db: Session = Depends(database.get_db)):
+def resume_stream(stream_id: int, db: Session = Depends(database.get_db)):
     stream = database.db_retry_on_lock(
         lambda: db.query(Stream).filter(Stream.id == stream_id).first()
     )
     if not stream:
         raise HTTPException(status_code=404, detail="Stream not found")
-    if stream.url in running_chats:
-        raise HTTPException(status_code=400, detail="Stream is already running")
+    if stream.download_status == DownloadStatus.DELETING.value:
+        raise HTTPException(status_code=400, detail="Stream is being deleted")
+
+    def mark_resumed():
+        # checked under the write lock, two resumes cannot both get through
+        job = jobs.get_job(db, stream.id)
+        if job and (job.desired_state == JobState.RUN.value or jobs.is_leased(job)):
+            return False
+        jobs.request_state(db, stream.id, JobState.RUN)
+        stream.updated_at = datetime.now()
+        return True
 
-    stop_event = threading.Event()
-    running_chats[stream.url] = stop_event
-    thread = threading.Thread(
-        target=start_download, args=(stream.id, stop_event), daemon=True
-    )
-    thread.start()
-    stream.updated_at = datetime.now()
-    db.commit()
+    if not database.run_write(db, mark_resumed, "api:resume_stream"):
+        raise HTTPException(status_code=400, detail="Stream is already running")
+    job_worker.wake()
 
     return {"status": "resumed"}
 
 
 @app.patch("/streams/{stream_id}/pause")
-async def pause_stream(stream_id: int, db: Session = Depends(database.get_db)):
+def pause_stream(stream_id: int, db: Session = Depends(database.get_db)):
     stream = database.db_retry_on_lock(
         lambda: db.query(Stream).filter(Stream.id == stream_id).first()
     )
     if not stream:
         raise HTTPException(status_code=404, detail="Stream not found")
-    if stream.url not in running_chats:
-        raise HTTPException(status_code=400, detail="Stream is not running")
 
-    running_chats[stream.url].set()
-    running_chats.pop(stream.url)
+    def mark_paused():
+        job = jobs.get_job(db, stream.id)
+        if not job or job.desired_state != JobState.RUN.value:
+            return False
+        # the worker holding the job stops the download at its next heartbeat
+        jobs.request_state(db, stream.id, JobState.PAUSE)
+        stream.download_status = DownloadStatus.PAUSED.value
+        stream.updated_at = datetime.now()
+        return True
 
-    stream.download_status = DownloadStatus.PAUSED.value
-    stream.updated_at = datetime.now()
-    db.commit()
+    if not database.run_write(db, mark_paused, "api:pause_stream"):
+        raise HTTPException(status_code=400, detail="Stream is not running")
+    job_worker.wake()
 
     return {"status": "paused"}
 
 
 @app.patch("/streams/{stream_id}/stop")
-async def stop_stream(stream_id: int, db: Session = Depends(database.get_db)):
+def stop_stream(stream_id: int, db: Session = Depends(database.get_db)):
     stream = database.db_retry_on_lock(
         lambda: db.query(Stream).filter(Stream.id == stream_id).first()
     )
     if not stream:
         raise HTTPException(status_code=404, detail="Stream not found")
 
-    if stream.url in running_chats:
-        running_chats[stream.url].set()
-        running_chats.pop(stream.url)
+    def mark_stopped():
+        jobs.request_state(db, stream.id, JobState.STOP)
+        stream.download_status = DownloadStatus.COMPLETED.value
+        stream.updated_at = datetime.now()
+        stream.resume_timestamp = None
 
-    stream.download_status = DownloadStatus.COMPLETED.value
-    stream.updated_at = datetime.now()
-    stream.resume_timestamp = None
-    db.commit()
+    database.run_write(db, mark_stopped, "api:stop_stream")
+    job_worker.wake()
 
     return {"status": "stopped", "stream_id": stream_id}
 
 
+@app.get("/jobs")
+def get_jobs(db: Session = Depends(database.get_read_db)):
+    rows = database.db_retry_on_lock(
+        lambda: db.query(DownloadJob).order_by(DownloadJob.stream_id).all()
+    )
+    now = datetime.now()
+    return [
+        {
+            "stream_id": job.stream_id,
+            "desired_state": job.desired_state,
+            "owner": job.owner,
+            "leased": jobs.is_leased(job, now),
+            "lease_expires_at": job.lease_expires_at,
+            "heartbeat_at": job.heartbeat_at,
+            "attempts": job.attempts,
+            "local": job.owner == job_worker.owner,
+        }
+        for job in rows
+    ]
+
+
+class FlushPolicyRequest(BaseModel):
+    max_delay: Optional[float] = None
+    max_batch: Optional[int] = None
+
+
+def flush_policy_response(stream: Stream):
+    handler = running_handlers.get(stream.id)
+    return {
+        "stream_id": stream.id,
+        "max_delay": stream.flush_max_delay,
+        "max_batch": stream.flush_max_batch,
+        "active": handler.policy.state() if handler else None,
+    }
+
+
+@app.get("/streams/{stream_id}/flush-policy")
+def get_flush_policy(stream_id: int, db: Session = Depends(database.get_read_db)):
+    stream = database.db_retry_on_lock(
+        lambda: db.query(Stream).filter(Stream.id == stream_id).first()
+    )
+    if not stream:
+        raise HTTPException(status_code=404, detail="Stream not found")
+    return flush_policy_response(stream)
+
+
+# null resets a value to the server default
+@app.patch("/streams/{stream_id}/flush-policy")
+def update_flush_policy(
+    stream_id: int, request: FlushPolicyRequest, db: Session = Depends(database.get_db)
+):
+    if request.max_delay is not None and request.max_delay <= 0:
+        raise HTTPException(status_code=400, detail="max_delay must be positive")
+    if request.max_batch is not None and request.max_batch < 1:
+        raise HTTPException(status_code=400, detail="max_batch must be positive")
+    stream = database.db_retry_on_lock(
+        lambda: db.query(Stream).filter(Stream.id == stream_id).first()
+    )
+    if not stream:
+        raise HTTPException(status_code=404, detail="Stream not found")
+
+    def apply():
+        if "max_delay" in request.model_fields_set:
+            stream.flush_max_delay = request.max_delay
+        if "max_batch" in request.model_fields_set:
+            stream.flush_max_batch = request.max_batch
+
+    database.run_write(db, apply, "api:update_flush_policy")
+
+    handler = running_handlers.get(stream_id)
+    if handler:
+        handler.policy.configure(stream.flush_max_delay, stream.flush_max_batch)
+    return flush_policy_response(stream)
+
+
+def message_to_dict(msg, platform: int) -> dict:
+    msg_dict = {
+        "id": msg.id,
+        "uuid": msg.message_id,
+        "messageGroupId": msg.message_group_id,
+        "timestamp": from_micros(msg.timestamp),
+        "author": {
+            "id": msg.author_id,
+            "isMod": msg.is_moderator,
+        },
+        "message": msg.message,
+        "clusterId": msg.cluster_id,
+        "created_at": from_micros(msg.created_at),
+    }
+
+    if platform == PlatformType.TWITCH.value:
+        msg_dict["author"].update(
+            {
+                "name": msg.author_display_name or msg.author_name,
+                "isSub": msg.is_subscriber,
+                "color": msg.colour,
+            }
+        )
+        msg_dict.update(
+            {
+                "systemMessage": msg.system_message,
+                "banType": msg.ban_type,
+                "subTier": msg.sub_tier,
+                "subPrime": msg.sub_prime,
+            }
+        )
+    elif platform == PlatformType.YOUTUBE.value:
+        msg_dict["author"].update(
+            {
+                "name": msg.author_name,
+                "isSub": msg.is_member,
+            }
+        )
+        msg_dict.update(
+            {
+                "targetId": msg.target_message_id,
+                "deleted": msg.deleted,
+                "amount": msg.money_amount / 100 if msg.money_amount is not None else None,
+                "currency": msg.money_currency,
+                "banType": ("removed" if msg.target_message_id else "retracted")
+                if msg.message_group_id == MessageGroup.bans.value
+                else None,
+            }
+        )
+    return msg_dict
+
+
 @app.get("/streams/{stream_id}/messages", response_model=MessagesResponse)
-async def get_stream_messages(
+def get_stream_messages(
     stream_id: int,
     limit: int = 500,
     offset: int = 0,
@@ -335,13 +1014,10 @@ async def get_stream_messages(
     moderators: Optional[bool] = False,
     username: Optional[str] = None,
     message: Optional[str] = None,
-    db: Session = Depends(database.get_db),
+    clusterId: Optional[int] = None,
+    db: Session = Depends(database.get_read_db),
 ):
-    parsed_message_group_ids = (
-        [int(id.strip()) for id in messageGroupIds.split(",")]
-        if messageGroupIds
-        else []
-    )
+    parsed_message_group_ids = parse_message_group_ids(messageGroupIds)
 
     stream = database.db_retry_on_lock(
         lambda: db.query(Stream).filter(Stream.id == stream_id).first()
@@ -349,57 +1025,22 @@ async def get_stream_messages(
     if not stream:
         raise HTTPException(status_code=404, detail="Stream not found")
 
-    model_class = (
-        TwitchChatMessage
-        if stream.platform == PlatformType.TWITCH.value
-        else YouTubeChatMessage
-    )
-
-    def get_messages_and_count():
-        query = db.query(model_class).filter(model_class.stream_id == stream_id)
-        if parsed_message_group_ids:
-            query = query.filter(
-                model_class.message_group_id.in_(parsed_message_group_ids)
-            )
-        if dateTo:
-            query = query.filter(model_class.timestamp < dateTo)
-        if dateFrom:
-            query = query.filter(model_class.timestamp > dateFrom)
-
-        includeMessages = (
-            MessageGroup.messages.value in parsed_message_group_ids
-            if parsed_message_group_ids
-            else True
-        )
-
-        banned_users_sub = (
-            db.query(model_class.author_name)
-            .filter(
-                model_class.stream_id == stream_id,
-                model_class.message_group_id == MessageGroup.bans.value,
-            )
-            .distinct()
+    model_class = get_model_class(stream.platform)
+
+    def get_messages_and_count(message_db: Session):
+        query = build_messages_query(
+            message_db,
+            stream,
+            parsed_message_group_ids,
+            includeBannedUsers=includeBannedUsers,
+            moderators=moderators,
+            username=username,
+            message=message,
+            dateFrom=dateFrom,
+            dateTo=dateTo,
+            clusterId=clusterId,
         )
 
-        if not includeBannedUsers and includeMessages:
-            query = query.filter(~model_class.author_name.in_(banned_users_sub))
-        elif includeBannedUsers and not includeMessages:
-            sub = db.query(model_class).filter(
-                model_class.message_group_id == MessageGroup.messages.value,
-                model_class.author_name.in_(banned_users_sub),
-            )
-            query = query.union(sub)
-
-        if moderators:
-            query = query.filter(model_class.is_moderator)
-        if username:
-            filter_cond = model_class.author_name.ilike(f"%{username}%")
-            if stream.platform == PlatformType.TWITCH.value:
-                filter_cond |= model_class.author_display_name.ilike(f"%{username}%")
-            query = query.filter(filter_cond)
-        if message:
-            query = query.filter(model_class.message.ilike(f"%{message}%"))
-
         total_count = query.count()
         messages = (
             query.order_by(model_class.timestamp.desc())
@@ -409,52 +1050,12 @@ async def get_stream_messages(
         )
         return messages, total_count
 
-    messages, total_count = database.db_retry_on_lock(get_messages_and_count)
-
-    message_dicts = []
-    for msg in messages:
-        msg_dict = {
-            "id": msg.id,
-            "uuid": msg.message_id,
-            "messageGroupId": msg.message_group_id,
-            "timestamp": msg.timestamp,
-            "author": {
-                "id": msg.author_id,
-                "isMod": msg.is_moderator,
-            },
-            "message": msg.message,
-            "created_at": msg.created_at,
-        }
-
-        if stream.platform == PlatformType.TWITCH.value:
-            msg_dict["author"].update(
-                {
-                    "name": msg.author_display_name or msg.author_name,
-                    "isSub": msg.is_subscriber,
-                    "color": msg.colour,
-                }
-            )
-            msg_dict.update(
-                {"systemMessage": msg.system_message, "banType": msg.ban_type}
-            )
-        elif stream.platform == PlatformType.YOUTUBE.value:
-            msg_dict["author"].update(
-                {
-                    "name": msg.author_name,
-                    "isSub": msg.is_member,
-                }
-            )
-            msg_dict.update(
-                {
-                    "targetId": msg.target_message_id,
-                    "deleted": msg.deleted,
-                    "banType": ("removed" if msg.target_message_id else "retracted")
-                    if msg.message_group_id == MessageGroup.bans.value
-                    else None,
-                }
-            )
+    with database.message_session(stream.id, db, read_only=True) as message_db:
+        messages, total_count = database.db_retry_on_lock(
+            lambda: get_messages_and_count(message_db)
+        )
 
-        message_dicts.append(msg_dict)
+    message_dicts = [message_to_dict(msg, stream.platform) for msg in messages]
 
     pagination = PaginationInfo(
         total_count=total_count,
@@ -472,143 +1073,541 @@ async def get_stream_messages(
     )
 
 
-@app.delete("/streams/{stream_id}")
-async def delete_stream(stream_id: int, db: Session = Depends(database.get_db)):
-    stream = database.db_retry_on_lock(
-        lambda: db.query(Stream).filter(Stream.id == stream_id).first()
-    )
-    if not stream:
-        raise HTTPException(status_code=404, detail="Stream not found")
-
-    if stream.url in running_chats:
-        running_chats[stream.url].set()
-        running_chats.pop(stream.url)
+class MessageGroupFacet(BaseModel):
+    message_group_id: int
+    count: int
+    moderators: int
+    subscribers: int
+    banned: int
 
-    def delete_stream_data():
-        model_class = (
-            TwitchChatMessage
-            if stream.platform == PlatformType.TWITCH.value
-            else YouTubeChatMessage
-        )
-        db.query(model_class).filter(model_class.stream_id == stream_id).delete()
-        db.delete(stream)
-        db.commit()
 
-    database.db_retry_on_lock(delete_stream_data)
-    return {"status": "deleted", "stream_id": stream_id}
+class FacetsResponse(BaseModel):
+    stream_id: int
+    # the total_count of /streams/{stream_id}/messages for the same filters
+    total_count: int
+    moderators: int
+    subscribers: int
+    banned: int
+    message_groups: List[MessageGroupFacet]
 
 
-@app.get("/streams/{stream_id}/export")
-async def export_stream_messages(
+@app.get("/streams/{stream_id}/facets", response_model=FacetsResponse)
+def get_stream_facets(
     stream_id: int,
-    format: str = "json",
+    dateTo: Optional[datetime] = None,
+    dateFrom: Optional[datetime] = None,
     messageGroupIds: Optional[str] = None,
     includeBannedUsers: Optional[bool] = True,
     moderators: Optional[bool] = False,
     username: Optional[str] = None,
     message: Optional[str] = None,
-    db: Session = Depends(database.get_db),
+    clusterId: Optional[int] = None,
+    db: Session = Depends(database.get_read_db),
 ):
-    if format.lower() not in ["json", "csv"]:
-        raise HTTPException(status_code=400, detail="Unsupported format")
-    parsed_message_group_ids = (
-        [int(id.strip()) for id in messageGroupIds.split(",")]
-        if messageGroupIds
-        else []
-    )
+    # counts for the filter panel, takes the filters of /streams/{stream_id}/messages
+    try:
+        parsed_message_group_ids = parse_message_group_ids(messageGroupIds)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid messageGroupIds")
+
     stream = database.db_retry_on_lock(
         lambda: db.query(Stream).filter(Stream.id == stream_id).first()
     )
     if not stream:
         raise HTTPException(status_code=404, detail="Stream not found")
 
-    model_class = (
-        TwitchChatMessage
-        if stream.platform == PlatformType.TWITCH.value
-        else YouTubeChatMessage
+    key = (
+        stream.id,
+        tuple(parsed_message_group_ids),
+        includeBannedUsers,
+        moderators,
+        username,
+        message,
+        dateFrom,
+        dateTo,
+        clusterId,
     )
+    mark = facets.watermark(stream)
+    counts = facets.cache.get(key, mark)
+    if counts is None:
+        with database.message_session(stream.id, db, read_only=True) as message_db:
+            counts = database.db_retry_on_lock(
+                lambda: facets.count_facets(
+                    message_db,
+                    stream,
+                    parsed_message_group_ids,
+                    includeBannedUsers,
+                    moderators,
+                    username,
+                    message,
+                    dateFrom,
+                    dateTo,
+                    clusterId,
+                )
+            )
+        facets.cache.put(key, mark, counts)
 
-    def get_messages():
-        query = db.query(model_class).filter(model_class.stream_id == stream_id)
-        if parsed_message_group_ids:
-            query = query.filter(
-                model_class.message_group_id.in_(parsed_message_group_ids)
+    total_count, moderator_count, subscriber_count, banned_count = facets.totals(counts)
+    return FacetsResponse(
+        stream_id=stream_id,
+        total_count=total_count,
+        moderators=moderator_count,
+        subscribers=subscriber_count,
+        banned=banned_count,
+        message_groups=[
+            MessageGroupFacet(
+                message_group_id=group_id,
+                count=group[0],
+                moderators=group[1],
+                subscribers=group[2],
+                banned=group[3],
             )
+            for group_id, group in sorted(counts.items())
+        ],
+    )
 
-        includeMessages = (
-            MessageGroup.messages.value in parsed_message_group_ids
-            if parsed_message_group_ids
-            else True
-        )
 
-        banned_users_sub = (
-            db.query(model_class.author_name)
-            .filter(
-                model_class.stream_id == stream_id,
-                model_class.message_group_id == MessageGroup.bans.value,
-            )
-            .distinct()
+class MessageCluster(BaseModel):
+    cluster_id: int
+    count: int
+    first_timestamp: datetime
+    last_timestamp: datetime
+    message: str | None = None
+
+
+class ClustersResponse(BaseModel):
+    stream_id: int
+    clusters: List[MessageCluster]
+
+
+@app.get("/streams/{stream_id}/clusters", response_model=ClustersResponse)
+def get_stream_clusters(
+    stream_id: int,
+    dateFrom: Optional[datetime] = None,
+    dateTo: Optional[datetime] = None,
+    limit: int = 20,
+    minSize: int = 2,
+    db: Session = Depends(database.get_read_db),
+):
+    # the biggest groups of near-identical messages, their messages are listed
+    # by /streams/{stream_id}/messages?clusterId=
+    stream = database.db_retry_on_lock(
+        lambda: db.query(Stream).filter(Stream.id == stream_id).first()
+    )
+    if not stream:
+        raise HTTPException(status_code=404, detail="Stream not found")
+
+    with database.message_session(stream.id, db, read_only=True) as message_db:
+        clusters = database.db_retry_on_lock(
+            lambda: duplicates.top_clusters(message_db, stream, dateFrom, dateTo, limit, minSize)
         )
 
-        if not includeBannedUsers and includeMessages:
-            query = query.filter(~model_class.author_name.in_(banned_users_sub))
-        elif includeBannedUsers and not includeMessages:
-            sub = db.query(model_class).filter(
-                model_class.message_group_id == MessageGroup.messages.value,
-                model_class.author_name.in_(banned_users_sub),
+    return ClustersResponse(
+        stream_id=stream_id,
+        clusters=[
+            MessageCluster(
+                cluster_id=cluster["cluster_id"],
+                count=cluster["count"],
+                first_timestamp=from_micros(cluster["first_timestamp"]),
+                last_timestamp=from_micros(cluster["last_timestamp"]),
+                message=cluster["message"],
             )
-            query = query.union(sub)
-
-        if moderators:
-            query = query.filter(model_class.is_moderator)
-        if username:
-            filter_cond = model_class.author_name.ilike(f"%{username}%")
-            if stream.platform == PlatformType.TWITCH.value:
-                filter_cond |= model_class.author_display_name.ilike(f"%{username}%")
-            query = query.filter(filter_cond)
-        if message:
-            query = query.filter(model_class.message.ilike(f"%{message}%"))
+            for cluster in clusters
+        ],
+    )
 
-        messages = query.order_by(model_class.timestamp.desc()).all()
-        return messages
 
-    messages= database.db_retry_on_lock(get_messages)
+class PaidMessageTotal(BaseModel):
+    currency: str
+    count: int
+    amount: float
+    first_timestamp: datetime | None = None
+    last_timestamp: datetime | None = None
 
-    message_dicts = []
-    for msg in messages:
-        msg_dict = {
-            "message_type": MessageGroup(msg.message_group_id).name,
-            "time": msg.timestamp.isoformat() if msg.timestamp else None,
-            "message": msg.message,
+
+class SubscriptionTotal(BaseModel):
+    # 0 for youtube memberships
+    tier: int
+    count: int
+    prime_count: int
+    first_timestamp: datetime | None = None
+    last_timestamp: datetime | None = None
+
+
+class RevenueResponse(BaseModel):
+    stream_id: int
+    paid_messages: List[PaidMessageTotal]
+    subscriptions: List[SubscriptionTotal]
+
+
+@app.get("/streams/{stream_id}/revenue", response_model=RevenueResponse)
+def get_stream_revenue(stream_id: int, db: Session = Depends(database.get_read_db)):
+    # totals kept up to date at ingest, reading them never touches the messages
+    def load():
+        stream = db.query(Stream).filter(Stream.id == stream_id).first()
+        return stream, revenue.stream_revenue(db, stream_id) if stream else []
+
+    stream, totals = database.db_retry_on_lock(load)
+    if not stream:
+        raise HTTPException(status_code=404, detail="Stream not found")
+
+    def timestamps(total):
+        return {
+            "first_timestamp": from_micros(total.first_timestamp),
+            "last_timestamp": from_micros(total.last_timestamp),
         }
 
-        if stream.platform == PlatformType.TWITCH.value:
-            msg_dict.update(
-                {
-                    "author_name": msg.author_display_name or msg.author_name,
-                    "system_message": msg.system_message,
-                    "ban_type": msg.ban_type,
-                    "is_subscriber": msg.is_subscriber,
-                }
+    return RevenueResponse(
+        stream_id=stream_id,
+        paid_messages=[
+            PaidMessageTotal(
+                currency=total.currency, count=total.count, amount=total.amount / 100, **timestamps(total)
             )
-        elif stream.platform == PlatformType.YOUTUBE.value:
-            msg_dict.update(
-                {
-                    "author_name": msg.author_name,
-                    "ban_type": ("removed" if msg.target_message_id else "retracted")
-                    if msg.message_group_id == MessageGroup.bans.value
-                    else None,
-                    "is_subscriber": msg.is_member,
-                }
+            for total in totals
+            if total.currency
+        ],
+        subscriptions=[
+            SubscriptionTotal(
+                tier=total.tier, count=total.count, prime_count=total.prime_count, **timestamps(total)
             )
-        msg_dict.update(
-            {
-                "is_moderator": msg.is_moderator,
-            }
+            for total in totals
+            if not total.currency
+        ],
+    )
+
+
+class SearchStreamResult(BaseModel):
+    stream: StreamResponse
+    count: int
+    messages: List[dict]
+
+
+class SearchResponse(BaseModel):
+    results: List[SearchStreamResult]
+    next_cursor: str | None = None
+
+
+@app.get("/search", response_model=SearchResponse)
+def search_messages(
+    author: Optional[str] = None,
+    q: Optional[str] = None,
+    platform: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    perStream: int = 5,
+    db: Session = Depends(database.get_read_db),
+):
+    # the cursor is the stream id the previous page ended at
+    try:
+        before = int(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if limit < 1 or perStream < 1:
+        raise HTTPException(status_code=400, detail="Invalid limit")
+
+    try:
+        results, next_before = database.db_retry_on_lock(
+            lambda: search.search(db, author, q, platform, before, limit, perStream)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return SearchResponse(
+        results=[
+            SearchStreamResult(
+                stream=StreamResponse.model_validate(stream, from_attributes=True),
+                count=count,
+                messages=[message_to_dict(msg, stream.platform) for msg in messages],
+            )
+            for stream, count, messages in results
+        ],
+        next_cursor=str(next_before) if next_before is not None else None,
+    )
+
+
+class TimelineResponse(BaseModel):
+    messages: List[dict]
+    next_cursor: str | None = None
+
+
+@app.get("/timeline", response_model=TimelineResponse)
+def get_timeline(
+    streamIds: str,
+    cursor: Optional[str] = None,
+    limit: int = 500,
+    dateFrom: Optional[datetime] = None,
+    dateTo: Optional[datetime] = None,
+    messageGroupIds: Optional[str] = None,
+    db: Session = Depends(database.get_read_db),
+):
+    try:
+        stream_ids = list(dict.fromkeys(int(id.strip()) for id in streamIds.split(",")))
+        after = timeline.parse_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid stream ids or cursor")
+    if len(stream_ids) > timeline.TIMELINE_MAX_STREAMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {timeline.TIMELINE_MAX_STREAMS} streams per timeline",
         )
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="Invalid limit")
+    try:
+        parsed_message_group_ids = parse_message_group_ids(messageGroupIds)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid messageGroupIds")
+
+    streams = database.db_retry_on_lock(
+        lambda: db.query(Stream).filter(Stream.id.in_(stream_ids)).all()
+    )
+    if len(streams) != len(stream_ids):
+        raise HTTPException(status_code=404, detail="Stream not found")
+
+    messages, next_position = database.db_retry_on_lock(
+        lambda: timeline.merged_messages(
+            db, streams, parsed_message_group_ids, limit, after, dateFrom, dateTo
+        )
+    )
 
+    message_dicts = []
+    for stream, msg in messages:
+        msg_dict = message_to_dict(msg, stream.platform)
+        msg_dict.update({"streamId": stream.id, "platform": stream.platform})
         message_dicts.append(msg_dict)
 
+    return TimelineResponse(
+        messages=message_dicts,
+        next_cursor=timeline.format_cursor(next_position) if next_position else None,
+    )
+
+
+class AlertRuleRequest(BaseModel):
+    pattern: str
+    field: str = "message"
+    platform: int | None = None
+
+
+class AlertRuleResponse(BaseModel):
+    id: int
+    pattern: str
+    field: str
+    platform: int | None = None
+    created_at: datetime
+
+
+class AlertHitResponse(BaseModel):
+    id: int
+    rule_id: int
+    stream_id: int
+    message_id: str | None = None
+    timestamp: datetime | None = None
+    author: str | None = None
+    message: str | None = None
+    created_at: datetime
+
+
+class AlertHitsResponse(BaseModel):
+    hits: List[AlertHitResponse]
+    next_cursor: str | None = None
+
+
+def alert_hit_response(hit: AlertHit) -> AlertHitResponse:
+    return AlertHitResponse(
+        id=hit.id,
+        rule_id=hit.rule_id,
+        stream_id=hit.stream_id,
+        message_id=hit.message_id,
+        timestamp=from_micros(hit.timestamp) if hit.timestamp is not None else None,
+        author=hit.author,
+        message=hit.message,
+        created_at=hit.created_at,
+    )
+
+
+@app.get("/alerts/rules", response_model=List[AlertRuleResponse])
+def get_alert_rules(db: Session = Depends(database.get_read_db)):
+    return database.db_retry_on_lock(lambda: db.query(AlertRule).order_by(AlertRule.id).all())
+
+
+@app.post("/alerts/rules", response_model=AlertRuleResponse)
+def create_alert_rule(request: AlertRuleRequest, db: Session = Depends(database.get_db)):
+    pattern = request.pattern.strip()
+    if not pattern or request.field not in alerts.RULE_FIELDS:
+        raise HTTPException(status_code=400, detail="Invalid alert rule")
+    rule = AlertRule(pattern=pattern, field=request.field, platform=request.platform)
+    database.run_write(db, lambda: db.add(rule), "api")
+    db.refresh(rule)
+    alerts.rules.refresh(db, force=True)
+    return rule
+
+
+@app.delete("/alerts/rules/{rule_id}")
+def delete_alert_rule(rule_id: int, db: Session = Depends(database.get_db)):
+    def delete_rule():
+        deleted = db.query(AlertRule).filter(AlertRule.id == rule_id).delete()
+        db.query(AlertHit).filter(AlertHit.rule_id == rule_id).delete()
+        return deleted
+
+    if not database.run_write(db, delete_rule, "api"):
+        raise HTTPException(status_code=404, detail="Alert rule not found")
+    alerts.rules.refresh(db, force=True)
+    return {"message": "Alert rule deleted"}
+
+
+@app.get("/alerts/hits", response_model=AlertHitsResponse)
+def get_alert_hits(
+    ruleId: Optional[int] = None,
+    streamId: Optional[int] = None,
+    cursor: Optional[int] = None,
+    limit: int = 100,
+    db: Session = Depends(database.get_read_db),
+):
+    # newest first, the cursor is the id of the last hit on the previous page
+    hits = database.db_retry_on_lock(
+        lambda: alerts.list_hits(db, ruleId, streamId, before=cursor, limit=limit + 1)
+    )
+    return AlertHitsResponse(
+        hits=[alert_hit_response(hit) for hit in hits[:limit]],
+        next_cursor=str(hits[limit - 1].id) if len(hits) > limit else None,
+    )
+
+
+def read_alert_hits(after: int, rule_id: Optional[int], stream_id: Optional[int]):
+    db = database.ReadSessionLocal()
+    try:
+        return [
+            alert_hit_response(hit)
+            for hit in alerts.list_hits(db, rule_id, stream_id, after=after, limit=500)
+        ]
+    finally:
+        db.close()
+
+
+async def alert_events(request: Request, after: int, rule_id: Optional[int], stream_id: Optional[int]):
+    # handlers in this process wake us as soon as they commit hits, hits
+    # written by other processes show up within ALERT_EVENTS_POLL
+    wake = alerts.broker.subscribe()
+    idle = 0.0
+    try:
+        while not await request.is_disconnected():
+            wake.clear()
+            hits = await to_thread.run_sync(
+                lambda: database.db_retry_on_lock(lambda: read_alert_hits(after, rule_id, stream_id))
+            )
+            for hit in hits:
+                after = hit.id
+                yield f"id: {hit.id}\nevent: hit\ndata: {hit.model_dump_json()}\n\n"
+            if hits:
+                idle = 0.0
+                continue
+            try:
+                await asyncio.wait_for(wake.wait(), ALERT_EVENTS_POLL)
+            except asyncio.TimeoutError:
+                idle += ALERT_EVENTS_POLL
+                if idle >= ALERT_EVENTS_KEEPALIVE:
+                    idle = 0.0
+                    yield ": keepalive\n\n"
+    finally:
+        alerts.broker.unsubscribe(wake)
+
+
+@app.get("/alerts/events")
+async def get_alert_events(
+    request: Request, ruleId: Optional[int] = None, streamId: Optional[int] = None
+):
+    # server-sent events; a client reconnecting with Last-Event-ID gets the
+    # hits it missed, a new one starts with the next hit
+    last_event_id = request.headers.get("last-event-id")
+    try:
+        after = int(last_event_id) if last_event_id else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    if after is None:
+        after = await to_thread.run_sync(
+            lambda: database.db_retry_on_lock(lambda: _last_alert_hit_id())
+        )
+    return StreamingResponse(
+        alert_events(request, after, ruleId, streamId),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+def _last_alert_hit_id() -> int:
+    db = database.ReadSessionLocal()
+    try:
+        return alerts.last_hit_id(db)
+    finally:
+        db.close()
+
+
+@app.delete("/streams/{stream_id}")
+def delete_stream(stream_id: int, db: Session = Depends(database.get_db)):
+    stream = database.db_retry_on_lock(
+        lambda: db.query(Stream).filter(Stream.id == stream_id).first()
+    )
+    if not stream:
+        raise HTTPException(status_code=404, detail="Stream not found")
+
+    if stream.download_status == DownloadStatus.DELETING.value:
+        return {"status": "deleting", "stream_id": stream_id}
+
+    def mark_deleting():
+        jobs.request_state(db, stream.id, JobState.STOP)
+        stream.download_status = DownloadStatus.DELETING.value
+        stream.updated_at = datetime.now()
+
+    database.run_write(db, mark_deleting, "api:delete_stream")
+    job_worker.wake()
+    start_purge(stream_id)
+    return {"status": "deleting", "stream_id": stream_id}
+
+
+@app.get("/streams/{stream_id}/export")
+def export_stream_messages(
+    stream_id: int,
+    format: str = "json",
+    messageGroupIds: Optional[str] = None,
+    includeBannedUsers: Optional[bool] = True,
+    moderators: Optional[bool] = False,
+    username: Optional[str] = None,
+    message: Optional[str] = None,
+    db: Session = Depends(database.get_read_db),
+):
+    if format.lower() not in ["json", "csv"]:
+        raise HTTPException(status_code=400, detail="Unsupported format")
+    parsed_message_group_ids = parse_message_group_ids(messageGroupIds)
+    stream = database.db_retry_on_lock(
+        lambda: db.query(Stream).filter(Stream.id == stream_id).first()
+    )
+    if not stream:
+        raise HTTPException(status_code=404, detail="Stream not found")
+
+    model_class = get_model_class(stream.platform)
+
+    def get_messages(message_db: Session):
+        query = build_messages_query(
+            message_db,
+            stream,
+            parsed_message_group_ids,
+            includeBannedUsers=includeBannedUsers,
+            moderators=moderators,
+            username=username,
+            message=message,
+        )
+        messages = query.order_by(model_class.timestamp.desc()).all()
+        return messages
+
+    with database.message_session(stream.id, db, read_only=True) as message_db:
+        messages = database.db_retry_on_lock(lambda: get_messages(message_db))
+
+    import csv
+    import io
+    import json
+    from models import exporter
+
+    message_dicts = [exporter.export_row(msg, stream.platform) for msg in messages]
+
     output = io.StringIO()
     if format.lower() == "json":
         json.dump(message_dicts, output, indent=2, ensure_ascii=False)
@@ -639,6 +1638,108 @@ async def export_stream_messages(
     )
 
 
+class BulkExportRequest(BaseModel):
+    stream_ids: List[int]
+    archive: str = "zip"
+    format: str = "ndjson"
+    formats: Dict[int, str] = {}
+    messageGroupIds: List[int] = []
+    includeBannedUsers: Optional[bool] = True
+    moderators: Optional[bool] = False
+    username: Optional[str] = None
+    message: Optional[str] = None
+
+
+def produce_export_rows(stream_id: int, request: BulkExportRequest):
+    from models import exporter
+
+    db = database.ReadSessionLocal()
+    try:
+        stream = db.query(Stream).filter(Stream.id == stream_id).first()
+        if not stream or stream.download_status == DownloadStatus.DELETING.value:
+            # deleted after the export started, its file stays empty
+            print(f"Stream {stream_id} was deleted during export", file=sys.stderr)
+            sys.stdout.flush()
+            return
+        model_class = get_model_class(stream.platform)
+        with database.message_session(stream.id, db, read_only=True) as message_db:
+            query = build_messages_query(
+                message_db,
+                stream,
+                request.messageGroupIds,
+                includeBannedUsers=request.includeBannedUsers,
+                moderators=request.moderators,
+                username=request.username,
+                message=request.message,
+            )
+            query = query.order_by(model_class.timestamp.desc()).yield_per(
+                exporter.EXPORT_YIELD_PER
+            )
+            for msg in query:
+                yield exporter.export_row(msg, stream.platform)
+    finally:
+        db.close()
+
+
+@app.post("/streams/export")
+def bulk_export_streams(
+    request: BulkExportRequest, db: Session = Depends(database.get_read_db)
+):
+    # exports pull in the archive and parquet code, not needed to start up
+    from models import exporter
+
+    archive_format = request.archive.lower()
+    if archive_format not in exporter.ARCHIVE_FORMATS:
+        raise HTTPException(status_code=400, detail="Unsupported archive format")
+    if not request.stream_ids:
+        raise HTTPException(status_code=400, detail="No streams selected")
+
+    file_formats = {
+        stream_id: request.formats.get(stream_id, request.format).lower()
+        for stream_id in request.stream_ids
+    }
+    if any(f not in exporter.FILE_FORMATS for f in file_formats.values()):
+        raise HTTPException(status_code=400, detail="Unsupported format")
+    if "parquet" in file_formats.values() and not exporter.parquet_available():
+        raise HTTPException(
+            status_code=400, detail="Parquet export requires pyarrow to be installed"
+        )
+
+    streams = database.db_retry_on_lock(
+        lambda: db.query(Stream).filter(Stream.id.in_(request.stream_ids)).all()
+    )
+    streams_by_id = {stream.id: stream for stream in streams}
+    missing = [id for id in request.stream_ids if id not in streams_by_id]
+    if missing:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Streams not found: {', '.join(str(id) for id in missing)}",
+        )
+
+    export_jobs = []
+    for stream_id in dict.fromkeys(request.stream_ids):
+        stream = streams_by_id[stream_id]
+        fieldnames = exporter.export_fieldnames(stream.platform)
+        export_jobs.append(
+            exporter.ExportJob(
+                name=f"{stream.id}_{stream.stream_id or 'export'}",
+                format=file_formats[stream_id],
+                produce=lambda stream_id=stream_id, fieldnames=fieldnames: (
+                    produce_export_rows(stream_id, request),
+                    fieldnames,
+                ),
+            )
+        )
+
+    filename = f"export_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.{archive_format}"
+    media_type = exporter.ARCHIVE_FORMATS[archive_format]
+    return StreamingResponse(
+        exporter.stream_archive(export_jobs, archive_format),
+        media_type=media_type,
+        headers={"Content-Type": media_type, "filename": filename},
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,287 @@
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+import math
+import threading
+import time
+import weakref
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+# hot paths only ever touch a dict owned by the calling thread, so recording
+# needs no lock; collection sums the per-thread dicts. a thread that exits has
+# its dict folded into the retired totals, download and import threads come and go
+class _ThreadShards:
+    def __init__(self, combine: Callable):
+        self._local = threading.local()
+        self._shards: Dict[int, dict] = {}
+        self._retired: dict = {}
+        self._combine = combine
+        self._lock = threading.Lock()
+
+    def get(self) -> dict:
+        owner = getattr(self._local, "owner", None)
+        if owner is None:
+            owner = self._local.owner = _ShardOwner()
+            with self._lock:
+                self._shards[id(owner)] = owner.shard
+            # runs once the thread's locals are gone
+            weakref.finalize(owner, self._retire, id(owner))
+        return owner.shard
+
+    def _retire(self, key: int) -> None:
+        with self._lock:
+            shard = self._shards.pop(key, None)
+            if not shard:
+                return
+            retired = dict(self._retired)
+            for labels, value in shard.items():
+                previous = retired.get(labels)
+                retired[labels] = value if previous is None else self._combine(previous, value)
+            self._retired = retired
+
+    def snapshots(self) -> List[dict]:
+        # under the lock, a retiring shard is counted either live or retired
+        with self._lock:
+            return [dict(self._retired)] + [dict(shard) for shard in self._shards.values()]
+
+
+class _ShardOwner:
+    __slots__ = ("shard", "__weakref__")
+
+    def __init__(self):
+        self.shard = {}
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+
+    def samples(self) -> Iterable[str]:
+        return []
+
+    def render(self) -> List[str]:
+        return self.header() + list(self.samples())
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._shards = _ThreadShards(lambda a, b: a + b)
+
+    def inc(self, amount: float = 1, *labels) -> None:
+        shard = self._shards.get()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self) -> Dict[LabelValues, float]:
+        totals: Dict[LabelValues, float] = {}
+        for shard in self._shards.snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def samples(self):
+        for labels, value in sorted(self.values().items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._shards = _ThreadShards(lambda a, b: [x + y for x, y in zip(a, b)])
+
+    def observe(self, value: float, *labels) -> None:
+        shard = self._shards.get()
+        state = shard.get(labels)
+        if state is None:
+            # per-bucket counts followed by sum and count
+            state = [0] * (len(self.buckets) + 2)
+            shard[labels] = state
+        state[bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def values(self) -> Dict[LabelValues, List[float]]:
+        totals: Dict[LabelValues, List[float]] = {}
+        for shard in self._shards.snapshots():
+            for labels, state in shard.items():
+                total = totals.setdefault(labels, [0] * len(state))
+                for i, value in enumerate(list(state)):
+                    total[i] += value
+        return totals
+
+    def samples(self):
+        for labels, state in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield (
+                    f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} "
+                    f"{_format_value(cumulative)}"
+                )
+            label_text = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {_format_value(state[-2])}"
+            yield f"{self.name}_count{label_text} {_format_value(state[-1])}"
+
+
+# read at scrape time, for values something else already tracks
+class CallbackMetric(Metric):
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        collect: Callable[[], Iterable[Tuple[LabelValues, float]]],
+        type: str = "gauge",
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.type = type
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in self.collect():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f"# {metric.name} failed: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = LATENCY_BUCKETS,
+) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def callback(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str],
+    collect: Callable[[], Iterable[Tuple[LabelValues, float]]],
+    type: str = "gauge",
+) -> CallbackMetric:
+    return REGISTRY.register(CallbackMetric(name, documentation, labelnames, collect, type))
+
+
+ingest_messages = counter(
+    "chat_ingest_messages_total", "Messages written per stream", ["stream_id"]
+)
+flush_duration = histogram(
+    "chat_flush_duration_seconds", "Time spent in flush_batch", ["platform"]
+)
+flush_batch_size = histogram(
+    "chat_flush_batch_size", "Messages per flushed batch", ["platform"], SIZE_BUCKETS
+)
+flush_errors = counter("chat_flush_errors_total", "Failed batch flushes", ["platform"])
+read_retries = counter(
+    "db_read_retries_total", "db_retry_on_lock retries after SQLITE_BUSY/SQLITE_LOCKED"
+)
+facet_cache_lookups = counter(
+    "chat_facet_cache_lookups_total", "Facet count lookups by result", ["result"]
+)
+# handlers with unflushed messages, read for the pending queue gauge
+pending_handlers = weakref.WeakSet()
+request_duration = histogram(
+    "http_request_duration_seconds",
+    "Request latency until the response body is sent",
+    ["method", "route", "status"],
+)
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            request_duration.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                route.path if route is not None else "unmatched",
+                str(status[0]),
+            )
@@ -0,0 +1,205 @@
+from collections import deque
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import asyncio
+import os
+import threading
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from models.dicts import MessageGroup
+from models.schema import AlertHit, AlertRule
+
+RULE_FIELDS = ("message", "author")
+# how often handlers look for rules changed by another process
+ALERT_RULES_REFRESH = float(os.environ.get("ALERT_RULES_REFRESH", "5"))
+# groups whose text the author wrote; bans and removals repeat other messages
+ALERT_GROUPS = (MessageGroup.messages.value, MessageGroup.subs.value)
+
+
+class AhoCorasick:
+    """Finds every pattern in a text in one pass over it.
+
+    The cost per text depends on its length and the number of matches, not on
+    how many patterns there are.
+    """
+
+    def __init__(self, patterns: Dict[str, Iterable[int]]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        # values of every pattern ending in a state, the ones of its suffixes included
+        self.out: List[Tuple[int, ...]] = [()]
+        for pattern, values in patterns.items():
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                state = next_state
+            self.out[state] += tuple(values)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.out[next_state] += self.out[self.fail[next_state]]
+
+    def __len__(self) -> int:
+        return len(self.goto) - 1
+
+    def search(self, text: str) -> Iterator[int]:
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                yield from out[state]
+
+
+class AlertMatcher:
+    def __init__(self, rules: Iterable[AlertRule] = ()):
+        patterns: Dict[str, List[int]] = {}
+        self.authors: Dict[str, List[int]] = {}
+        self.platforms: Dict[int, Optional[int]] = {}
+        for rule in rules:
+            key = rule.pattern.casefold()
+            target = self.authors if rule.field == "author" else patterns
+            target.setdefault(key, []).append(rule.id)
+            self.platforms[rule.id] = rule.platform
+        self.automaton = AhoCorasick(patterns) if patterns else None
+
+    def __bool__(self) -> bool:
+        return bool(self.platforms)
+
+    def match(self, platform: int, message: Optional[str], names: Iterable[Optional[str]] = ()) -> List[int]:
+        # ids of the rules a message sets off, each once
+        rule_ids = set()
+        if self.automaton and message:
+            rule_ids.update(self.automaton.search(message.casefold()))
+        if self.authors:
+            for name in names:
+                if name:
+                    rule_ids.update(self.authors.get(name.casefold(), ()))
+        return sorted(
+            rule_id
+            for rule_id in rule_ids
+            if self.platforms[rule_id] in (None, platform)
+        )
+
+
+class RuleSet:
+    # the compiled rules every handler matches against, swapped as a whole
+    # when the rules change
+    def __init__(self):
+        self.matcher = AlertMatcher()
+        self.signature = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def refresh(self, db: Session, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and self.checked_at is not None and now - self.checked_at < ALERT_RULES_REFRESH:
+            return
+        with self.lock:
+            self.checked_at = now
+            signature = tuple(
+                db.execute(
+                    select(func.count(), func.max(AlertRule.id), func.max(AlertRule.updated_at))
+                ).one()
+            )
+            if signature == self.signature:
+                return
+            self.matcher = AlertMatcher(db.query(AlertRule).all())
+            self.signature = signature
+
+
+rules = RuleSet()
+
+
+class AlertBroker:
+    # wakes the event streams of connected clients once new hits are committed
+    def __init__(self):
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self) -> asyncio.Event:
+        event = asyncio.Event()
+        with self.lock:
+            self.subscribers.add((asyncio.get_running_loop(), event))
+        return event
+
+    def unsubscribe(self, event: asyncio.Event) -> None:
+        with self.lock:
+            self.subscribers = {s for s in self.subscribers if s[1] is not event}
+
+    def notify(self) -> None:
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for loop, event in subscribers:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # the loop closed before the client unsubscribed
+                pass
+
+
+broker = AlertBroker()
+
+
+def matchable(record) -> bool:
+    return (
+        record.message_group_id in ALERT_GROUPS
+        and getattr(record, "target_message_id", None) is None
+    )
+
+
+def hit_row(rule_id: int, record, author: Optional[str]) -> dict:
+    return {
+        "rule_id": rule_id,
+        "stream_id": record.stream_id,
+        "message_id": record.message_id,
+        "timestamp": record.timestamp,
+        "author": author,
+        "message": record.message,
+        "created_at": datetime.now(),
+    }
+
+
+def list_hits(
+    db: Session,
+    rule_id: Optional[int] = None,
+    stream_id: Optional[int] = None,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    limit: int = 100,
+) -> List[AlertHit]:
+    # newest first, or oldest first when reading on from after
+    query = db.query(AlertHit)
+    if rule_id is not None:
+        query = query.filter(AlertHit.rule_id == rule_id)
+    if stream_id is not None:
+        query = query.filter(AlertHit.stream_id == stream_id)
+    if before is not None:
+        query = query.filter(AlertHit.id < before)
+    if after is not None:
+        return query.filter(AlertHit.id > after).order_by(AlertHit.id).limit(limit).all()
+    return query.order_by(AlertHit.id.desc()).limit(limit).all()
+
+
+def last_hit_id(db: Session) -> int:
+    return db.execute(select(func.max(AlertHit.id))).scalar() or 0
@@ -0,0 +1,136 @@
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from models.schema import ChatAuthor
+
+# (author_id, name) identifies an author within a platform
+AuthorKey = Tuple[Optional[str], Optional[str]]
+
+LOOKUP_CHUNK_SIZE = 200
+
+
+class AuthorInfo:
+    __slots__ = ("author_id", "name", "display_name", "colour")
+
+    def __init__(
+        self,
+        author_id: Optional[str],
+        name: Optional[str],
+        display_name: Optional[str] = None,
+        colour: Optional[str] = None,
+    ):
+        self.author_id = author_id
+        self.name = name
+        self.display_name = display_name
+        self.colour = colour
+
+    @property
+    def key(self) -> AuthorKey:
+        return (self.author_id, self.name)
+
+
+def _lookup_key(key: AuthorKey) -> Tuple[str, str]:
+    return (key[0] or "", key[1] or "")
+
+
+# joining a VALUES list searches ux_chat_authors_key on all three columns; a
+# row-value IN over the coalesce expressions only uses the platform prefix and
+# gets slower with every author in the table
+@lru_cache(maxsize=None)
+def _lookup_statement(size: int):
+    keys = ", ".join(f"(:a{i}, :n{i})" for i in range(size))
+    return text(
+        f"WITH lookup(author_id, name) AS (VALUES {keys}) "
+        "SELECT chat_authors.id, chat_authors.author_id, chat_authors.name, "
+        "chat_authors.display_name, chat_authors.colour "
+        "FROM lookup JOIN chat_authors ON chat_authors.platform = :platform "
+        "AND coalesce(chat_authors.author_id, '') = lookup.author_id "
+        "AND coalesce(chat_authors.name, '') = lookup.name"
+    )
+
+
+class AuthorCache:
+    def __init__(self, platform: int, capacity: int = 50_000):
+        self.platform = platform
+        self.capacity = capacity
+        # key -> [ref, display_name, colour]
+        self.entries: "OrderedDict[AuthorKey, list]" = OrderedDict()
+
+    def _remember(self, key: AuthorKey, entry: list):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def _select(self, db: Session, keys: List[AuthorKey]) -> Dict[AuthorKey, list]:
+        found = {}
+        for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+            chunk = [_lookup_key(key) for key in keys[start:start + LOOKUP_CHUNK_SIZE]]
+            params = {"platform": self.platform}
+            for i, (author_id, name) in enumerate(chunk):
+                params[f"a{i}"] = author_id
+                params[f"n{i}"] = name
+            rows = db.execute(_lookup_statement(len(chunk)), params)
+            for ref, author_id, name, display_name, colour in rows:
+                found[(author_id, name)] = [ref, display_name, colour]
+        return found
+
+    def resolve(self, db: Session, authors: Iterable[AuthorInfo]) -> Dict[AuthorKey, int]:
+        latest: Dict[AuthorKey, AuthorInfo] = {}
+        for author in authors:
+            if author.author_id is None and author.name is None:
+                continue
+            previous = latest.get(author.key)
+            if previous:
+                author.display_name = author.display_name or previous.display_name
+                author.colour = author.colour or previous.colour
+            latest[author.key] = author
+
+        found: Dict[AuthorKey, list] = {}
+        for key in latest:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+                found[key] = entry
+
+        missing = [key for key in latest if key not in found]
+        if missing:
+            found.update(self._select(db, missing))
+            new_keys = [key for key in missing if key not in found]
+            if new_keys:
+                db.execute(
+                    insert(ChatAuthor).on_conflict_do_nothing(),
+                    [
+                        {
+                            "platform": self.platform,
+                            "author_id": latest[key].author_id,
+                            "name": latest[key].name,
+                            "display_name": latest[key].display_name,
+                            "colour": latest[key].colour,
+                        }
+                        for key in new_keys
+                    ],
+                )
+                found.update(self._select(db, new_keys))
+
+        refs: Dict[AuthorKey, int] = {}
+        for key, author in latest.items():
+            entry = found[key]
+            self._remember(key, entry)
+            ref, display_name, colour = entry
+            new_display_name = author.display_name or display_name
+            new_colour = author.colour or colour
+            if (new_display_name, new_colour) != (display_name, colour):
+                db.execute(
+                    update(ChatAuthor)
+                    .where(ChatAuthor.id == ref)
+                    .values(display_name=new_display_name, colour=new_colour)
+                )
+                entry[1], entry[2] = new_display_name, new_colour
+            refs[key] = ref
+        return refs
@@ -1,62 +1,296 @@
 from abc import ABC, abstractmethod
+from datetime import datetime
+from sqlalchemy import insert, select, update
 from sqlalchemy.orm import Session
 from typing import Dict, Any, Optional
+import os
 import time
 import sys
 
-from models.schema import Stream
-from database import SessionLocal, db_retry_on_lock
+from models.schema import AlertHit, Stream
+from models.dicts import DownloadStatus, PlatformType
+from models.author_cache import AuthorCache
+from models.flush_policy import AdaptiveFlushPolicy
+from models.records import rows_by_model
+from models import alerts, revenue, search
+from models.duplicates import DuplicateDetector
+from models.staging import BULK_MERGE_ROWS, STAGING_TABLES, merge_staged_messages
+from models.timestamps import from_micros
+import database
+import metrics
+
+# sessions are closed (or expunged when someone else owns them) after this many
+# flushes, so a download that runs for days holds no per-message orm state
+SESSION_RECYCLE_FLUSHES = int(os.environ.get("SESSION_RECYCLE_FLUSHES", "100"))
 
 class BaseDataHandler(ABC):
-    def __init__(self, db: Optional[Session] = None, flush_interval: int = 10, batch_size: int = 100):
-        self.db = db if db else SessionLocal()
+    platform: int
+    message_class: type
+
+    def __init__(
+        self,
+        db: Optional[Session] = None,
+        message_db: Optional[Session] = None,
+        bulk: bool = False,
+        policy=None,
+    ):
+        self.db = db if db else database.SessionLocal()
         self.owns_db = db is None
+        # per-stream shard session in sharded storage mode, otherwise the catalog session
+        self.message_db = message_db if message_db else self.db
         self.message_batch = []
-        self.batch_size = batch_size
+        # leading records of the batch already committed to the shard, see _write_rows
+        self.rows_written = 0
+        self.author_cache = AuthorCache(self.platform)
         self.stream_message_counts = {}
-        self.last_flush_time = time.time()
-        self.flush_interval = flush_interval
+        # newest chat timestamp per stream, written with the counts
+        self.stream_last_timestamps = {}
+        # spool position of the newest queued record per stream, written with the
+        # counts; spool_checkpoint holds the positions that are committed
+        self.stream_spool_positions = {}
+        self.spool_checkpoint = {}
+        # alert_hits rows of the queued messages, written with them
+        self.alert_hits = []
+        # near-duplicate detection per stream, see models.duplicates
+        self.duplicates: Dict[int, DuplicateDetector] = {}
+        self.flushes = 0
+        # decides when the batch is written, see models.flush_policy
+        self.policy = policy if policy else AdaptiveFlushPolicy()
+        self.first_queued_at = None
+        # bulk mode writes into the unindexed staging table, see merge_staged
+        self.bulk = bulk
+        self.staged_rows = 0
+        self.staged_stream_ids = set()
+        self.platform_label = PlatformType(self.platform).name.lower()
+        metrics.pending_handlers.add(self)
 
     def flush_batch(self):
         if not self.message_batch:
             return
 
         def _flush_operation():
-            self.db.add_all(self.message_batch)
+            # streams being deleted, or already purged while this batch waited,
+            # get no rows; a purged stream's shard is gone and must stay gone
+            batch_stream_ids = (
+                self.stream_message_counts.keys() | self.stream_spool_positions.keys()
+            )
+            live_stream_ids = set(
+                self.db.execute(
+                    select(Stream.id).where(
+                        Stream.id.in_(list(batch_stream_ids)),
+                        Stream.download_status.is_distinct_from(DownloadStatus.DELETING.value),
+                    )
+                ).scalars()
+            )
+            deleting_stream_ids = batch_stream_ids - live_stream_ids
+            self._write_rows(deleting_stream_ids, "flush")
 
-            for stream_id, count in self.stream_message_counts.items():
-                stream = self.db.query(Stream).filter(Stream.id == stream_id).first()
-                if stream:
-                    stream.message_count += count
+            # plain updates, the stream row never enters the identity map
+            for stream_id in live_stream_ids:
+                count = self.stream_message_counts.get(stream_id, 0)
+                values = {"message_count": Stream.message_count + count}
+                last_timestamp = self.stream_last_timestamps.get(stream_id)
+                if last_timestamp is not None:
+                    values["last_message_timestamp"] = from_micros(last_timestamp)
+                position = self.stream_spool_positions.get(stream_id)
+                if position is not None:
+                    values["spool_segment"], values["spool_offset"] = position
+                self.db.execute(update(Stream).where(Stream.id == stream_id).values(**values))
 
-            self.db.commit()
+            messages = [m for m in self.message_batch if m.stream_id not in deleting_stream_ids]
+            search.record_authors(self.db, self.platform, messages)
+            revenue.record_revenue(self.db, self.platform, messages)
+            hits = [h for h in self.alert_hits if h["stream_id"] not in deleting_stream_ids]
+            if hits:
+                self.db.execute(insert(AlertHit), hits)
+            return messages
 
+        started = time.perf_counter()
+        batch_size = len(self.message_batch)
+        try:
+            # picks up rules changed by other processes, a read kept out of the write lock
+            database.db_retry_on_lock(lambda: alerts.rules.refresh(self.db))
+            flushed = self._run_write(_flush_operation, "flush")
+            if self.bulk:
+                self.staged_rows += len(flushed)
+                self.staged_stream_ids.update(m.stream_id for m in flushed)
+            for stream_id in {m.stream_id for m in flushed}:
+                metrics.ingest_messages.inc(
+                    self.stream_message_counts.get(stream_id, 0), str(stream_id)
+                )
+            if self.alert_hits:
+                alerts.broker.notify()
+            self.alert_hits.clear()
             self.message_batch.clear()
+            self.rows_written = 0
             self.stream_message_counts.clear()
-
-        try:
-            db_retry_on_lock(_flush_operation)
-            self.last_flush_time = time.time()
+            self.stream_last_timestamps.clear()
+            self.spool_checkpoint.update(self.stream_spool_positions)
+            self.stream_spool_positions.clear()
+            self.first_queued_at = None
         except Exception as e:
+            metrics.flush_errors.inc(1, self.platform_label)
             print(f"Error flushing batch: {e}", file=sys.stderr)
             sys.stdout.flush()
+            self.message_db.rollback()
             self.db.rollback()
+            # refs inserted by the failed transaction may not exist
+            self.author_cache.entries.clear()
+            return
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.flush_duration.observe(elapsed, self.platform_label)
+
+        self.policy.record_flush(batch_size, elapsed)
+        metrics.flush_batch_size.observe(batch_size, self.platform_label)
+        if self.staged_rows >= BULK_MERGE_ROWS:
+            self.merge_staged()
+        self.flushes += 1
+        if self.flushes % SESSION_RECYCLE_FLUSHES == 0:
+            self.recycle_sessions()
+
+    def recycle_sessions(self):
+        for session, owned in (
+            (self.message_db, self.message_db is not self.db),
+            (self.db, self.owns_db),
+        ):
+            if owned:
+                # a closed session hands its connection back and starts over on next use
+                session.close()
+            else:
+                session.expunge_all()
+
+    def merge_staged(self):
+        if not self.staged_stream_ids:
+            return
+        model_class = self.message_class
+        try:
+            for stream_id in list(self.staged_stream_ids):
+                database.run_write(
+                    self.message_db,
+                    lambda: merge_staged_messages(self.message_db, model_class, stream_id),
+                    "merge",
+                )
+                # staged rows only show up now, the stream's watermark has to move
+                database.run_write(
+                    self.db,
+                    lambda: self.db.execute(
+                        update(Stream).where(Stream.id == stream_id).values(updated_at=datetime.now())
+                    ),
+                    "merge",
+                )
+                self.staged_stream_ids.discard(stream_id)
+            self.staged_rows = 0
+        except Exception as e:
+            print(f"Error merging staged messages: {e}", file=sys.stderr)
+            sys.stdout.flush()
+            self.message_db.rollback()
+
+    def _write_rows(self, deleting_stream_ids, owner: str):
+        messages = [
+            m for m in self.message_batch[self.rows_written:]
+            if m.stream_id not in deleting_stream_ids
+        ]
+        # a purged stream's shard is gone, opening it again would recreate the file
+        if not messages:
+            return
+
+        def write():
+            refs = self.author_cache.resolve(
+                self.message_db, [m.author for m in messages if m.author]
+            )
+            for m in messages:
+                if m.author:
+                    m.author_ref = refs.get(m.author.key)
+
+            # records become rows only here, inserted without the orm unit of work
+            for model, rows in rows_by_model(messages).items():
+                table = STAGING_TABLES[model] if self.bulk else model.__table__
+                self.message_db.execute(insert(table), rows)
+
+        if self.message_db is self.db:
+            write()
+            return
+        # the shard commits on its own, inside the catalog transaction; when the
+        # catalog step is retried or flushed again, its rows are not inserted twice
+        database.run_write(self.message_db, write, owner, self.author_cache.entries.clear)
+        self.rows_written = len(self.message_batch)
+
+    def _run_write(self, operation, owner: str):
+        # refs inserted by a rolled back transaction may not exist; catalog
+        # lock first, then the shard, the same order everywhere
+        return database.run_write(self.db, operation, owner, self.author_cache.entries.clear)
 
     def close(self):
         self.flush_batch()
+        self.merge_staged()
+        if self.message_db is not self.db:
+            self.message_db.close()
         if self.owns_db:
             self.db.close()
 
+    def queue_record(self, chat_message, stream_id: Optional[int]) -> None:
+        # the process ingest mode clusters in the child already
+        if chat_message.cluster_id is None and chat_message.message:
+            self.duplicate_detector(stream_id).assign_record(chat_message)
+        self._match_alerts(chat_message, stream_id)
+        self._queue_message(chat_message, stream_id)
+        self._check_flush_conditions()
+
+    def _queue_message(self, chat_message, stream_id: Optional[int]) -> None:
+        if not self.message_batch:
+            self.first_queued_at = time.monotonic()
+        self.message_batch.append(chat_message)
+        self._increment_message_count(stream_id)
+
+    def duplicate_detector(self, stream_id: Optional[int]) -> DuplicateDetector:
+        detector = self.duplicates.get(stream_id)
+        if detector is None:
+            detector = self.duplicates[stream_id] = DuplicateDetector()
+        return detector
+
+    def _match_alerts(self, chat_message, stream_id: Optional[int]) -> None:
+        matcher = alerts.rules.matcher
+        if not matcher or not stream_id or not alerts.matchable(chat_message):
+            return
+        author = chat_message.author
+        names = (author.name, author.display_name) if author else ()
+        for rule_id in matcher.match(self.platform, chat_message.message, names):
+            self.alert_hits.append(
+                alerts.hit_row(rule_id, chat_message, author and (author.display_name or author.name))
+            )
+
+    def track_timestamp(self, stream_id: Optional[int], timestamp: Optional[int]) -> None:
+        if stream_id and timestamp is not None:
+            previous = self.stream_last_timestamps.get(stream_id)
+            if previous is None or timestamp > previous:
+                self.stream_last_timestamps[stream_id] = timestamp
+
+    def track_spool_position(self, stream_id: Optional[int], position) -> None:
+        if stream_id:
+            self.stream_spool_positions[stream_id] = position
+
     def _increment_message_count(self, stream_id: Optional[int]) -> None:
         if stream_id:
             self.stream_message_counts[stream_id] = self.stream_message_counts.get(stream_id, 0) + 1
 
     def _check_flush_conditions(self):
-        current_time = time.time()
-        if (len(self.message_batch) >= self.batch_size or
-            current_time - self.last_flush_time >= self.flush_interval):
+        if not self.message_batch:
+            return
+        oldest_age = time.monotonic() - self.first_queued_at
+        if self.policy.due(len(self.message_batch), oldest_age):
             self.flush_batch()
 
+    @classmethod
+    def requires_session(cls, data: Dict[str, Any]) -> bool:
+        # messages build_record cannot turn into a record without reading stored rows
+        return False
+
+    @classmethod
+    @abstractmethod
+    def build_record(cls, data: Dict[str, Any], stream_id: Optional[int] = None):
+        pass
+
     @abstractmethod
     def save_message(
         self, data: Dict[str, Any], stream_id: Optional[int] = None
@@ -6,6 +6,15 @@ class DownloadStatus(enum.Enum):
     PAUSED = "paused"
     COMPLETED = "completed"
     ERROR = "error"
+    DELETING = "deleting"
+
+
+# what the API wants a download job to do, workers act on it at their next heartbeat
+class JobState(enum.Enum):
+    RUN = "run"
+    PAUSE = "pause"
+    STOP = "stop"
+    DONE = "done"
 
 
 class PlatformType(enum.Enum):
@@ -13,6 +22,16 @@ class PlatformType(enum.Enum):
     YOUTUBE = 2
 
 
+def get_platform(url: str) -> PlatformType:
+    url = url.lower()
+    if "twitch.tv" in url:
+        return PlatformType.TWITCH
+    elif "youtube.com" in url:
+        return PlatformType.YOUTUBE
+    else:
+        raise ValueError("Unsupported platform")
+
+
 class MessageGroup(enum.Enum):
     messages = 1
     bans = 2
@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional
+import os
+import random
+import re
+import zlib
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from models.queries import get_model_class
+from models.schema import Stream
+from models.timestamps import to_micros
+
+# messages a stream remembers for matching, older clusters are forgotten
+DUPLICATE_WINDOW = int(os.environ.get("DUPLICATE_WINDOW", "10000"))
+
+# minhash signature of one-permutation hashing: every shingle hash lands in one
+# of BINS bins, each bin keeps its smallest value; BANDS groups of ROWS bins are
+# the lsh bucket keys, so two messages share a bucket with probability
+# j ** ROWS per band for a jaccard similarity j (about 50% at j = 0.7)
+BINS = 16
+ROWS = 4
+BANDS = BINS // ROWS
+_EMPTY = 1 << 32
+
+_REPEATS = re.compile(r"(.)\1{2,}")
+_SPACES = re.compile(r"\s+")
+
+_cluster_ids = random.Random()
+
+
+def _normalize(text: str) -> str:
+    # "LOOOOL  spam" and "lool spam" are the same message
+    return _SPACES.sub(" ", _REPEATS.sub(r"\1\1", text.casefold())).strip()
+
+
+def signature(text: str) -> Optional[List[int]]:
+    text = _normalize(text)
+    if not text:
+        return None
+    bins = [_EMPTY] * BINS
+    for start in range(max(1, len(text) - 2)):
+        h = zlib.crc32(text[start:start + 3].encode())
+        index = h % BINS
+        value = h // BINS
+        if value < bins[index]:
+            bins[index] = value
+    # short messages leave bins empty, they borrow from the next filled one so
+    # two different short messages do not agree on empty bins
+    for index in range(BINS):
+        if bins[index] == _EMPTY:
+            for offset in range(1, BINS):
+                value = bins[(index + offset) % BINS]
+                if value != _EMPTY:
+                    bins[index] = value + offset * _EMPTY
+                    break
+    return bins
+
+
+class DuplicateDetector:
+    """Assigns near-identical messages of one stream the same cluster id.
+
+    Memory is bounded by window: the lsh buckets of the last window messages
+    are kept, a cluster that keeps getting messages stays in them.
+    """
+
+    def __init__(self, window: int = DUPLICATE_WINDOW):
+        self.capacity = window * BANDS
+        self.buckets: "OrderedDict[int, int]" = OrderedDict()
+
+    def assign(self, text: Optional[str]) -> Optional[int]:
+        bins = signature(text) if text else None
+        if bins is None:
+            return None
+        keys = [hash((band,) + tuple(bins[band * ROWS:(band + 1) * ROWS])) for band in range(BANDS)]
+        cluster_id = None
+        for key in keys:
+            cluster_id = self.buckets.get(key)
+            if cluster_id is not None:
+                break
+        if cluster_id is None:
+            # random, so restarts and other processes do not reuse ids; 52 bits
+            # stay exact as javascript numbers
+            cluster_id = _cluster_ids.getrandbits(52)
+        buckets = self.buckets
+        for key in keys:
+            buckets[key] = cluster_id
+            buckets.move_to_end(key)
+        while len(buckets) > self.capacity:
+            buckets.popitem(last=False)
+        return cluster_id
+
+    def assign_record(self, record) -> None:
+        record.cluster_id = self.assign(record.message)
+
+
+def top_clusters(
+    db: Session,
+    stream: Stream,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    limit: int = 20,
+    min_size: int = 2,
+) -> List[dict]:
+    model_class = get_model_class(stream.platform)
+    conditions = [model_class.stream_id == stream.id, model_class.cluster_id.is_not(None)]
+    if date_from:
+        conditions.append(model_class.timestamp > to_micros(date_from))
+    if date_to:
+        conditions.append(model_class.timestamp < to_micros(date_to))
+    size = func.count().label("size")
+    rows = db.execute(
+        select(
+            model_class.cluster_id,
+            size,
+            func.min(model_class.timestamp),
+            func.max(model_class.timestamp),
+            func.min(model_class.id),
+        )
+        .where(*conditions)
+        .group_by(model_class.cluster_id)
+        .having(size >= min_size)
+        .order_by(size.desc(), model_class.cluster_id)
+        .limit(limit)
+    ).all()
+    # the first message of each cluster stands for it
+    samples = dict(
+        db.execute(
+            select(model_class.id, model_class.message).where(
+                model_class.id.in_([row[4] for row in rows])
+            )
+        ).all()
+    )
+    return [
+        {
+            "cluster_id": cluster_id,
+            "count": count,
+            "first_timestamp": first,
+            "last_timestamp": last,
+            "message": samples.get(first_id),
+        }
+        for cluster_id, count, first, last, first_id in rows
+    ]
@@ -0,0 +1,258 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, IO, Iterable, Iterator, List, Tuple
+import csv
+import io
+import json
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+
+from models.dicts import PlatformType, MessageGroup
+from models.timestamps import from_micros
+
+FILE_FORMATS = ("ndjson", "csv", "parquet")
+ARCHIVE_FORMATS = {"zip": "application/zip", "tar": "application/x-tar"}
+
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", "4"))
+EXPORT_SPOOL_SIZE = 8 * 1024 * 1024
+EXPORT_YIELD_PER = 1000
+
+TWITCH_FIELDNAMES = [
+    "message_type",
+    "time",
+    "message",
+    "author_name",
+    "system_message",
+    "ban_type",
+    "is_subscriber",
+    "is_moderator",
+]
+YOUTUBE_FIELDNAMES = [
+    "message_type",
+    "time",
+    "message",
+    "author_name",
+    "ban_type",
+    "is_subscriber",
+    "is_moderator",
+]
+
+
+def export_fieldnames(platform: int) -> List[str]:
+    if platform == PlatformType.TWITCH.value:
+        return TWITCH_FIELDNAMES
+    return YOUTUBE_FIELDNAMES
+
+
+def export_row(msg, platform: int) -> Dict[str, Any]:
+    msg_dict = {
+        "message_type": MessageGroup(msg.message_group_id).name,
+        "time": from_micros(msg.timestamp).isoformat() if msg.timestamp else None,
+        "message": msg.message,
+    }
+
+    if platform == PlatformType.TWITCH.value:
+        msg_dict.update(
+            {
+                "author_name": msg.author_display_name or msg.author_name,
+                "system_message": msg.system_message,
+                "ban_type": msg.ban_type,
+                "is_subscriber": msg.is_subscriber,
+            }
+        )
+    elif platform == PlatformType.YOUTUBE.value:
+        msg_dict.update(
+            {
+                "author_name": msg.author_name,
+                "ban_type": ("removed" if msg.target_message_id else "retracted")
+                if msg.message_group_id == MessageGroup.bans.value
+                else None,
+                "is_subscriber": msg.is_member,
+            }
+        )
+    msg_dict.update(
+        {
+            "is_moderator": msg.is_moderator,
+        }
+    )
+    return msg_dict
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def write_ndjson(rows: Iterable[Dict[str, Any]], fieldnames: List[str], out: IO[bytes]):
+    for row in rows:
+        out.write(json.dumps(row, ensure_ascii=False).encode("utf-8"))
+        out.write(b"\n")
+
+
+def write_csv(rows: Iterable[Dict[str, Any]], fieldnames: List[str], out: IO[bytes]):
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+    try:
+        writer = csv.DictWriter(text, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    finally:
+        text.detach()
+
+
+def write_parquet(
+    rows: Iterable[Dict[str, Any]],
+    fieldnames: List[str],
+    out: IO[bytes],
+    row_group_size: int = 50_000,
+):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [
+            (name, pa.bool_() if name.startswith("is_") else pa.string())
+            for name in fieldnames
+        ]
+    )
+    with pq.ParquetWriter(out, schema) as writer:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= row_group_size:
+                writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+                chunk = []
+        if chunk:
+            writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+
+
+FILE_WRITERS: Dict[str, Callable] = {
+    "ndjson": write_ndjson,
+    "csv": write_csv,
+    "parquet": write_parquet,
+}
+
+
+class ExportJob:
+    def __init__(self, name: str, format: str, produce: Callable[[], Tuple[Iterable[Dict[str, Any]], List[str]]]):
+        self.name = name
+        self.format = format
+        self.produce = produce
+
+    def run(self) -> Tuple["ExportJob", IO[bytes]]:
+        out = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+        try:
+            rows, fieldnames = self.produce()
+            FILE_WRITERS[self.format](rows, fieldnames, out)
+            out.seek(0)
+        except Exception:
+            out.close()
+            raise
+        return self, out
+
+
+# zipfile/tarfile write into this sink; its contents are drained after every file
+class _ArchiveBuffer:
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        if data:
+            self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+# TarFile.addfile copies a whole member in one call; writing the tar framing
+# here lets the member data go out in chunks like the zip entries do
+class _TarWriter:
+    def __init__(self, out: _ArchiveBuffer):
+        self.out = out
+        self.offset = 0
+
+    def write(self, data: bytes):
+        self.out.write(data)
+        self.offset += len(data)
+
+    def header(self, info: tarfile.TarInfo):
+        self.write(info.tobuf(tarfile.DEFAULT_FORMAT, tarfile.ENCODING, "surrogateescape"))
+
+    def pad(self, size: int):
+        remainder = size % tarfile.BLOCKSIZE
+        if remainder:
+            self.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+
+    def close(self):
+        self.write(tarfile.NUL * (tarfile.BLOCKSIZE * 2))
+        remainder = self.offset % tarfile.RECORDSIZE
+        if remainder:
+            self.write(tarfile.NUL * (tarfile.RECORDSIZE - remainder))
+
+
+def _copy_chunks(src: IO[bytes], dest, buffer: _ArchiveBuffer):
+    while True:
+        chunk = src.read(256 * 1024)
+        if not chunk:
+            break
+        dest.write(chunk)
+        if len(buffer.chunks) > 16:
+            yield buffer.drain()
+
+
+def _add_to_archive(archive, archive_format: str, name: str, src: IO[bytes], buffer: _ArchiveBuffer):
+    if archive_format == "zip":
+        with archive.open(name, "w", force_zip64=True) as dest:
+            yield from _copy_chunks(src, dest, buffer)
+    else:
+        # the spooled file knows its size, so the header can go out first
+        src.seek(0, os.SEEK_END)
+        info = tarfile.TarInfo(name)
+        info.size = src.tell()
+        info.mtime = int(time.time())
+        src.seek(0)
+        archive.header(info)
+        yield from _copy_chunks(src, archive, buffer)
+        archive.pad(info.size)
+    yield buffer.drain()
+
+
+def stream_archive(
+    jobs: List[ExportJob], archive_format: str, max_workers: int = EXPORT_WORKERS
+) -> Iterator[bytes]:
+    buffer = _ArchiveBuffer()
+    if archive_format == "zip":
+        archive = zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED)
+    else:
+        archive = _TarWriter(buffer)
+
+    workers = max(1, min(max_workers, len(jobs)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export") as pool:
+        futures = [pool.submit(job.run) for job in jobs]
+        try:
+            for future in as_completed(futures):
+                job, out = future.result()
+                try:
+                    yield from _add_to_archive(
+                        archive, archive_format, f"{job.name}.{job.format}", out, buffer
+                    )
+                finally:
+                    out.close()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    archive.close()
+    yield buffer.drain()
+
@@ -0,0 +1,105 @@
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import os
+import threading
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from models.dicts import PlatformType
+from models.queries import banned_authors_query, build_messages_query, get_model_class
+from models.schema import Stream
+import metrics
+
+# filter sets whose counts are kept, per process
+FACETS_CACHE_SIZE = int(os.environ.get("FACETS_CACHE_SIZE", "256"))
+
+# message_group_id -> (messages, moderators, subscribers, banned users)
+Counts = Dict[int, Tuple[int, int, int, int]]
+
+
+def watermark(stream: Stream) -> tuple:
+    # every flush and every merge of staged rows moves it, see BaseDataHandler
+    return stream.message_count, stream.updated_at
+
+
+def count_facets(
+    message_db: Session,
+    stream: Stream,
+    message_group_ids: List[int],
+    include_banned_users: Optional[bool] = True,
+    moderators: Optional[bool] = False,
+    username: Optional[str] = None,
+    message: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    cluster_id: Optional[int] = None,
+) -> Counts:
+    # every facet of the filter panel in one pass over the rows the message
+    # list shows for the same filters, banned users' chat unioned in included
+    model_class = get_model_class(stream.platform)
+    subscriber = (
+        model_class.is_subscriber
+        if stream.platform == PlatformType.TWITCH.value
+        else model_class.is_member
+    )
+    query = build_messages_query(
+        message_db,
+        stream,
+        message_group_ids,
+        includeBannedUsers=include_banned_users,
+        moderators=moderators,
+        username=username,
+        message=message,
+        dateFrom=date_from,
+        dateTo=date_to,
+        clusterId=cluster_id,
+    )
+    rows = (
+        query.with_entities(
+            model_class.message_group_id,
+            func.count(),
+            func.count().filter(model_class.is_moderator),
+            func.count().filter(subscriber),
+            func.count().filter(model_class.author_ref.in_(banned_authors_query(stream))),
+        )
+        .group_by(model_class.message_group_id)
+        .all()
+    )
+    return {group_id: tuple(counts) for group_id, *counts in rows}
+
+
+class FacetCache:
+    """Facet counts by stream and filter set, valid while the stream's watermark
+    stays the same; a panel polled by many clients costs one pass per flush.
+    """
+
+    def __init__(self, size: int = FACETS_CACHE_SIZE):
+        self.size = size
+        self.entries: "OrderedDict[tuple, Tuple[tuple, Counts]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple, mark: tuple) -> Optional[Counts]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != mark:
+                metrics.facet_cache_lookups.inc(1, "miss")
+                return None
+            self.entries.move_to_end(key)
+        metrics.facet_cache_lookups.inc(1, "hit")
+        return entry[1]
+
+    def put(self, key: tuple, mark: tuple, counts: Counts) -> None:
+        with self.lock:
+            self.entries[key] = (mark, counts)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+cache = FacetCache()
+
+
+def totals(counts: Counts) -> Tuple[int, int, int, int]:
+    return tuple(sum(value[i] for value in counts.values()) for i in range(4))
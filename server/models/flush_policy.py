@@ -0,0 +1,99 @@
+from typing import Optional
+import os
+import threading
+import time
+
+FLUSH_MAX_DELAY = float(os.environ.get("FLUSH_MAX_DELAY", "5"))
+FLUSH_MAX_BATCH = int(os.environ.get("FLUSH_MAX_BATCH", "2000"))
+
+
+class FixedFlushPolicy:
+    def __init__(self, batch_size: int = 100, flush_interval: float = 10):
+        self.batch_size = batch_size
+        self.linger = flush_interval
+
+    def due(self, pending: int, oldest_age: float) -> bool:
+        return pending >= self.batch_size or (pending > 0 and oldest_age >= self.linger)
+
+    def record_flush(self, messages: int, seconds: float):
+        pass
+
+    def state(self) -> dict:
+        return {"batch_size": self.batch_size, "linger": self.linger}
+
+
+# a quiet stream flushes shortly after a message arrives; as the message rate
+# approaches busy_rate the linger stretches to max_delay so each commit carries
+# more rows, and slow commits (lock waits included) stretch it further so
+# committing never takes more than max_commit_share of the time
+class AdaptiveFlushPolicy:
+    def __init__(
+        self,
+        max_delay: Optional[float] = None,
+        max_batch: Optional[int] = None,
+        min_batch: int = 10,
+        min_linger: float = 0.5,
+        busy_rate: float = 20.0,
+        max_commit_share: float = 0.1,
+        smoothing: float = 0.3,
+    ):
+        self.max_delay = max_delay or FLUSH_MAX_DELAY
+        self.max_batch = max_batch or FLUSH_MAX_BATCH
+        self.min_batch = min_batch
+        self.min_linger = min_linger
+        self.busy_rate = busy_rate
+        self.max_commit_share = max_commit_share
+        self.smoothing = smoothing
+        self.rate = 0.0
+        self.commit_seconds = 0.0
+        self.flushes = 0
+        self.last_flush_at = time.monotonic()
+        self.lock = threading.Lock()
+        self._update()
+
+    def configure(self, max_delay: Optional[float] = None, max_batch: Optional[int] = None):
+        with self.lock:
+            self.max_delay = max_delay or FLUSH_MAX_DELAY
+            self.max_batch = max_batch or FLUSH_MAX_BATCH
+            self._update()
+
+    def due(self, pending: int, oldest_age: float) -> bool:
+        return pending >= self.batch_size or (pending > 0 and oldest_age >= self.linger)
+
+    def record_flush(self, messages: int, seconds: float):
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.last_flush_at
+            self.last_flush_at = now
+            if elapsed > 0:
+                self.rate = self._smooth(self.rate, messages / elapsed)
+            self.commit_seconds = self._smooth(self.commit_seconds, seconds)
+            self.flushes += 1
+            self._update()
+
+    def _smooth(self, current: float, sample: float) -> float:
+        if not self.flushes:
+            return sample
+        return current + self.smoothing * (sample - current)
+
+    def _update(self):
+        min_linger = min(self.min_linger, self.max_delay)
+        load = min(1.0, self.rate / self.busy_rate)
+        linger = min_linger + (self.max_delay - min_linger) * load
+        linger = max(linger, self.commit_seconds / self.max_commit_share)
+        self.linger = min(linger, self.max_delay)
+        self.batch_size = int(
+            min(self.max_batch, max(self.min_batch, self.rate * self.linger))
+        )
+
+    def state(self) -> dict:
+        with self.lock:
+            return {
+                "max_delay": self.max_delay,
+                "max_batch": self.max_batch,
+                "batch_size": self.batch_size,
+                "linger": self.linger,
+                "rate": self.rate,
+                "commit_seconds": self.commit_seconds,
+                "flushes": self.flushes,
+            }
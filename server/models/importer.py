@@ -0,0 +1,202 @@
+from datetime import datetime
+from sqlalchemy.orm import Session
+from typing import Any, BinaryIO, Callable, Dict, Iterator, Optional
+import codecs
+import itertools
+import json
+import os
+
+from models.dicts import DownloadStatus, PlatformType
+from models.schema import Stream
+from models.tw_data_handler import TwitchDataHandler
+from models.yt_data_handler import YouTubeDataHandler
+import database
+
+IMPORT_CHUNK_BYTES = int(os.environ.get("IMPORT_CHUNK_BYTES", str(1024 * 1024)))
+# a single message larger than this is treated as a broken file instead of
+# reading the rest of it into memory looking for the end
+IMPORT_MAX_MESSAGE_BYTES = int(os.environ.get("IMPORT_MAX_MESSAGE_BYTES", str(16 * 1024 * 1024)))
+# messages between two progress reports
+IMPORT_PROGRESS_EVERY = int(os.environ.get("IMPORT_PROGRESS_EVERY", "10000"))
+
+_WHITESPACE = " \t\r\n"
+
+
+# yields the objects of a JSON array, or of NDJSON / concatenated JSON, reading
+# the file in chunks so only one message is decoded at a time
+class MessageReader:
+    def __init__(self, source: BinaryIO, chunk_size: int = IMPORT_CHUNK_BYTES):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.text = codecs.getincrementaldecoder("utf-8-sig")()
+        self.bytes_read = 0
+        self.messages = 0
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.source.read(self.chunk_size)
+        self.bytes_read += len(chunk)
+        if not chunk:
+            self.eof = True
+        # keep only what is left to parse
+        self.buffer = self.buffer[self.pos:] + self.text.decode(chunk, final=self.eof)
+        self.pos = 0
+        return True
+
+    def _skip(self, separators: str) -> Optional[str]:
+        # next significant character, None at the end of the input
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in separators:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return None
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        first = self._skip(_WHITESPACE)
+        in_array = first == "["
+        if in_array:
+            self.pos += 1
+            if self._skip(_WHITESPACE) == "]":
+                self.pos += 1
+                self._expect_end()
+                return
+        while True:
+            char = self._skip(_WHITESPACE)
+            if char is None:
+                if in_array:
+                    raise ValueError("Unexpected end of file inside the JSON array")
+                return
+            value = self._decode()
+            if isinstance(value, list) and not in_array:
+                # an NDJSON line holding a batch of messages
+                for item in value:
+                    self.messages += 1
+                    yield item
+            else:
+                self.messages += 1
+                yield value
+            if not in_array:
+                continue
+            char = self._skip(_WHITESPACE)
+            if char == "]":
+                self.pos += 1
+                self._expect_end()
+                return
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']' near byte {self.bytes_read}")
+            self.pos += 1
+
+    def _decode(self):
+        while True:
+            try:
+                value, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+                return value
+            except json.JSONDecodeError as e:
+                # a message cut in half by the chunk boundary, read on
+                too_long = len(self.buffer) - self.pos > IMPORT_MAX_MESSAGE_BYTES
+                if too_long or not self._fill():
+                    raise ValueError(
+                        f"Invalid JSON near byte {self.bytes_read}: {e.msg}"
+                    ) from None
+
+    def _expect_end(self):
+        if self._skip(_WHITESPACE) is not None:
+            raise ValueError(f"Unexpected data after the JSON array near byte {self.bytes_read}")
+
+
+def guess_platform(message: Dict[str, Any]) -> PlatformType:
+    # twitch messages carry the channel, youtube ones never do
+    return PlatformType.TWITCH if "channel_id" in message else PlatformType.YOUTUBE
+
+
+def create_import_stream(db: Session, url: str, platform: PlatformType, title: Optional[str]) -> int:
+    stream = Stream(
+        url=url,
+        title=title,
+        platform=platform.value,
+        status="past",
+        download_status=DownloadStatus.DOWNLOADING.value,
+        created_at=datetime.now(),
+        updated_at=datetime.now(),
+    )
+    database.run_write(db, lambda: db.add(stream), "import")
+    stream_id = stream.id
+    db.expunge(stream)
+    return stream_id
+
+
+def import_messages(
+    db: Session,
+    stream_id: int,
+    platform: PlatformType,
+    messages: Iterator[Dict[str, Any]],
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    handler_class = TwitchDataHandler if platform == PlatformType.TWITCH else YouTubeDataHandler
+    message_db = database.open_message_db(stream_id)
+    # archives arrive as fast as we can write them, the same path as past broadcasts
+    handler = handler_class(db, message_db=message_db, bulk=True)
+    imported = 0
+    try:
+        for message in messages:
+            handler.track_timestamp(stream_id, message.get("timestamp"))
+            if not handler.save_message(message, stream_id):
+                continue
+            imported += 1
+            if progress and imported % IMPORT_PROGRESS_EVERY == 0:
+                progress(imported)
+    finally:
+        handler.close()
+    if handler.message_batch:
+        raise RuntimeError(f"Could not write the imported messages of stream {stream_id}")
+    return imported
+
+
+def run_import(
+    db: Session,
+    source: BinaryIO,
+    url: Optional[str] = None,
+    platform: Optional[PlatformType] = None,
+    title: Optional[str] = None,
+    stream_id: Optional[int] = None,
+    progress: Optional[Callable[[MessageReader, int], None]] = None,
+) -> int:
+    # into a new stream, or into stream_id when the caller created it already
+    reader = MessageReader(source)
+    messages = iter(reader)
+    first = next(messages, None)
+    if first is None:
+        raise ValueError("The file holds no messages")
+    if platform is None:
+        platform = guess_platform(first)
+    if stream_id is None:
+        stream_id = create_import_stream(db, url or f"import://{title or 'chat'}", platform, title)
+
+    try:
+        imported = import_messages(
+            db,
+            stream_id,
+            platform,
+            itertools.chain((first,), messages),
+            (lambda imported: progress(reader, imported)) if progress else None,
+        )
+        values = {"download_status": DownloadStatus.COMPLETED.value, "updated_at": datetime.now()}
+    except Exception as e:
+        values = {"download_status": DownloadStatus.ERROR.value, "error": str(e), "updated_at": datetime.now()}
+        raise
+    finally:
+        database.run_write(
+            db,
+            lambda: db.query(Stream).filter(Stream.id == stream_id).update(values),
+            "import",
+        )
+    if progress:
+        progress(reader, imported)
+    return stream_id
@@ -0,0 +1,252 @@
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from models import spool
+from models.dicts import PlatformType, message_groups_by_platform
+from models.duplicates import DuplicateDetector
+
+# "process" runs the fetching and normalizing of each download in its own
+# process, the server process only writes the batches it gets back
+INGEST_MODE = os.environ.get("INGEST_MODE", "thread").lower()
+INGEST_PROCESS_BATCH = int(os.environ.get("INGEST_PROCESS_BATCH", "500"))
+# a quiet stream still hands its messages over within this many seconds
+INGEST_PROCESS_BATCH_DELAY = float(os.environ.get("INGEST_PROCESS_BATCH_DELAY", "0.05"))
+# fetched messages waiting to be normalized, the fetch blocks beyond this
+INGEST_PROCESS_BUFFER = int(os.environ.get("INGEST_PROCESS_BUFFER", "100000"))
+# how long a stopped download gets to hand over what it has before it is killed
+INGEST_PROCESS_STOP_GRACE = float(os.environ.get("INGEST_PROCESS_STOP_GRACE", "5"))
+
+# fork would copy the server's threads and open sqlite connections
+_context = multiprocessing.get_context("spawn")
+
+# (spool position, chat timestamp, record, or the raw message when the writer
+# has to look at stored rows, or None when there is nothing to store)
+Item = Tuple[spool.Position, Optional[int], Any]
+
+
+def get_chat(url: str, platform: int):
+    from chat_downloader import ChatDownloader
+
+    return ChatDownloader().get_chat(
+        url,
+        message_groups=message_groups_by_platform[PlatformType(platform)],
+        interruptible_retry=False,
+        retry_timeout=32,
+        max_attempts=1000,
+    )
+
+
+def _handler_class(platform: int):
+    from models.tw_data_handler import TwitchDataHandler
+    from models.yt_data_handler import YouTubeDataHandler
+
+    return TwitchDataHandler if platform == PlatformType.TWITCH.value else YouTubeDataHandler
+
+
+def normalize(handler_class, message: Dict[str, Any], stream_id: int, detector=None) -> Any:
+    if handler_class.requires_session(message):
+        return message
+    record = handler_class.build_record(message, stream_id)
+    if record is not None and detector is not None and record.message:
+        detector.assign_record(record)
+    return record
+
+
+def _fetch(chat, writer: spool.SpoolWriter, messages: queue.Queue, stop):
+    try:
+        for message in chat:
+            if stop.is_set():
+                break
+            try:
+                position = writer.append(message)
+            except ValueError:
+                # the spool was closed by a stop, the message was never accepted
+                break
+            messages.put((position, message))
+    except Exception as e:
+        messages.put(e)
+    finally:
+        messages.put(None)
+
+
+def _run(
+    stream_id: int,
+    url: str,
+    platform: int,
+    directory: str,
+    first_segment: int,
+    conn,
+    stop,
+    chat_factory: Callable = get_chat,
+):
+    handler_class = _handler_class(platform)
+    # clustering is cpu work too, it stays off the server process
+    detector = DuplicateDetector()
+    try:
+        chat = chat_factory(url, platform)
+        conn.send(
+            (
+                "started",
+                {
+                    "title": chat.title,
+                    "id": chat.id,
+                    "status": chat.status,
+                    "duration": chat.duration,
+                },
+            )
+        )
+
+        writer = spool.SpoolWriter(directory, first_segment)
+        messages = queue.Queue(INGEST_PROCESS_BUFFER)
+        # the chat iterator blocks on the network, it gets a thread of its own
+        threading.Thread(
+            target=_fetch, args=(chat, writer, messages, stop), daemon=True
+        ).start()
+
+        batch: List[Item] = []
+        sent_at = time.monotonic()
+        error = None
+        received = 0
+        while True:
+            if stop.is_set() and not writer.closed:
+                writer.close()
+            # stopped and every message the spool accepted is handed over, the
+            # fetch thread may stay blocked on the network until we exit
+            if writer.closed and received == writer.appends:
+                break
+            try:
+                fetched = messages.get(timeout=INGEST_PROCESS_BATCH_DELAY)
+            except queue.Empty:
+                fetched = False
+            if fetched is None:
+                break
+            if isinstance(fetched, Exception):
+                error = fetched
+            elif fetched:
+                received += 1
+                position, message = fetched
+                batch.append(
+                    (position, message.get("timestamp"), normalize(handler_class, message, stream_id, detector))
+                )
+            if batch and (
+                len(batch) >= INGEST_PROCESS_BATCH
+                or time.monotonic() - sent_at >= INGEST_PROCESS_BATCH_DELAY
+            ):
+                conn.send(("batch", batch))
+                batch = []
+                sent_at = time.monotonic()
+        if batch:
+            conn.send(("batch", batch))
+        writer.close()
+        if error:
+            raise error
+        conn.send(("done", None))
+    except Exception as e:
+        conn.send(("error", str(e)))
+    finally:
+        conn.close()
+
+
+class ProcessIngest:
+    def __init__(
+        self,
+        stream_id: int,
+        url: str,
+        platform: int,
+        directory: str,
+        first_segment: int,
+        chat_factory: Callable = get_chat,
+    ):
+        self.stream_id = stream_id
+        self.directory = directory
+        self.stop = _context.Event()
+        self.conn, child_conn = _context.Pipe(duplex=False)
+        self.process = _context.Process(
+            target=_run,
+            args=(stream_id, url, platform, directory, first_segment, child_conn, self.stop, chat_factory),
+            name=f"ingest-{stream_id}",
+            daemon=True,
+        )
+        self.process.start()
+        # only the child writes, our copy would keep the pipe open after it exits
+        child_conn.close()
+        self.stopped_at = None
+        # set once the child handed over everything it spooled
+        self.finished = False
+
+    def _receive(self, timeout: float):
+        if not self.conn.poll(timeout):
+            return None
+        try:
+            return self.conn.recv()
+        except EOFError:
+            raise RuntimeError(f"Ingest process for stream {self.stream_id} exited unexpectedly")
+
+    def _check_stop(self, stop_event: threading.Event):
+        if stop_event.is_set() and self.stopped_at is None:
+            self.stop.set()
+            self.stopped_at = time.monotonic()
+        if self.stopped_at and time.monotonic() - self.stopped_at > INGEST_PROCESS_STOP_GRACE:
+            # stuck waiting for the next chat message, nothing it holds is lost:
+            # every message it accepted is in the spool and replayed on startup
+            self.process.terminate()
+            return True
+        return False
+
+    def started(self, stop_event: threading.Event) -> Optional[SimpleNamespace]:
+        # the chat metadata, None when the download was stopped before it began
+        while True:
+            received = self._receive(0.5)
+            if received:
+                kind, payload = received
+                if kind == "error":
+                    raise RuntimeError(payload)
+                return SimpleNamespace(**payload)
+            if self._check_stop(stop_event):
+                return None
+
+    def consume(self, handler, stop_event: threading.Event):
+        # the writer side of consume() in models.spool, fed from the pipe
+        stream_id = self.stream_id
+        while True:
+            if self._check_stop(stop_event):
+                break
+            wait = handler.policy.linger
+            if handler.first_queued_at is not None:
+                wait -= time.monotonic() - handler.first_queued_at
+            received = self._receive(min(1.0, max(0.05, wait)))
+            if received:
+                kind, payload = received
+                if kind == "error":
+                    raise RuntimeError(payload)
+                if kind == "done":
+                    self.finished = True
+                    break
+                for position, timestamp, item in payload:
+                    handler.track_timestamp(stream_id, timestamp)
+                    handler.track_spool_position(stream_id, position)
+                    if isinstance(item, dict):
+                        handler.save_message(item, stream_id)
+                    elif item is not None:
+                        handler.queue_record(item, stream_id)
+            handler._check_flush_conditions()
+            checkpoint = handler.spool_checkpoint.get(stream_id)
+            if checkpoint:
+                spool.remove_consumed(self.directory, checkpoint)
+
+        handler.flush_batch()
+        if handler.message_batch:
+            raise RuntimeError(f"Could not flush ingested messages for stream {stream_id}")
+
+    def close(self):
+        self.stop.set()
+        self.process.join(INGEST_PROCESS_STOP_GRACE)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
@@ -0,0 +1,244 @@
+from datetime import datetime, timedelta
+from sqlalchemy import case, or_, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from typing import Callable, Dict, List, Optional
+import os
+import socket
+import sys
+import threading
+import uuid
+
+from models.dicts import JobState
+from models.schema import DownloadJob
+import database
+
+# a worker renews its leases three times per lease, so it has to miss two
+# heartbeats in a row before another worker takes its downloads over
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "30"))
+# downloads one process runs at once, 0 leaves ingest to other processes
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", "16"))
+
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def request_state(db: Session, stream_id: int, state: JobState):
+    now = datetime.now()
+    db.execute(
+        insert(DownloadJob)
+        .values(stream_id=stream_id, desired_state=state.value, attempts=0, updated_at=now)
+        .on_conflict_do_update(
+            index_elements=["stream_id"],
+            set_={"desired_state": state.value, "updated_at": now},
+        )
+    )
+
+
+def get_job(db: Session, stream_id: int) -> Optional[DownloadJob]:
+    return db.execute(
+        select(DownloadJob).where(DownloadJob.stream_id == stream_id)
+    ).scalar_one_or_none()
+
+
+def is_leased(job: Optional[DownloadJob], now: Optional[datetime] = None) -> bool:
+    return bool(
+        job
+        and job.owner
+        and job.lease_expires_at
+        and job.lease_expires_at > (now or datetime.now())
+    )
+
+
+def _unleased(now: datetime):
+    return or_(DownloadJob.owner.is_(None), DownloadJob.lease_expires_at < now)
+
+
+def claim(db: Session, owner: str, limit: int, lease_seconds: float = JOB_LEASE_SECONDS) -> List[int]:
+    # runs under the write lock, nobody else can claim between the select and the update
+    now = datetime.now()
+    candidates = (
+        select(DownloadJob.stream_id)
+        .where(DownloadJob.desired_state == JobState.RUN.value, _unleased(now))
+        .order_by(DownloadJob.updated_at)
+        .limit(limit)
+        .scalar_subquery()
+    )
+    result = db.execute(
+        update(DownloadJob)
+        .where(DownloadJob.stream_id.in_(candidates))
+        .values(
+            owner=owner,
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            heartbeat_at=now,
+            attempts=DownloadJob.attempts + 1,
+        )
+        .returning(DownloadJob.stream_id)
+        .execution_options(synchronize_session=False)
+    )
+    return list(result.scalars())
+
+
+def acquire(db: Session, owner: str, stream_id: int, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+    # takes one job whatever its desired state, as long as nobody holds it
+    now = datetime.now()
+    result = db.execute(
+        update(DownloadJob)
+        .where(DownloadJob.stream_id == stream_id, _unleased(now))
+        .values(
+            owner=owner,
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            heartbeat_at=now,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def renew(
+    db: Session, owner: str, stream_ids: List[int], lease_seconds: float = JOB_LEASE_SECONDS
+) -> Dict[int, str]:
+    # desired state of every job the worker still holds, a missing id was taken over
+    now = datetime.now()
+    result = db.execute(
+        update(DownloadJob)
+        .where(DownloadJob.stream_id.in_(stream_ids), DownloadJob.owner == owner)
+        .values(lease_expires_at=now + timedelta(seconds=lease_seconds), heartbeat_at=now)
+        .returning(DownloadJob.stream_id, DownloadJob.desired_state)
+        .execution_options(synchronize_session=False)
+    )
+    return dict(result.all())
+
+
+def release(db: Session, owner: str, stream_id: int, finished: bool):
+    # a download that ended on its own is done, anything else keeps its desired
+    # state and is claimed again while that is run
+    values = {"owner": None, "lease_expires_at": None}
+    if finished:
+        values["desired_state"] = case(
+            (DownloadJob.desired_state == JobState.RUN.value, JobState.DONE.value),
+            else_=DownloadJob.desired_state,
+        )
+    db.execute(
+        update(DownloadJob)
+        .where(DownloadJob.stream_id == stream_id, DownloadJob.owner == owner)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+class JobWorker:
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        start: Callable[[int, threading.Event], None],
+        capacity: int = DOWNLOAD_WORKERS,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+    ):
+        self.session_factory = session_factory
+        self.start_download = start
+        self.capacity = capacity
+        self.lease_seconds = lease_seconds
+        self.owner = new_worker_id()
+        # stream id -> (download thread, its stop event)
+        self.running: Dict[int, tuple] = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread or self.capacity <= 0:
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._loop, name="job-worker", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        if not self.thread:
+            return
+        self.stopping.set()
+        self.wakeup.set()
+        self.thread.join()
+        self.thread = None
+        with self.lock:
+            running = list(self.running.values())
+        for _, stop_event in running:
+            stop_event.set()
+        # a download stuck waiting on the network keeps its lease until it runs out
+        for thread, _ in running:
+            thread.join(self.lease_seconds if timeout is None else timeout)
+
+    def wake(self):
+        self.wakeup.set()
+
+    def is_running(self, stream_id: int) -> bool:
+        with self.lock:
+            return stream_id in self.running
+
+    def _loop(self):
+        db = self.session_factory()
+        try:
+            while not self.stopping.is_set():
+                self.wakeup.clear()
+                try:
+                    self.heartbeat(db)
+                except Exception as e:
+                    print(f"Job worker heartbeat failed: {e}", file=sys.stderr)
+                    sys.stdout.flush()
+                    db.rollback()
+                self.wakeup.wait(self.lease_seconds / 3)
+        finally:
+            db.close()
+
+    def heartbeat(self, db: Session):
+        with self.lock:
+            stream_ids = list(self.running)
+        if stream_ids:
+            states = database.run_write(
+                db, lambda: renew(db, self.owner, stream_ids, self.lease_seconds), "jobs"
+            )
+            for stream_id in stream_ids:
+                # paused, stopped, or taken over after we missed our heartbeats
+                if states.get(stream_id) != JobState.RUN.value:
+                    with self.lock:
+                        entry = self.running.get(stream_id)
+                    if entry:
+                        entry[1].set()
+
+        free = self.capacity - len(stream_ids)
+        if free <= 0 or self.stopping.is_set():
+            return
+        claimed = database.run_write(
+            db, lambda: claim(db, self.owner, free, self.lease_seconds), "jobs"
+        )
+        for stream_id in claimed:
+            stop_event = threading.Event()
+            thread = threading.Thread(
+                target=self._run,
+                args=(stream_id, stop_event),
+                name=f"download-{stream_id}",
+                daemon=True,
+            )
+            with self.lock:
+                self.running[stream_id] = (thread, stop_event)
+            thread.start()
+
+    def _run(self, stream_id: int, stop_event: threading.Event):
+        try:
+            self.start_download(stream_id, stop_event)
+        finally:
+            finished = not self.stopping.is_set()
+            db = self.session_factory()
+            try:
+                database.run_write(
+                    db, lambda: release(db, self.owner, stream_id, finished), "jobs"
+                )
+            except Exception as e:
+                print(f"Error releasing job for stream {stream_id}: {e}", file=sys.stderr)
+            finally:
+                db.close()
+            with self.lock:
+                self.running.pop(stream_id, None)
+            self.wakeup.set()
@@ -0,0 +1,107 @@
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session, Query
+
+from models.schema import ChatAuthor, Stream, TwitchChatMessage, YouTubeChatMessage
+from models.dicts import PlatformType, MessageGroup
+from models.timestamps import to_micros
+
+
+def get_model_class(platform: int):
+    return (
+        TwitchChatMessage
+        if platform == PlatformType.TWITCH.value
+        else YouTubeChatMessage
+    )
+
+
+def parse_message_group_ids(messageGroupIds: Optional[str]) -> List[int]:
+    return (
+        [int(id.strip()) for id in messageGroupIds.split(",")]
+        if messageGroupIds
+        else []
+    )
+
+
+def banned_authors_query(stream: Stream):
+    # banned users are matched by name, as ban events may carry other ids
+    model_class = get_model_class(stream.platform)
+    banned_names_sub = (
+        select(ChatAuthor.name)
+        .join(model_class, model_class.author_ref == ChatAuthor.id)
+        .where(
+            model_class.stream_id == stream.id,
+            model_class.message_group_id == MessageGroup.bans.value,
+        )
+        .distinct()
+    )
+    return select(ChatAuthor.id).where(
+        ChatAuthor.platform == stream.platform,
+        ChatAuthor.name.in_(banned_names_sub),
+    )
+
+
+def build_messages_query(
+    db: Session,
+    stream: Stream,
+    message_group_ids: List[int],
+    includeBannedUsers: Optional[bool] = True,
+    moderators: Optional[bool] = False,
+    username: Optional[str] = None,
+    message: Optional[str] = None,
+    dateFrom: Optional[datetime] = None,
+    dateTo: Optional[datetime] = None,
+    clusterId: Optional[int] = None,
+) -> Query:
+    model_class = get_model_class(stream.platform)
+    stream_id = stream.id
+
+    query = db.query(model_class).filter(model_class.stream_id == stream_id)
+    if message_group_ids:
+        query = query.filter(model_class.message_group_id.in_(message_group_ids))
+    if dateTo:
+        query = query.filter(model_class.timestamp < to_micros(dateTo))
+    if dateFrom:
+        query = query.filter(model_class.timestamp > to_micros(dateFrom))
+    if clusterId is not None:
+        query = query.filter(model_class.cluster_id == clusterId)
+
+    includeMessages = (
+        MessageGroup.messages.value in message_group_ids
+        if message_group_ids
+        else True
+    )
+
+    banned_users_sub = banned_authors_query(stream)
+
+    if not includeBannedUsers and includeMessages:
+        query = query.filter(~model_class.author_ref.in_(banned_users_sub))
+    elif includeBannedUsers and not includeMessages:
+        sub = db.query(model_class).filter(
+            model_class.stream_id == stream_id,
+            model_class.message_group_id == MessageGroup.messages.value,
+            model_class.author_ref.in_(banned_users_sub),
+        )
+        query = query.union(sub)
+
+    if moderators:
+        query = query.filter(model_class.is_moderator)
+    if username:
+        filter_cond = ChatAuthor.name.ilike(f"%{username}%")
+        if stream.platform == PlatformType.TWITCH.value:
+            filter_cond = or_(
+                filter_cond, ChatAuthor.display_name.ilike(f"%{username}%")
+            )
+        query = query.filter(
+            model_class.author_ref.in_(
+                select(ChatAuthor.id).where(
+                    ChatAuthor.platform == stream.platform, filter_cond
+                )
+            )
+        )
+    if message:
+        query = query.filter(model_class.message.ilike(f"%{message}%"))
+
+    return query
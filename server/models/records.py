@@ -0,0 +1,173 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from models.author_cache import AuthorInfo
+from models.dicts import PlatformType
+from models.schema import TwitchChatMessage, YouTubeChatMessage
+from models.timestamps import now_micros
+
+# queued messages stay plain slotted objects until the batch is written, the
+# orm models are only used for reading them back
+
+
+class MessageRecord:
+    __slots__ = ("author",)
+    model: type
+    columns: Tuple[str, ...] = ()
+
+    def row(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.columns}
+
+
+class TwitchMessageRecord(MessageRecord):
+    model = TwitchChatMessage
+    columns = (
+        "message_id",
+        "message_group_id",
+        "timestamp",
+        "stream_id",
+        "author_ref",
+        "is_moderator",
+        "is_subscriber",
+        "message",
+        "cluster_id",
+        "ban_duration",
+        "ban_type",
+        "cumulative_months",
+        "sub_tier",
+        "sub_prime",
+        "system_message",
+        "created_at",
+    )
+    __slots__ = columns
+
+    def __init__(
+        self,
+        message_group_id: int,
+        timestamp: int,
+        stream_id: Optional[int],
+        author: Optional[AuthorInfo] = None,
+        message_id: Optional[str] = None,
+        is_moderator: Optional[bool] = None,
+        is_subscriber: Optional[bool] = None,
+        message: Optional[str] = None,
+        ban_duration: Optional[int] = None,
+        ban_type: Optional[str] = None,
+        cumulative_months: Optional[int] = None,
+        sub_tier: Optional[int] = None,
+        sub_prime: Optional[bool] = None,
+        system_message: Optional[str] = None,
+    ):
+        self.message_id = message_id
+        self.message_group_id = message_group_id
+        self.timestamp = timestamp
+        self.stream_id = stream_id
+        self.author = author
+        self.author_ref = None
+        self.is_moderator = is_moderator
+        self.is_subscriber = is_subscriber
+        self.message = message
+        # set when the record is queued, see models.duplicates
+        self.cluster_id = None
+        self.ban_duration = ban_duration
+        self.ban_type = ban_type
+        self.cumulative_months = cumulative_months
+        self.sub_tier = sub_tier
+        self.sub_prime = sub_prime
+        self.system_message = system_message
+        self.created_at = now_micros()
+
+
+class YouTubeMessageRecord(MessageRecord):
+    model = YouTubeChatMessage
+    columns = (
+        "message_id",
+        "message_group_id",
+        "timestamp",
+        "stream_id",
+        "author_ref",
+        "is_moderator",
+        "is_member",
+        "message",
+        "cluster_id",
+        "target_message_id",
+        "header_primary_text",
+        "header_secondary_text",
+        "money",
+        "money_amount",
+        "money_currency",
+        "deleted",
+        "created_at",
+    )
+    __slots__ = columns
+
+    def __init__(
+        self,
+        message_group_id: int,
+        timestamp: Optional[int],
+        stream_id: Optional[int],
+        author: Optional[AuthorInfo] = None,
+        author_ref: Optional[int] = None,
+        message_id: Optional[str] = None,
+        is_moderator: bool = False,
+        is_member: bool = False,
+        message: Optional[str] = None,
+        target_message_id: Optional[str] = None,
+        header_primary_text: Optional[str] = None,
+        header_secondary_text: Optional[str] = None,
+        money: Optional[dict] = None,
+        money_amount: Optional[int] = None,
+        money_currency: Optional[str] = None,
+    ):
+        self.created_at = now_micros()
+        self.message_id = message_id
+        self.message_group_id = message_group_id
+        self.timestamp = timestamp if timestamp is not None else self.created_at
+        self.stream_id = stream_id
+        self.author = author
+        self.author_ref = author_ref
+        self.is_moderator = is_moderator
+        self.is_member = is_member
+        self.message = message
+        self.cluster_id = None
+        self.target_message_id = target_message_id
+        self.header_primary_text = header_primary_text
+        self.header_secondary_text = header_secondary_text
+        self.money = money
+        self.money_amount = money_amount
+        self.money_currency = money_currency
+        self.deleted = False
+
+
+# platform -> (badge key, value, exact match, flag); one pass over the badges
+# sets every flag, a non-exact value only has to appear in the badge text
+BADGE_FLAGS: Dict[int, Tuple[Tuple[str, str, bool, str], ...]] = {
+    PlatformType.TWITCH.value: (
+        ("name", "moderator", True, "is_moderator"),
+        ("name", "subscriber", True, "is_subscriber"),
+        ("name", "founder", True, "is_subscriber"),
+    ),
+    PlatformType.YOUTUBE.value: (
+        ("icon_name", "moderator", True, "is_moderator"),
+        ("title", "Member", False, "is_member"),
+    ),
+}
+
+
+def badge_flags(platform: int, badges: Iterable[dict]) -> Dict[str, bool]:
+    rules = BADGE_FLAGS[platform]
+    flags = {flag: False for _, _, _, flag in rules}
+    for badge in badges:
+        for key, value, exact, flag in rules:
+            found = badge.get(key)
+            if found is None:
+                continue
+            if found == value if exact else value in found:
+                flags[flag] = True
+    return flags
+
+
+def rows_by_model(records: Iterable[MessageRecord]) -> Dict[type, List[Dict[str, Any]]]:
+    rows: Dict[type, List[Dict[str, Any]]] = {}
+    for record in records:
+        rows.setdefault(record.model, []).append(record.row())
+    return rows
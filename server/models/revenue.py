@@ -0,0 +1,198 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import sys
+
+from sqlalchemy import delete, exists, func, literal, or_, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from models.dicts import DownloadStatus, MessageGroup, PlatformType
+from models.schema import Stream, StreamRevenue, TwitchChatMessage, YouTubeChatMessage
+import database
+
+# twitch plan names as chat_downloader reports them, and the plan codes of irc
+SUB_TIERS = {
+    "prime": (1, True),
+    "tier 1": (1, False),
+    "tier 2": (2, False),
+    "tier 3": (3, False),
+    "1000": (1, False),
+    "2000": (2, False),
+    "3000": (3, False),
+}
+
+# announcements of gift bombs, every gifted sub also arrives as a
+# subscription_gift of its own
+GIFT_ANNOUNCEMENTS = ("mystery_subscription_gift", "anonymous_mystery_subscription_gift")
+
+
+def sub_plan(data: dict) -> Tuple[Optional[int], Optional[bool]]:
+    # (tier, prime) of a twitch subscription event, (None, None) for events that
+    # do not stand for one subscription
+    if data.get("message_type") in GIFT_ANNOUNCEMENTS:
+        return None, None
+    plan = data.get("subscription_type") or data.get("subscription_plan")
+    return SUB_TIERS.get(str(plan).strip().lower(), (None, None)) if plan else (None, None)
+
+
+def money_value(money) -> Tuple[Optional[int], Optional[str]]:
+    # (hundredths of the currency unit, currency code) of a youtube money dict
+    if not isinstance(money, dict):
+        return None, None
+    amount = money.get("amount")
+    currency = money.get("currency")
+    if amount is None or not currency:
+        return None, None
+    try:
+        return round(float(amount) * 100), str(currency)
+    except (TypeError, ValueError):
+        return None, None
+
+
+def _key(platform: int, m) -> Optional[Tuple[str, int]]:
+    # (currency, tier) a message is summed up under, the same rules as the
+    # queries of _stored_totals
+    if platform == PlatformType.TWITCH.value:
+        return ("", m.sub_tier) if m.sub_tier else None
+    if m.money_currency:
+        return m.money_currency, 0
+    if m.message_group_id == MessageGroup.subs.value:
+        # memberships carry no tier
+        return "", 0
+    return None
+
+
+def record_revenue(db: Session, platform: int, messages: Iterable) -> None:
+    # called with every flushed batch, in the flush transaction of the catalog
+    totals: Dict[Tuple[int, str, int], list] = {}
+    for m in messages:
+        key = _key(platform, m) if m.stream_id else None
+        if key is None:
+            continue
+        entry = totals.get((m.stream_id,) + key)
+        if entry is None:
+            entry = totals[(m.stream_id,) + key] = [0, 0, 0, m.timestamp, m.timestamp]
+        entry[0] += 1
+        if platform == PlatformType.TWITCH.value:
+            entry[1] += 1 if m.sub_prime else 0
+        else:
+            entry[2] += m.money_amount or 0
+        entry[3] = min(entry[3], m.timestamp)
+        entry[4] = max(entry[4], m.timestamp)
+    if totals:
+        _upsert(db, [key + tuple(entry) for key, entry in totals.items()])
+
+
+def _upsert(db: Session, rows: List[tuple]) -> None:
+    statement = insert(StreamRevenue)
+    excluded = statement.excluded
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=["stream_id", "currency", "tier"],
+            set_={
+                "count": StreamRevenue.count + excluded.count,
+                "prime_count": StreamRevenue.prime_count + excluded.prime_count,
+                "amount": StreamRevenue.amount + excluded.amount,
+                "first_timestamp": func.coalesce(
+                    func.min(StreamRevenue.first_timestamp, excluded.first_timestamp),
+                    excluded.first_timestamp,
+                ),
+                "last_timestamp": func.coalesce(
+                    func.max(StreamRevenue.last_timestamp, excluded.last_timestamp),
+                    excluded.last_timestamp,
+                ),
+            },
+        ),
+        [
+            {
+                "stream_id": stream_id,
+                "currency": currency,
+                "tier": tier,
+                "count": count,
+                "prime_count": prime_count,
+                "amount": amount,
+                "first_timestamp": first,
+                "last_timestamp": last,
+            }
+            for stream_id, currency, tier, count, prime_count, amount, first, last in rows
+        ],
+    )
+
+
+def _stored_totals(message_db: Session, stream_id: int, platform: int) -> List[tuple]:
+    # (currency, tier, count, prime count, amount, first, last) of the stored
+    # messages, read off the typed columns and their indexes
+    if platform == PlatformType.TWITCH.value:
+        m = TwitchChatMessage
+        return message_db.execute(
+            select(
+                literal(""),
+                m.sub_tier,
+                func.count(),
+                func.count(m.sub_prime).filter(m.sub_prime.is_(True)),
+                literal(0),
+                func.min(m.timestamp),
+                func.max(m.timestamp),
+            )
+            .where(m.stream_id == stream_id, m.sub_tier.is_not(None))
+            .group_by(m.sub_tier)
+        ).all()
+    m = YouTubeChatMessage
+    return message_db.execute(
+        select(
+            func.coalesce(m.money_currency, ""),
+            literal(0),
+            func.count(),
+            literal(0),
+            func.coalesce(func.sum(m.money_amount), 0),
+            func.min(m.timestamp),
+            func.max(m.timestamp),
+        )
+        .where(
+            m.stream_id == stream_id,
+            or_(m.money_currency.is_not(None), m.message_group_id == MessageGroup.subs.value),
+        )
+        .group_by(m.money_currency)
+    ).all()
+
+
+def rebuild_revenue(db: Session, message_db: Session, stream_id: int, platform: int) -> int:
+    rows = [(stream_id,) + tuple(row) for row in _stored_totals(message_db, stream_id, platform)]
+    if not any(row[1:3] == ("", 0) for row in rows):
+        # an empty row marks the stream as summed up, see index_missing_revenue
+        rows.append((stream_id, "", 0, 0, 0, 0, None, None))
+
+    def replace():
+        db.execute(delete(StreamRevenue).where(StreamRevenue.stream_id == stream_id))
+        _upsert(db, rows)
+
+    database.run_write(db, replace, "revenue")
+    return len(rows)
+
+
+def index_missing_revenue(db: Session) -> None:
+    # streams stored before the revenue totals existed
+    streams = db.execute(
+        select(Stream.id, Stream.platform).where(
+            Stream.message_count > 0,
+            Stream.download_status != DownloadStatus.DELETING.value,
+            ~exists().where(StreamRevenue.stream_id == Stream.id),
+        )
+    ).all()
+    for stream_id, platform in streams:
+        try:
+            with database.message_session(stream_id, db) as message_db:
+                rebuild_revenue(db, message_db, stream_id, platform)
+            print(f"Summed up revenue of stream {stream_id}")
+        except Exception as e:
+            print(f"Error summing up revenue of stream {stream_id}: {e}", file=sys.stderr)
+            db.rollback()
+    sys.stdout.flush()
+
+
+def stream_revenue(db: Session, stream_id: int) -> List[StreamRevenue]:
+    return (
+        db.query(StreamRevenue)
+        .filter(StreamRevenue.stream_id == stream_id, StreamRevenue.count > 0)
+        .order_by(StreamRevenue.currency, StreamRevenue.tier)
+        .all()
+    )
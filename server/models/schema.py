@@ -1,4 +1,6 @@
 from sqlalchemy import (
+    DDL,
+    BigInteger,
     Column,
     Integer,
     String,
@@ -9,9 +11,14 @@ from sqlalchemy import (
     JSON,
     Index,
     ForeignKey,
+    Table,
+    event,
+    func,
 )
-from sqlalchemy.orm import declarative_base
+from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime
+from models.timestamps import now_micros
 
 Base = declarative_base()
 
@@ -37,6 +44,124 @@ class Stream(Base):
 
     message_count = Column(Integer, default=0, nullable=False)
 
+    # per-stream overrides for the adaptive flush policy, null uses the defaults
+    flush_max_delay = Column(Float, nullable=True)
+    flush_max_batch = Column(Integer, nullable=True)
+    # last spool record committed to the message tables, see models.spool
+    spool_segment = Column(Integer, nullable=True)
+    spool_offset = Column(Integer, nullable=True)
+
+
+class DownloadJob(Base):
+    __tablename__ = "download_jobs"
+
+    stream_id = Column(Integer, ForeignKey('streams.id'), primary_key=True)
+    desired_state = Column(String, nullable=False)
+    # worker holding the lease, a job whose lease ran out is claimed again
+    owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=lambda: datetime.now(), onupdate=lambda: datetime.now())
+
+    __table_args__ = (
+        Index('ix_download_jobs_claim', 'desired_state', 'lease_expires_at'),
+    )
+
+
+class AlertRule(Base):
+    __tablename__ = "alert_rules"
+
+    id = Column(Integer, primary_key=True)
+    # a substring of the message text, or an author name, matched case-insensitively
+    pattern = Column(String, nullable=False)
+    field = Column(String, nullable=False)
+    # null matches every platform
+    platform = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now())
+    updated_at = Column(DateTime, default=lambda: datetime.now(), onupdate=lambda: datetime.now())
+
+
+class AlertHit(Base):
+    __tablename__ = "alert_hits"
+
+    id = Column(Integer, primary_key=True)
+    rule_id = Column(Integer, ForeignKey('alert_rules.id'), nullable=False)
+    stream_id = Column(Integer, ForeignKey('streams.id'), nullable=False)
+    message_id = Column(String, nullable=True)
+    timestamp = Column(BigInteger, nullable=True)
+    author = Column(String, nullable=True)
+    message = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now())
+
+    __table_args__ = (
+        Index('ix_alert_hits_rule', 'rule_id', 'id'),
+        Index('ix_alert_hits_stream', 'stream_id', 'id'),
+    )
+
+
+# which authors wrote in which stream, kept in the catalog so a search by author
+# only opens the streams (and shard files) the author actually wrote in
+class AuthorStream(Base):
+    __tablename__ = "author_streams"
+
+    stream_id = Column(Integer, ForeignKey('streams.id'), primary_key=True)
+    platform = Column(Integer, primary_key=True)
+    # '' instead of null, so the key can be upserted
+    author_id = Column(String, primary_key=True, default="")
+    name = Column(String, primary_key=True, default="")
+    display_name = Column(String, nullable=True)
+    message_count = Column(Integer, default=0, nullable=False)
+    first_timestamp = Column(BigInteger, nullable=True)
+    last_timestamp = Column(BigInteger, nullable=True)
+
+    __table_args__ = (
+        Index('ix_author_streams_author_id', 'author_id'),
+        Index('ix_author_streams_name', func.lower(name)),
+        Index('ix_author_streams_display_name', func.lower(display_name)),
+    )
+
+
+# paid messages and subscriptions of a stream summed up, kept up to date by
+# every flush, see models.revenue
+class StreamRevenue(Base):
+    __tablename__ = "stream_revenue"
+
+    stream_id = Column(Integer, ForeignKey('streams.id'), primary_key=True)
+    # '' for subscriptions, the currency of paid messages otherwise
+    currency = Column(String, primary_key=True, default="")
+    # subscription tier, 0 for paid messages and memberships
+    tier = Column(Integer, primary_key=True, default=0)
+    count = Column(Integer, default=0, nullable=False)
+    prime_count = Column(Integer, default=0, nullable=False)
+    # hundredths of the currency unit
+    amount = Column(BigInteger, default=0, nullable=False)
+    first_timestamp = Column(BigInteger, nullable=True)
+    last_timestamp = Column(BigInteger, nullable=True)
+
+
+class ChatAuthor(Base):
+    __tablename__ = "chat_authors"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    platform = Column(Integer, nullable=False)
+    author_id = Column(String, nullable=True)
+    name = Column(String, nullable=True)
+    display_name = Column(String, nullable=True)
+    colour = Column(String, nullable=True)
+
+
+    __table_args__ = (
+        Index(
+            'ux_chat_authors_key',
+            'platform',
+            func.coalesce(author_id, ''),
+            func.coalesce(name, ''),
+            unique=True,
+        ),
+        Index('ix_chat_authors_name', 'name'),
+    )
+
 
 class TwitchChatMessage(Base):
     __tablename__ = "twitch_chat_messages"
@@ -44,19 +169,18 @@ class TwitchChatMessage(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     message_id = Column(String, nullable=True)
     message_group_id = Column(Integer, nullable=False)
-    timestamp = Column(DateTime, nullable=False)
+    timestamp = Column(BigInteger, nullable=False)
     stream_id = Column(Integer, ForeignKey('streams.id'), nullable=True)
 
 
-    author_name = Column(String, nullable=True)
-    author_id = Column(String, nullable=True)
-    author_display_name = Column(String, nullable=True)
+    author_ref = Column(Integer, ForeignKey('chat_authors.id'), nullable=True)
     is_moderator = Column(Boolean, nullable=True)
     is_subscriber = Column(Boolean, nullable=True)
-    colour = Column(String, nullable=True)
 
 
     message = Column(Text, nullable=True)
+    # near-duplicate messages of a stream share it, see models.duplicates
+    cluster_id = Column(BigInteger, nullable=True)
 
 
     ban_duration = Column(Integer, nullable=True)
@@ -64,19 +188,27 @@ class TwitchChatMessage(Base):
 
 
     cumulative_months = Column(Integer, nullable=True)
+    # set on rows that each stand for one subscription, 1 to 3; a prime sub is
+    # tier 1 with sub_prime set
+    sub_tier = Column(Integer, nullable=True)
+    sub_prime = Column(Boolean, nullable=True)
     system_message = Column(Text, nullable=True)
 
-    created_at = Column(DateTime, default=lambda: datetime.now())
+    created_at = Column(BigInteger, default=now_micros)
+
+    author = relationship(ChatAuthor, lazy="selectin")
+    author_name = association_proxy("author", "name")
+    author_id = association_proxy("author", "author_id")
+    author_display_name = association_proxy("author", "display_name")
+    colour = association_proxy("author", "colour")
 
 
     __table_args__ = (
-        Index('ix_twitch_chat_timestamp', 'timestamp'),
-        Index('ix_twitch_chat_message_group_id', 'message_group_id'),
-        Index('ix_twitch_chat_stream_id', 'stream_id'),
-        Index('ix_twitch_chat_author_name', 'author_name'),
-        Index('ix_twitch_chat_author_display_name', 'author_display_name'),
-        Index('ix_twitch_chat_message', 'message'),
-        Index('ix_twitch_chat_is_moderator', 'is_moderator'),
+        Index('ix_twitch_chat_stream_timestamp', 'stream_id', 'timestamp'),
+        Index('ix_twitch_chat_stream_group', 'stream_id', 'message_group_id'),
+        Index('ix_twitch_chat_author_ref', 'author_ref'),
+        Index('ix_twitch_chat_stream_cluster', 'stream_id', 'cluster_id'),
+        Index('ix_twitch_chat_stream_sub_tier', 'stream_id', 'sub_tier'),
     )
 
 
@@ -86,36 +218,89 @@ class YouTubeChatMessage(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     message_id = Column(String, nullable=True)
     message_group_id = Column(Integer, nullable=False)
-    timestamp = Column(DateTime, default=lambda: datetime.now())
+    timestamp = Column(BigInteger, default=now_micros)
     stream_id = Column(Integer, ForeignKey('streams.id'), nullable=True)
 
-    author_name = Column(String, nullable=True)
-    author_id = Column(String, nullable=True)
+    author_ref = Column(Integer, ForeignKey('chat_authors.id'), nullable=True)
     is_moderator = Column(Boolean, default=False, nullable=False)
     is_member = Column(Boolean, default=False, nullable=False)
 
     message = Column(Text, nullable=True)
+    cluster_id = Column(BigInteger, nullable=True)
 
     target_message_id = Column(String, nullable=True)
 
     header_primary_text = Column(Text, nullable=True)
     header_secondary_text = Column(Text, nullable=True)
     money = Column(JSON, nullable=True)
+    # taken out of money at ingest; the amount is in hundredths of the currency
+    # unit, so sums stay exact
+    money_amount = Column(BigInteger, nullable=True)
+    money_currency = Column(String, nullable=True)
 
     deleted = Column(Boolean, default=False, nullable=False)
 
-    created_at = Column(DateTime, default=lambda: datetime.now())
+    created_at = Column(BigInteger, default=now_micros)
+
+    author = relationship(ChatAuthor, lazy="selectin")
+    author_name = association_proxy("author", "name")
+    author_id = association_proxy("author", "author_id")
 
 
     __table_args__ = (
-        Index('ix_youtube_chat_timestamp', 'timestamp'),
-        Index('ix_youtube_chat_message_group_id', 'message_group_id'),
-        Index('ix_youtube_chat_stream_id', 'stream_id'),
-        Index('ix_youtube_chat_author_name', 'author_name'),
-        Index('ix_youtube_chat_author_id', 'author_id'),
-        Index('ix_youtube_chat_target_message_id', 'target_message_id'),
-        Index('ix_youtube_chat_message', 'message'),
-        Index('ix_youtube_chat_deleted', 'deleted'),
-        Index('ix_youtube_chat_is_moderator', 'is_moderator'),
-        Index('ix_youtube_chat_is_member', 'is_member'),
+        Index('ix_youtube_chat_stream_timestamp', 'stream_id', 'timestamp'),
+        Index('ix_youtube_chat_stream_group', 'stream_id', 'message_group_id'),
+        Index('ix_youtube_chat_author_ref', 'author_ref'),
+        Index('ix_youtube_chat_message_id', 'message_id'),
+        Index('ix_youtube_chat_stream_cluster', 'stream_id', 'cluster_id'),
+        Index('ix_youtube_chat_stream_currency', 'stream_id', 'money_currency'),
     )
+
+
+# fts5 index over the message text, kept up to date by triggers so every way
+# rows get in or out (handlers, staging merges, purges) is covered
+def full_text_statements(table: str):
+    fts = f"{table}_fts"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(message, content='{table}', "
+        "content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} "
+        f"WHEN new.message IS NOT NULL BEGIN "
+        f"INSERT INTO {fts} (rowid, message) VALUES (new.id, new.message); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} "
+        f"WHEN old.message IS NOT NULL BEGIN "
+        f"INSERT INTO {fts} ({fts}, rowid, message) VALUES ('delete', old.id, old.message); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF message ON {table} BEGIN "
+        f"INSERT INTO {fts} ({fts}, rowid, message) "
+        f"SELECT 'delete', old.id, old.message WHERE old.message IS NOT NULL; "
+        f"INSERT INTO {fts} (rowid, message) "
+        f"SELECT new.id, new.message WHERE new.message IS NOT NULL; END",
+    ]
+
+
+for _model in (TwitchChatMessage, YouTubeChatMessage):
+    for _statement in full_text_statements(_model.__tablename__):
+        event.listen(_model.__table__, "after_create", DDL(_statement))
+    # the triggers go with the message table
+    event.listen(
+        _model.__table__, "before_drop", DDL(f"DROP TABLE IF EXISTS {_model.__tablename__}_fts")
+    )
+
+
+# same columns as the message tables but without indexes or constraints, bulk
+# downloads land here and are merged into the main table in timestamp order
+def _staging_table(table: Table) -> Table:
+    return Table(
+        f"{table.name}_staging",
+        Base.metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        *[
+            Column(column.name, column.type, nullable=True)
+            for column in table.columns
+            if not column.primary_key
+        ],
+    )
+
+
+TwitchChatMessageStaging = _staging_table(TwitchChatMessage.__table__)
+YouTubeChatMessageStaging = _staging_table(YouTubeChatMessage.__table__)
@@ -0,0 +1,346 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+import os
+import re
+import sys
+
+from sqlalchemy import and_, delete, exists, func, literal_column, or_, select, table
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from models.dicts import DownloadStatus, PlatformType
+from models.queries import get_model_class
+from models.schema import AuthorStream, ChatAuthor, Stream
+import database
+
+# streams one search request looks into before it returns a partial page, a
+# rare word searched in sharded storage would otherwise open every shard file
+SEARCH_SCAN_STREAMS = int(os.environ.get("SEARCH_SCAN_STREAMS", "200"))
+
+_WORD = re.compile(r"\w+")
+
+
+def record_authors(db: Session, platform: int, messages: Iterable) -> None:
+    # called with every flushed batch, in the flush transaction of the catalog
+    totals: Dict[Tuple[int, str, str], list] = {}
+    for m in messages:
+        if not m.author or not m.stream_id:
+            continue
+        key = (m.stream_id, m.author.author_id or "", m.author.name or "")
+        entry = totals.get(key)
+        if entry is None:
+            totals[key] = [m.author.display_name, 1, m.timestamp, m.timestamp]
+            continue
+        entry[0] = m.author.display_name or entry[0]
+        entry[1] += 1
+        entry[2] = min(entry[2], m.timestamp)
+        entry[3] = max(entry[3], m.timestamp)
+    if not totals:
+        return
+
+    statement = insert(AuthorStream)
+    excluded = statement.excluded
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=["stream_id", "platform", "author_id", "name"],
+            set_={
+                "display_name": func.coalesce(excluded.display_name, AuthorStream.display_name),
+                "message_count": AuthorStream.message_count + excluded.message_count,
+                "first_timestamp": func.min(AuthorStream.first_timestamp, excluded.first_timestamp),
+                "last_timestamp": func.max(AuthorStream.last_timestamp, excluded.last_timestamp),
+            },
+        ),
+        [
+            {
+                "stream_id": stream_id,
+                "platform": platform,
+                "author_id": author_id,
+                "name": name,
+                "display_name": display_name,
+                "message_count": count,
+                "first_timestamp": first,
+                "last_timestamp": last,
+            }
+            for (stream_id, author_id, name), (display_name, count, first, last) in totals.items()
+        ],
+    )
+
+
+def rebuild_author_streams(db: Session, message_db: Session, stream_id: int, platform: int) -> int:
+    model_class = get_model_class(platform)
+    rows = message_db.execute(
+        select(
+            func.coalesce(ChatAuthor.author_id, ""),
+            func.coalesce(ChatAuthor.name, ""),
+            func.max(ChatAuthor.display_name),
+            func.count(),
+            func.min(model_class.timestamp),
+            func.max(model_class.timestamp),
+        )
+        .join(ChatAuthor, ChatAuthor.id == model_class.author_ref)
+        .where(model_class.stream_id == stream_id)
+        .group_by(ChatAuthor.id)
+    ).all()
+
+    def replace():
+        db.execute(delete(AuthorStream).where(AuthorStream.stream_id == stream_id))
+        if rows:
+            db.execute(
+                insert(AuthorStream),
+                [
+                    {
+                        "stream_id": stream_id,
+                        "platform": platform,
+                        "author_id": author_id,
+                        "name": name,
+                        "display_name": display_name,
+                        "message_count": count,
+                        "first_timestamp": first,
+                        "last_timestamp": last,
+                    }
+                    for author_id, name, display_name, count, first, last in rows
+                ],
+            )
+
+    database.run_write(db, replace, "search-index")
+    return len(rows)
+
+
+def index_missing_authors(db: Session) -> None:
+    # streams stored before the author index existed
+    streams = db.execute(
+        select(Stream.id, Stream.platform).where(
+            Stream.message_count > 0,
+            Stream.download_status != DownloadStatus.DELETING.value,
+            ~exists().where(AuthorStream.stream_id == Stream.id),
+        )
+    ).all()
+    for stream_id, platform in streams:
+        try:
+            with database.message_session(stream_id, db) as message_db:
+                authors = rebuild_author_streams(db, message_db, stream_id, platform)
+            print(f"Indexed {authors} authors of stream {stream_id}")
+        except Exception as e:
+            print(f"Error indexing authors of stream {stream_id}: {e}", file=sys.stderr)
+            db.rollback()
+    sys.stdout.flush()
+
+
+def match_expression(text: str) -> Optional[str]:
+    # every word has to appear, quoted so fts5 syntax in the input is plain text
+    words = _WORD.findall(text)
+    return " ".join(f'"{word}"' for word in words) if words else None
+
+
+def _full_text_rowids(model_class, match: str):
+    fts = f"{model_class.__tablename__}_fts"
+    return (
+        select(literal_column("rowid"))
+        .select_from(table(fts))
+        .where(literal_column(fts).op("MATCH")(match))
+    )
+
+
+def _author_refs(platform: int, keys: Iterable[Tuple[str, str]]):
+    # ux_chat_authors_key lookups, refs differ between shard files
+    return select(ChatAuthor.id).where(
+        ChatAuthor.platform == platform,
+        or_(
+            *(
+                and_(
+                    func.coalesce(ChatAuthor.author_id, "") == author_id,
+                    func.coalesce(ChatAuthor.name, "") == name,
+                )
+                for author_id, name in keys
+            )
+        ),
+    )
+
+
+def _search_messages(
+    message_db: Session,
+    platform: int,
+    per_stream: int,
+    stream_ids: Optional[List[int]] = None,
+    before: Optional[int] = None,
+    match: Optional[str] = None,
+    keys: Optional[Iterable[Tuple[str, str]]] = None,
+) -> Dict[int, Tuple[int, list]]:
+    # stream id -> (matching messages, the newest per_stream of them) in one pass
+    model_class = get_model_class(platform)
+    conditions = []
+    if stream_ids is not None:
+        stream_column = model_class.stream_id
+        if keys is not None:
+            # + 0 keeps sqlite on the author_ref index, an author wrote far
+            # fewer rows than the streams hold
+            stream_column = stream_column + 0
+        conditions.append(stream_column.in_(stream_ids))
+    if before is not None:
+        conditions.append(model_class.stream_id < before)
+    if match:
+        conditions.append(model_class.id.in_(_full_text_rowids(model_class, match)))
+    if keys is not None:
+        conditions.append(model_class.author_ref.in_(_author_refs(platform, keys)))
+
+    ranked = (
+        select(
+            model_class.id,
+            model_class.stream_id,
+            func.row_number()
+            .over(
+                partition_by=model_class.stream_id,
+                order_by=(model_class.timestamp.desc(), model_class.id.desc()),
+            )
+            .label("rank"),
+            func.count().over(partition_by=model_class.stream_id).label("total"),
+        )
+        .where(*conditions)
+        .subquery()
+    )
+    rows = message_db.execute(
+        select(ranked.c.stream_id, ranked.c.total, ranked.c.id)
+        .where(ranked.c.rank <= per_stream)
+        .order_by(ranked.c.stream_id, ranked.c.rank)
+    ).all()
+    messages = {
+        m.id: m
+        for m in message_db.query(model_class).filter(model_class.id.in_([row.id for row in rows]))
+    }
+    results: Dict[int, Tuple[int, list]] = {}
+    for stream_id, total, message_id in rows:
+        results.setdefault(stream_id, (total, []))[1].append(messages[message_id])
+    return results
+
+
+def _author_candidates(
+    db: Session, author: str, platform: Optional[int], before: Optional[int]
+) -> List[Tuple[int, int, List[Tuple[str, str]]]]:
+    # (stream id, platform, matching author keys), newest stream first
+    conditions = [
+        or_(
+            AuthorStream.author_id == author,
+            func.lower(AuthorStream.name) == author.lower(),
+            func.lower(AuthorStream.display_name) == author.lower(),
+        )
+    ]
+    if platform is not None:
+        conditions.append(AuthorStream.platform == platform)
+    if before is not None:
+        conditions.append(AuthorStream.stream_id < before)
+    stream_ids = (
+        select(AuthorStream.stream_id)
+        .where(*conditions)
+        .distinct()
+        .order_by(AuthorStream.stream_id.desc())
+        .limit(SEARCH_SCAN_STREAMS)
+        .subquery()
+    )
+    rows = db.execute(
+        select(AuthorStream.stream_id, AuthorStream.platform, AuthorStream.author_id, AuthorStream.name)
+        .where(*conditions, AuthorStream.stream_id.in_(select(stream_ids.c.stream_id)))
+        .order_by(AuthorStream.stream_id.desc())
+    ).all()
+    candidates: Dict[int, Tuple[int, int, list]] = {}
+    for stream_id, stream_platform, author_id, name in rows:
+        candidates.setdefault(stream_id, (stream_id, stream_platform, []))[2].append((author_id, name))
+    return list(candidates.values())
+
+
+def _stream_candidates(
+    db: Session, platform: Optional[int], before: Optional[int]
+) -> List[Tuple[int, int, None]]:
+    query = select(Stream.id, Stream.platform).where(Stream.message_count > 0)
+    if platform is not None:
+        query = query.where(Stream.platform == platform)
+    if before is not None:
+        query = query.where(Stream.id < before)
+    rows = db.execute(query.order_by(Stream.id.desc()).limit(SEARCH_SCAN_STREAMS)).all()
+    return [(stream_id, stream_platform, None) for stream_id, stream_platform in rows]
+
+
+def search(
+    db: Session,
+    author: Optional[str] = None,
+    text: Optional[str] = None,
+    platform: Optional[int] = None,
+    before: Optional[int] = None,
+    limit: int = 20,
+    per_stream: int = 5,
+) -> Tuple[List[Tuple[Stream, int, list]], Optional[int]]:
+    """Messages of all streams by author and/or text, grouped per stream.
+
+    Streams come newest first, at most limit of them; the second value is the
+    stream id to continue before, None once every stream was searched.
+    """
+    match = match_expression(text) if text else None
+    if text and not match:
+        raise ValueError("The search text has no words in it")
+    if not author and not match:
+        raise ValueError("Search by author, text or both")
+    platforms = [platform] if platform is not None else [p.value for p in PlatformType]
+
+    found: Dict[int, Tuple[int, list]] = {}
+    # set when streams before the last one searched were left for the next page
+    scanned = None
+    if not author and not database.is_sharded():
+        # a single pass over the full-text index finds every stream at once
+        for p in platforms:
+            found.update(_search_messages(db, p, per_stream, before=before, match=match))
+    else:
+        candidates = (
+            _author_candidates(db, author, platform, before)
+            if author
+            else _stream_candidates(db, platform, before)
+        )
+        for start in range(0, len(candidates), limit):
+            chunk = candidates[start:start + limit]
+            if database.is_sharded():
+                for stream_id, stream_platform, keys in chunk:
+                    with database.message_session(stream_id, db, read_only=True) as message_db:
+                        found.update(
+                            _search_messages(
+                                message_db, stream_platform, per_stream, [stream_id], match=match, keys=keys
+                            )
+                        )
+            else:
+                by_platform = defaultdict(lambda: ([], set()))
+                for stream_id, stream_platform, keys in chunk:
+                    by_platform[stream_platform][0].append(stream_id)
+                    if keys is not None:
+                        by_platform[stream_platform][1].update(keys)
+                for stream_platform, (stream_ids, keys) in by_platform.items():
+                    found.update(
+                        _search_messages(
+                            db, stream_platform, per_stream, stream_ids, match=match,
+                            keys=keys if author else None,
+                        )
+                    )
+            if len(found) >= limit:
+                break
+        if candidates:
+            last = chunk[-1][0]
+            if last != candidates[-1][0] or len(candidates) == SEARCH_SCAN_STREAMS:
+                scanned = last
+
+    stream_ids = sorted(found, reverse=True)
+    next_before = scanned
+    if len(stream_ids) > limit or (len(stream_ids) == limit and scanned is not None):
+        stream_ids = stream_ids[:limit]
+        next_before = stream_ids[-1]
+    return _results(db, {stream_id: found[stream_id] for stream_id in stream_ids}), next_before
+
+
+def _results(db: Session, found: Dict[int, Tuple[int, list]]) -> List[Tuple[Stream, int, list]]:
+    streams = {
+        stream.id: stream
+        for stream in db.query(Stream).filter(
+            Stream.id.in_(list(found)),
+            Stream.download_status != DownloadStatus.DELETING.value,
+        )
+    }
+    return [
+        (streams[stream_id], total, messages)
+        for stream_id, (total, messages) in sorted(found.items(), reverse=True)
+        if stream_id in streams
+    ]
@@ -0,0 +1,242 @@
+from typing import Iterator, List, Optional, Tuple
+import json
+import os
+import shutil
+import struct
+import sys
+import threading
+import time
+import zlib
+
+# every record is <payload length><crc32 of payload><json payload>
+HEADER = struct.Struct("<II")
+SEGMENT_SUFFIX = ".log"
+
+SPOOL_SEGMENT_BYTES = int(os.environ.get("SPOOL_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+# a message is on disk at most this long after append
+SPOOL_FSYNC_INTERVAL = float(os.environ.get("SPOOL_FSYNC_INTERVAL", "0.2"))
+
+# (segment, offset just past the record)
+Position = Tuple[int, int]
+
+
+def stream_directory(root: str, stream_id: int) -> str:
+    return os.path.join(root, f"stream_{stream_id}")
+
+
+def segment_path(directory: str, segment: int) -> str:
+    return os.path.join(directory, f"{segment:012d}{SEGMENT_SUFFIX}")
+
+
+def list_segments(directory: str) -> List[int]:
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(
+        int(name[: -len(SEGMENT_SUFFIX)]) for name in names if name.endswith(SEGMENT_SUFFIX)
+    )
+
+
+def remove_consumed(directory: str, position: Position):
+    # segments before the checkpoint segment have been committed completely
+    for segment in list_segments(directory):
+        if segment >= position[0]:
+            break
+        os.remove(segment_path(directory, segment))
+
+
+def remove_stream(root: Optional[str], stream_id: int):
+    if root:
+        shutil.rmtree(stream_directory(root, stream_id), ignore_errors=True)
+
+
+def _fsync_directory(directory: str):
+    if os.name != "posix":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SpoolWriter:
+    def __init__(
+        self,
+        directory: str,
+        first_segment: int = 0,
+        segment_bytes: int = SPOOL_SEGMENT_BYTES,
+        fsync_interval: float = SPOOL_FSYNC_INTERVAL,
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        # set on every append so a reader waiting for data wakes up
+        self.appended = threading.Event()
+        self.closed = False
+        self.appends = 0
+        os.makedirs(directory, exist_ok=True)
+        existing = list_segments(directory)
+        # never reuse a number a checkpoint may still point past
+        self.segment = max([first_segment] + [s + 1 for s in existing])
+        self._open()
+
+    def _open(self):
+        self.file = open(segment_path(self.directory, self.segment), "ab")
+        self.size = self.file.tell()
+        _fsync_directory(self.directory)
+        self.dirty = False
+        self.synced_at = time.monotonic()
+
+    def append(self, message: dict) -> Position:
+        payload = json.dumps(message, separators=(",", ":")).encode("utf-8")
+        record = HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self.lock:
+            if self.closed:
+                raise ValueError("append to a closed spool")
+            if self.size >= self.segment_bytes:
+                self._sync()
+                self.file.close()
+                self.segment += 1
+                self._open()
+            self.file.write(record)
+            # visible to the reader right away, durable at the next fsync
+            self.file.flush()
+            self.size += len(record)
+            self.appends += 1
+            self.dirty = True
+            if time.monotonic() - self.synced_at >= self.fsync_interval:
+                self._sync()
+            position = (self.segment, self.size)
+        self.appended.set()
+        return position
+
+    def sync_if_due(self):
+        with self.lock:
+            if self.dirty and time.monotonic() - self.synced_at >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        if self.closed or not self.dirty:
+            return
+        os.fsync(self.file.fileno())
+        self.dirty = False
+        self.synced_at = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self._sync()
+            self.file.close()
+            self.closed = True
+        self.appended.set()
+
+
+class SpoolReader:
+    def __init__(
+        self,
+        directory: str,
+        checkpoint: Optional[Position] = None,
+        until: Optional[int] = None,
+    ):
+        self.directory = directory
+        # segments from this one on belong to somebody else's reader
+        self.until = until
+        segments = [s for s in list_segments(directory) if until is None or s < until]
+        if checkpoint and checkpoint[0] in segments:
+            self.segment, self.offset = checkpoint
+        else:
+            # no checkpoint, or its segment is gone: start at the first segment after it
+            after = checkpoint[0] if checkpoint else -1
+            pending = [s for s in segments if s > after]
+            self.segment = pending[0] if pending else after + 1
+            self.offset = 0
+
+    def read(self) -> Iterator[Tuple[dict, Position]]:
+        while self.until is None or self.segment < self.until:
+            yield from self._read_segment()
+            later = [
+                s
+                for s in list_segments(self.directory)
+                if s > self.segment and (self.until is None or s < self.until)
+            ]
+            if not later:
+                return
+            # the writer finished this segment before creating the next one,
+            # read it once more in case it grew since the last pass
+            yield from self._read_segment()
+            self.segment, self.offset = later[0], 0
+
+    def _read_segment(self) -> Iterator[Tuple[dict, Position]]:
+        try:
+            f = open(segment_path(self.directory, self.segment), "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(self.offset)
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                length, crc = HEADER.unpack(header)
+                payload = f.read(length)
+                # a record still being written, or torn by a crash
+                if len(payload) < length:
+                    return
+                if zlib.crc32(payload) != crc:
+                    print(
+                        f"Corrupt spool record in {segment_path(self.directory, self.segment)} "
+                        f"at {self.offset}, skipping the rest of the segment",
+                        file=sys.stderr,
+                    )
+                    self.offset = os.fstat(f.fileno()).st_size
+                    return
+                self.offset += HEADER.size + length
+                yield json.loads(payload), (self.segment, self.offset)
+
+
+# the consumer stops reading while this many messages wait for a flush, a
+# stalled database backs up into the spool instead of into memory
+SPOOL_MAX_PENDING = int(os.environ.get("SPOOL_MAX_PENDING", "20000"))
+
+
+def drain(handler, reader: SpoolReader, stream_id: int) -> bool:
+    # False when it stopped early, the limit is checked before a record is read
+    records = reader.read()
+    while len(handler.message_batch) < SPOOL_MAX_PENDING:
+        record = next(records, None)
+        if record is None:
+            return True
+        message, position = record
+        handler.track_timestamp(stream_id, message.get("timestamp"))
+        handler.track_spool_position(stream_id, position)
+        handler.save_message(message, stream_id)
+    return False
+
+
+def consume(handler, reader: SpoolReader, writer: SpoolWriter, stream_id: int):
+    # the only user of the handler's sessions while the download thread appends
+    while True:
+        finished = writer.closed
+        writer.appended.clear()
+        drained = drain(handler, reader, stream_id)
+        handler._check_flush_conditions()
+        writer.sync_if_due()
+        checkpoint = handler.spool_checkpoint.get(stream_id)
+        if checkpoint:
+            remove_consumed(writer.directory, checkpoint)
+        if finished and drained and not handler.message_batch:
+            return
+        if finished:
+            # the last batch goes out now, there is nothing left to wait for
+            handler.flush_batch()
+            if handler.message_batch:
+                raise RuntimeError(f"Could not flush spooled messages for stream {stream_id}")
+            continue
+        wait = handler.policy.linger
+        if handler.first_queued_at is not None:
+            wait -= time.monotonic() - handler.first_queued_at
+        writer.appended.wait(min(1.0, max(0.05, wait)))
@@ -0,0 +1,37 @@
+from sqlalchemy import Table, delete, insert, select
+from sqlalchemy.orm import Session
+from typing import Dict
+import os
+
+from models.schema import (
+    TwitchChatMessage,
+    TwitchChatMessageStaging,
+    YouTubeChatMessage,
+    YouTubeChatMessageStaging,
+)
+
+# staged rows are merged once this many have piled up, so a long VOD download
+# still shows up in the message list while it runs
+BULK_MERGE_ROWS = int(os.environ.get("BULK_MERGE_ROWS", "50000"))
+
+STAGING_TABLES: Dict[type, Table] = {
+    TwitchChatMessage: TwitchChatMessageStaging,
+    YouTubeChatMessage: YouTubeChatMessageStaging,
+}
+
+
+def merge_staged_messages(db: Session, model_class, stream_id: int) -> int:
+    staging = STAGING_TABLES[model_class]
+    columns = [column.name for column in staging.columns if not column.primary_key]
+
+    # sorted inserts append to the (stream_id, timestamp) index instead of
+    # splitting pages all over it
+    rows = (
+        select(*[staging.c[name] for name in columns])
+        .where(staging.c.stream_id == stream_id)
+        .order_by(staging.c.timestamp, staging.c.id)
+    )
+    result = db.execute(insert(model_class.__table__).from_select(columns, rows))
+    db.execute(delete(staging).where(staging.c.stream_id == stream_id))
+    return result.rowcount
+
@@ -0,0 +1,129 @@
+from sqlalchemy import Table, delete, select, text
+from sqlalchemy.orm import Session
+from typing import List
+import os
+import sys
+import time
+
+from models.schema import (
+    AlertHit,
+    AuthorStream,
+    DownloadJob,
+    Stream,
+    StreamRevenue,
+    TwitchChatMessage,
+    TwitchChatMessageStaging,
+    YouTubeChatMessage,
+    YouTubeChatMessageStaging,
+)
+from models import spool
+from database import run_write, SHARDED_TABLES
+import database
+
+PURGE_BATCH_SIZE = 2000
+PURGE_BATCH_PAUSE = 0.05
+VACUUM_PAGES_PER_STEP = 1000
+VACUUM_MAX_SECONDS = float(os.environ.get("VACUUM_MAX_SECONDS", "30"))
+
+# every table holding per-stream rows, emptied before the stream row itself goes
+STREAM_SCOPED_TABLES: List[Table] = [
+    TwitchChatMessage.__table__,
+    YouTubeChatMessage.__table__,
+    TwitchChatMessageStaging,
+    YouTubeChatMessageStaging,
+]
+
+
+def _delete_batch(db: Session, table: Table, stream_id: int, batch_size: int) -> int:
+    batch_ids = (
+        select(table.c.id)
+        .where(table.c.stream_id == stream_id)
+        .limit(batch_size)
+        .scalar_subquery()
+    )
+    result = db.execute(delete(table).where(table.c.id.in_(batch_ids)))
+    return result.rowcount
+
+
+def _vacuum_pages(db: Session, pages: int):
+    # the driver stops a pragma after its first step, and every step frees one
+    # page, so incremental_vacuum(N) frees a single page per execute
+    for _ in range(pages):
+        db.execute(text("PRAGMA incremental_vacuum(1)"))
+
+
+def incremental_vacuum(
+    db: Session,
+    pages_per_step: int = VACUUM_PAGES_PER_STEP,
+    pause: float = PURGE_BATCH_PAUSE,
+    max_seconds: float = VACUUM_MAX_SECONDS,
+) -> int:
+    # pages left over when time runs out are reclaimed by the next purge
+    if db.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+        return 0
+    started = time.monotonic()
+    freed = 0
+    while True:
+        free = db.execute(text("PRAGMA freelist_count")).scalar()
+        if not free:
+            break
+        if time.monotonic() - started >= max_seconds:
+            print(f"Incremental vacuum stopped after {max_seconds}s, {free} free pages left")
+            break
+        pages = min(pages_per_step, free)
+        run_write(db, lambda: _vacuum_pages(db, pages), "purge")
+        freed += pages
+        # other writers get the lock between steps
+        time.sleep(pause)
+    return freed
+
+
+def purge_stream(
+    db: Session,
+    stream_id: int,
+    batch_size: int = PURGE_BATCH_SIZE,
+    pause: float = PURGE_BATCH_PAUSE,
+) -> int:
+    total = 0
+    spool.remove_stream(database.spool_dir, stream_id)
+
+    for table in STREAM_SCOPED_TABLES:
+        if database.is_sharded() and table in SHARDED_TABLES:
+            continue
+        while True:
+            deleted = run_write(
+                db, lambda: _delete_batch(db, table, stream_id, batch_size), "purge"
+            )
+            total += deleted
+            if deleted < batch_size:
+                break
+            time.sleep(pause)
+
+    # handlers drop batches for streams marked as deleting, so no new rows land here
+    def delete_stream():
+        db.query(DownloadJob).filter(DownloadJob.stream_id == stream_id).delete()
+        db.query(AuthorStream).filter(AuthorStream.stream_id == stream_id).delete()
+        db.query(AlertHit).filter(AlertHit.stream_id == stream_id).delete()
+        db.query(StreamRevenue).filter(StreamRevenue.stream_id == stream_id).delete()
+        db.query(Stream).filter(Stream.id == stream_id).delete()
+
+    run_write(db, delete_stream, "purge")
+    # only once the stream row is gone: while it exists, opening the shard
+    # would create the file again
+    if database.is_sharded():
+        database.shards.drop(stream_id)
+    incremental_vacuum(db, pause=pause)
+    return total
+
+
+def run_purge(session_factory, stream_id: int):
+    db = session_factory()
+    try:
+        deleted = purge_stream(db, stream_id)
+        print(f"Deleted stream {stream_id} ({deleted} rows)")
+    except Exception as e:
+        print(f"Error deleting stream {stream_id}: {e}", file=sys.stderr)
+        db.rollback()
+    finally:
+        sys.stdout.flush()
+        db.close()
@@ -0,0 +1,109 @@
+from contextlib import ExitStack
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+import heapq
+import itertools
+import os
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+
+from models.queries import get_model_class
+from models.schema import Stream
+from models.timestamps import to_micros
+import database
+
+# rows read from one stream at a time while merging, a page over many streams
+# only reads about as far into each of them as the page reaches
+TIMELINE_FETCH_ROWS = int(os.environ.get("TIMELINE_FETCH_ROWS", "200"))
+# every stream of a page is queried and held open while merging
+TIMELINE_MAX_STREAMS = int(os.environ.get("TIMELINE_MAX_STREAMS", "50"))
+
+# (timestamp, stream id, message id), the order of the merged timeline
+Position = Tuple[int, int, int]
+
+
+def parse_cursor(cursor: str) -> Position:
+    timestamp, stream_id, message_id = (int(part) for part in cursor.split(":"))
+    return timestamp, stream_id, message_id
+
+
+def format_cursor(position: Position) -> str:
+    return ":".join(str(part) for part in position)
+
+
+def stream_messages(
+    message_db: Session,
+    stream: Stream,
+    message_group_ids: List[int],
+    after: Optional[Position] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    fetch_rows: int = TIMELINE_FETCH_ROWS,
+) -> Iterator[Tuple[Position, object]]:
+    # one stream in timeline order, read in keyset pages off the (stream_id, timestamp) index
+    model_class = get_model_class(stream.platform)
+    query = message_db.query(model_class).filter(model_class.stream_id == stream.id)
+    if message_group_ids:
+        query = query.filter(model_class.message_group_id.in_(message_group_ids))
+    if date_from:
+        query = query.filter(model_class.timestamp > to_micros(date_from))
+    if date_to:
+        query = query.filter(model_class.timestamp < to_micros(date_to))
+
+    last = None
+    if after:
+        timestamp, stream_id, message_id = after
+        # ties on the timestamp are broken by stream id, then message id
+        if stream.id > stream_id:
+            query = query.filter(model_class.timestamp >= timestamp)
+        elif stream.id < stream_id:
+            query = query.filter(model_class.timestamp > timestamp)
+        else:
+            last = (timestamp, message_id)
+
+    while True:
+        page = query
+        if last:
+            page = page.filter(tuple_(model_class.timestamp, model_class.id) > last)
+        rows = page.order_by(model_class.timestamp, model_class.id).limit(fetch_rows).all()
+        for row in rows:
+            yield (row.timestamp, stream.id, row.id), row
+        if len(rows) < fetch_rows:
+            return
+        last = (rows[-1].timestamp, rows[-1].id)
+
+
+def merged_messages(
+    db: Session,
+    streams: List[Stream],
+    message_group_ids: List[int],
+    limit: int,
+    after: Optional[Position] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+) -> Tuple[List[Tuple[Stream, object]], Optional[Position]]:
+    """The next limit messages of all streams in time order.
+
+    Returns (stream, message) pairs and the position to continue after, None
+    when every stream is read to the end.
+    """
+    fetch_rows = max(1, min(TIMELINE_FETCH_ROWS, limit + 1))
+    with ExitStack() as sessions:
+        cursors = []
+        for stream in streams:
+            message_db = sessions.enter_context(
+                database.message_session(stream.id, db, read_only=True)
+            )
+            cursors.append(
+                stream_messages(
+                    message_db, stream, message_group_ids, after, date_from, date_to, fetch_rows
+                )
+            )
+        by_id = {stream.id: stream for stream in streams}
+        merged = list(
+            itertools.islice(heapq.merge(*cursors, key=lambda item: item[0]), limit + 1)
+        )
+
+    next_position = merged[limit - 1][0] if len(merged) > limit else None
+    return [(by_id[position[1]], row) for position, row in merged[:limit]], next_position
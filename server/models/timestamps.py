@@ -0,0 +1,24 @@
+from datetime import datetime, timedelta
+from typing import Optional
+import time
+
+# message tables store integer microseconds since the unix epoch;
+# datetimes only appear at the API boundary, in local time as before
+
+
+def now_micros() -> int:
+    return time.time_ns() // 1_000
+
+
+def to_micros(value: Optional[datetime]) -> Optional[int]:
+    if value is None:
+        return None
+    seconds = int(value.replace(microsecond=0).timestamp())
+    return seconds * 1_000_000 + value.microsecond
+
+
+def from_micros(value: Optional[int]) -> Optional[datetime]:
+    if value is None:
+        return None
+    seconds, micros = divmod(int(value), 1_000_000)
+    return datetime.fromtimestamp(seconds) + timedelta(microseconds=micros)
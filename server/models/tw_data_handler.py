@@ -1,85 +1,112 @@
 from models.schema import TwitchChatMessage
-from models.dicts import message_types
+from models.records import TwitchMessageRecord, badge_flags
+from models.dicts import message_types, PlatformType
 from typing import Dict, Any, Optional
-from datetime import datetime
 from models.base_data_handler import BaseDataHandler
+from models.author_cache import AuthorInfo
+from models.revenue import sub_plan
 import sys
 
 from sqlalchemy.orm import Session
 
 class TwitchDataHandler(BaseDataHandler):
-    def __init__(self, db: Optional[Session] = None):
-        super().__init__(db)
+    message_class = TwitchChatMessage
+    platform = PlatformType.TWITCH.value
+
+    def __init__(
+        self,
+        db: Optional[Session] = None,
+        message_db: Optional[Session] = None,
+        bulk: bool = False,
+        policy=None,
+    ):
+        super().__init__(db, message_db=message_db, bulk=bulk, policy=policy)
 
     def save_message(
         self, data: Dict[str, Any], stream_id: Optional[int] = None
     ) -> bool:
         try:
-            author = data.get("author", {})
-            message_type = data.get("message_type", "")
-            message_group = message_types.get(message_type)
-
-            if not message_group:
-                print(f"Unknown message type: {message_type}")
-                sys.stdout.flush()
+            chat_message = self.build_record(data, stream_id)
+            if chat_message is None:
                 return False
 
-            if message_type == "ban_user":
-                chat_message = self._create_ban_message(
-                    data, message_group, stream_id
-                )
-            else:
-                chat_message = self._create_regular_message(
-                    data, message_group, stream_id, author
-                )
-
-            self.message_batch.append(chat_message)
-            self._increment_message_count(stream_id)
-
-            self._check_flush_conditions()
+            self.queue_record(chat_message, stream_id)
 
             return True
 
         except Exception as e:
             print(f"Error saving message: {e}")
             sys.stdout.flush()
-            self.db.rollback()
+            self.message_db.rollback()
             return False
 
-    def _create_ban_message(self, data: Dict[str, Any], message_group, stream_id: Optional[int]) -> TwitchChatMessage:
+    @classmethod
+    def build_record(
+        cls, data: Dict[str, Any], stream_id: Optional[int] = None
+    ) -> Optional[TwitchMessageRecord]:
+        author = data.get("author", {})
+        message_type = data.get("message_type", "")
+        message_group = message_types.get(message_type)
+
+        if not message_group:
+            print(f"Unknown message type: {message_type}")
+            sys.stdout.flush()
+            return None
+
+        if message_type == "ban_user":
+            return cls._create_ban_message(data, message_group, stream_id)
+        return cls._create_regular_message(data, message_group, stream_id, author)
+
+    @classmethod
+    def _create_ban_message(cls, data: Dict[str, Any], message_group, stream_id: Optional[int]) -> TwitchMessageRecord:
         author = data.get("author", {})
         author_name = data.get("banned_user")
         author_id = author.get("target_id")
         ban_type = "timeout" if data.get("ban_type") == "timeout" else "permaban"
         message = f"User {author_name} got {ban_type}"
 
-        return TwitchChatMessage(
+        return TwitchMessageRecord(
             message_group_id=message_group.value,
             stream_id=stream_id,
-            author_name=author_name,
-            timestamp=datetime.fromtimestamp(data.get("timestamp", 0) / 1_000_000),
-            author_id=author_id,
-            author_display_name=author_name,
+            timestamp=data.get("timestamp", 0),
+            author=AuthorInfo(author_id, author_name),
             system_message=message,
             ban_duration=data.get("ban_duration"),
             ban_type=ban_type,
         )
 
-    def _create_regular_message(self, data: Dict[str, Any], message_group, stream_id: Optional[int], author: Dict[str, Any]) -> TwitchChatMessage:
+    @classmethod
+    def _create_regular_message(cls, data: Dict[str, Any], message_group, stream_id: Optional[int], author: Dict[str, Any]) -> TwitchMessageRecord:
         message_type = data.get("message_type", "")
+        is_subscription = "subscription" in message_type
+
+        is_moderator = author.get("is_moderator")
+        is_subscriber = author.get("is_subscriber")
+        # replayed chat can come without the flags, the badges carry the same information
+        if is_moderator is None or is_subscriber is None:
+            flags = badge_flags(cls.platform, author.get("badges", ()))
+            if is_moderator is None:
+                is_moderator = flags["is_moderator"]
+            if is_subscriber is None:
+                is_subscriber = flags["is_subscriber"]
+        sub_tier, sub_prime = sub_plan(data) if is_subscription else (None, None)
 
-        return TwitchChatMessage(
+        return TwitchMessageRecord(
             message_id=data.get("message_id"),
             message_group_id=message_group.value,
-            timestamp=datetime.fromtimestamp(data.get("timestamp", 0) / 1_000_000),
+            timestamp=data.get("timestamp", 0),
             stream_id=stream_id,
-            author_name=author.get("name"),
-            author_id=author.get("id"),
-            author_display_name=author.get("display_name"),
-            is_moderator=author.get("is_moderator"),
-            is_subscriber=author.get("is_subscriber"),
-            colour=data.get("colour"),
+            author=AuthorInfo(
+                author.get("id"),
+                author.get("name"),
+                author.get("display_name"),
+                data.get("colour"),
+            ),
+            is_moderator=is_moderator,
+            is_subscriber=is_subscriber,
             message=data.get("message"),
-            cumulative_months=data.get("cumulative_months") if "subscription" in message_type else None,
-            system_message=data.get("system_message") if "subscription" in message_type else None,
+            cumulative_months=data.get("cumulative_months") if is_subscription else None,
+            sub_tier=sub_tier,
+            sub_prime=sub_prime,
+            system_message=data.get("system_message") if is_subscription else None,
         )
@@ -1,79 +1,102 @@
 from models.schema import YouTubeChatMessage
-from models.dicts import message_types
+from models.records import YouTubeMessageRecord, badge_flags
+from models.dicts import message_types, PlatformType
 from typing import Dict, Any, Optional
-from datetime import datetime
 from models.base_data_handler import BaseDataHandler
+from models.author_cache import AuthorInfo
+from models.revenue import money_value
 import sys
 
 from sqlalchemy.orm import Session
 
 class YouTubeDataHandler(BaseDataHandler):
-    def __init__(self, db: Optional[Session] = None):
-        super().__init__(db)
+    message_class = YouTubeChatMessage
+    platform = PlatformType.YOUTUBE.value
+
+    def __init__(
+        self,
+        db: Optional[Session] = None,
+        message_db: Optional[Session] = None,
+        bulk: bool = False,
+        policy=None,
+    ):
+        super().__init__(db, message_db=message_db, bulk=bulk, policy=policy)
 
     def save_message(
         self, data: Dict[str, Any], stream_id: Optional[int] = None
     ) -> bool:
         try:
-            message_type = data.get("message_type", "")
-            action_type = data.get("action_type")
-            message_group = message_types.get(message_type)
-
-            if action_type == "remove_chat_item":
+            if self.requires_session(data):
+                message_group = message_types.get(data.get("message_type", ""))
                 return self._handle_message_removal(data, message_group, stream_id)
 
-            if action_type == "remove_chat_item_by_author":
-                return True
-
-            if not message_group:
-                print(f"Unknown YouTube message type: {message_type}")
-                sys.stdout.flush()
-                return False
-
-            author = data.get("author", {})
-            badges = author.get("badges", [])
-            is_moderator = any(
-                badge.get("icon_name") == "moderator" for badge in badges
-            )
-            is_member = any("Member" in badge.get("title") for badge in badges)
-
-            chat_message = YouTubeChatMessage(
-                message_id=data.get("message_id"),
-                message_group_id=message_group.value,
-                timestamp=datetime.fromtimestamp(data.get("timestamp", 0) / 1_000_000),
-                stream_id=stream_id,
-                author_name=author.get("name"),
-                author_id=author.get("id"),
-                is_moderator=is_moderator,
-                is_member=is_member,
-                message=data.get("message"),
-                header_primary_text=data.get("header_primary_text"),
-                header_secondary_text=data.get("header_secondary_text"),
-                money=data.get("money"),
-            )
-
-            self.message_batch.append(chat_message)
-            self._increment_message_count(stream_id)
-
-            self._check_flush_conditions()
+            chat_message = self.build_record(data, stream_id)
+            if chat_message is None:
+                # removals by author carry nothing to store
+                return data.get("action_type") == "remove_chat_item_by_author"
+
+            self.queue_record(chat_message, stream_id)
 
             return True
 
         except Exception as e:
             print(f"Error saving YouTube message: {e}")
             sys.stdout.flush()
-            self.db.rollback()
+            self.message_db.rollback()
             return False
 
+    @classmethod
+    def requires_session(cls, data: Dict[str, Any]) -> bool:
+        # a removal marks the stored target row, it cannot be normalized on its own
+        return data.get("action_type") == "remove_chat_item"
+
+    @classmethod
+    def build_record(
+        cls, data: Dict[str, Any], stream_id: Optional[int] = None
+    ) -> Optional[YouTubeMessageRecord]:
+        message_type = data.get("message_type", "")
+        message_group = message_types.get(message_type)
+
+        if data.get("action_type") == "remove_chat_item_by_author":
+            return None
+
+        if not message_group:
+            print(f"Unknown YouTube message type: {message_type}")
+            sys.stdout.flush()
+            return None
+
+        author = data.get("author", {})
+        flags = badge_flags(cls.platform, author.get("badges", ()))
+        money = data.get("money")
+        money_amount, money_currency = money_value(money)
+
+        return YouTubeMessageRecord(
+            message_id=data.get("message_id"),
+            message_group_id=message_group.value,
+            timestamp=data.get("timestamp", 0),
+            stream_id=stream_id,
+            author=AuthorInfo(author.get("id"), author.get("name")),
+            is_moderator=flags["is_moderator"],
+            is_member=flags["is_member"],
+            message=data.get("message"),
+            header_primary_text=data.get("header_primary_text"),
+            header_secondary_text=data.get("header_secondary_text"),
+            money=money,
+            money_amount=money_amount,
+            money_currency=money_currency,
+        )
+
     def _handle_message_removal(self, data: Dict[str, Any], message_group, stream_id: Optional[int]) -> bool:
         target_message_id = data.get("target_message_id")
         if not target_message_id:
             return False
 
         self.flush_batch()
+        # the target may still sit in the unindexed staging table
+        self.merge_staged()
 
         result = (
-            self.db.query(YouTubeChatMessage)
+            self.message_db.query(YouTubeChatMessage)
             .filter(YouTubeChatMessage.message_id == target_message_id)
             .first()
         )
@@ -82,20 +105,16 @@ class YouTubeDataHandler(BaseDataHandler):
             return False
 
         result.deleted = True
-        chat_message = YouTubeChatMessage(
+        chat_message = YouTubeMessageRecord(
             message_group_id=message_group.value,
+            timestamp=None,
             stream_id=stream_id,
-            author_name=result.author_name,
-            author_id=result.author_id,
+            author_ref=result.author_ref,
             is_moderator=result.is_moderator,
             is_member=result.is_member,
             message=result.message,
             target_message_id=result.id,
         )
-        self.message_batch.append(chat_message)
-        self._increment_message_count(stream_id)
-
-        if len(self.message_batch) >= self.batch_size:
-            self.flush_batch()
+        self.queue_record(chat_message, stream_id)
 
         return True
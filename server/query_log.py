@@ -0,0 +1,143 @@
+from sqlalchemy import event
+from typing import Optional
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+import metrics
+
+PARAM_REPR_LIMIT = 200
+
+slow_queries = metrics.counter(
+    "db_slow_queries_total", "Sampled statements slower than the slow query threshold"
+)
+
+
+def _short(value) -> str:
+    text = repr(value)
+    if len(text) > PARAM_REPR_LIMIT:
+        return text[:PARAM_REPR_LIMIT] + "..."
+    return text
+
+
+def _format_plan(rows) -> list:
+    # rows are (id, parent, notused, detail), indent children under their parent
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
+
+
+def explain(dbapi_connection, statement: str, parameters) -> list:
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ())
+        return _format_plan(cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+class SlowQueryLog:
+    def __init__(
+        self,
+        threshold_ms: float = 200,
+        sample_rate: float = 1.0,
+        size: int = 50,
+    ):
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.size = size
+        # min-heap of (duration, sequence, entry): the slowest statements stay,
+        # the fastest kept one is the first to go
+        self.entries = []
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+
+    def configure(
+        self,
+        threshold_ms: Optional[float] = None,
+        sample_rate: Optional[float] = None,
+        size: Optional[int] = None,
+    ):
+        with self.lock:
+            if threshold_ms is not None:
+                self.threshold_ms = threshold_ms
+            if sample_rate is not None:
+                self.sample_rate = sample_rate
+            if size is not None and size != self.size:
+                self.size = size
+                self.entries = heapq.nlargest(size, self.entries)
+                heapq.heapify(self.entries)
+
+    def install(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # unsampled statements are not timed at all
+        sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+        # one slot per connection, a statement that raises never reaches
+        # _after_execute and must not leave anything behind
+        conn.info["query_started"] = time.perf_counter() if sampled else None
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("query_started", None)
+        if started is None:
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if elapsed_ms < self.threshold_ms:
+            return
+
+        slow_queries.inc()
+        with self.lock:
+            # faster than everything kept, not worth explaining
+            if self.size <= 0 or (
+                len(self.entries) >= self.size and elapsed_ms <= self.entries[0][0]
+            ):
+                return
+        if executemany:
+            plan = ["not explained: executemany"]
+            params = [_short(p) for p in parameters[:3]]
+        else:
+            params = [_short(p) for p in parameters or ()]
+            try:
+                plan = explain(cursor.connection, statement, parameters)
+            except Exception as e:
+                plan = [f"not explained: {e}"]
+        entry = {
+            "duration_ms": round(elapsed_ms, 3),
+            "recorded_at": time.time(),
+            "database": conn.engine.url.database,
+            "statement": statement,
+            "parameters": params,
+            "plan": plan,
+        }
+        with self.lock:
+            item = (elapsed_ms, next(self.sequence), entry)
+            if len(self.entries) < self.size:
+                heapq.heappush(self.entries, item)
+            elif self.size > 0:
+                heapq.heappushpop(self.entries, item)
+
+    def snapshot(self) -> list:
+        # slowest first
+        with self.lock:
+            entries = sorted(self.entries, reverse=True)
+        return [entry for _, _, entry in entries]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# SLOW_QUERY_MS=0 with a low SLOW_QUERY_SAMPLE_RATE records a sample of everything
+log = SlowQueryLog(
+    float(os.environ.get("SLOW_QUERY_MS", "200")),
+    float(os.environ.get("SLOW_QUERY_SAMPLE_RATE", "1.0")),
+    int(os.environ.get("SLOW_QUERY_LOG_SIZE", "50")),
+)
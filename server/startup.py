@@ -0,0 +1,72 @@
+# The API starts listening before its database maintenance is done: the steps
+# of the lifespan run in a worker thread, /health answers right away and every
+# other request waits until the steps are through.
+from typing import Callable, Dict, Iterable, Optional, Tuple
+import asyncio
+import sys
+import time
+
+from anyio import to_thread
+from starlette.responses import JSONResponse
+
+# paths served while the startup steps still run, they need no database
+UNGATED_PATHS = ("/health", "/metrics")
+
+
+class Startup:
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.error: Optional[BaseException] = None
+        # seconds each step took, in the order they ran
+        self.timings: Dict[str, float] = {}
+
+    @property
+    def status(self) -> str:
+        if self.error is not None:
+            return "error"
+        if self.task is not None and not self.task.done():
+            return "starting"
+        return "ok"
+
+    def start(self, steps: Iterable[Tuple[str, Callable[[], None]]]) -> None:
+        self.error = None
+        self.timings = {}
+        self.task = asyncio.get_running_loop().create_task(self._run(list(steps)))
+
+    async def _run(self, steps) -> None:
+        try:
+            await to_thread.run_sync(self._run_steps, steps)
+        except Exception as e:
+            self.error = e
+            print(f"Error during startup: {e}", file=sys.stderr)
+        finally:
+            sys.stdout.flush()
+
+    def _run_steps(self, steps) -> None:
+        for name, step in steps:
+            started = time.perf_counter()
+            step()
+            self.timings[name] = round(time.perf_counter() - started, 4)
+        print(f"Startup steps done in {sum(self.timings.values()):.2f}s")
+
+    async def wait(self) -> bool:
+        # true once the steps went through, right away when none were started
+        if self.task is not None and not self.task.done():
+            await asyncio.shield(self.task)
+        return self.error is None
+
+
+state = Startup()
+
+
+class StartupGateMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] not in UNGATED_PATHS:
+            if not await state.wait():
+                response = JSONResponse({"detail": "Server failed to start"}, status_code=503)
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
@@ -45,5 +45,34 @@ def client(db_session):
         yield db_session
 
     app.dependency_overrides[database.get_db] = override_get_db
+    app.dependency_overrides[database.get_read_db] = override_get_db
     yield TestClient(app)
     del app.dependency_overrides[database.get_db]
+    del app.dependency_overrides[database.get_read_db]
+
+@pytest.fixture(scope="function")
+def file_db(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'sql_app.db'}")
+    database.init_db()
+    db = database.SessionLocal()
+
+    yield db
+
+    db.close()
+    database.close_db()
+
+@pytest.fixture(scope="function")
+def sharded_db(tmp_path, monkeypatch):
+    monkeypatch.setenv("STORAGE_MODE", "sharded")
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'sql_app.db'}")
+    database.init_db()
+    db = database.SessionLocal()
+
+    yield db
+
+    db.close()
+    database.close_db()
+
+@pytest.fixture(scope="function")
+def file_client(file_db):
+    yield TestClient(app)
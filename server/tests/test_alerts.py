@@ -0,0 +1,196 @@
+import asyncio
+import random
+
+import pytest
+
+import database
+import main
+from models import alerts
+from models.alerts import AhoCorasick, AlertMatcher
+from models.dicts import PlatformType
+from models.schema import AlertHit, AlertRule, Stream
+from models.tw_data_handler import TwitchDataHandler
+from models.yt_data_handler import YouTubeDataHandler
+
+
+@pytest.fixture(autouse=True)
+def rules(monkeypatch):
+    # the compiled rules are process-wide, every test starts without any
+    monkeypatch.setattr(alerts, "rules", alerts.RuleSet())
+
+
+def _naive(patterns, text):
+    return sorted(
+        value
+        for pattern, values in patterns.items()
+        for start in range(len(text))
+        if text.startswith(pattern, start)
+        for value in values
+    )
+
+
+def test_automaton_finds_overlapping_patterns():
+    patterns = {"he": [1], "she": [2], "his": [3], "hers": [4], "e": [5]}
+    automaton = AhoCorasick(patterns)
+
+    assert sorted(automaton.search("ushers")) == _naive(patterns, "ushers") == [1, 2, 4, 5]
+
+    rng = random.Random(7)
+    for _ in range(50):
+        patterns = {
+            "".join(rng.choices("abc", k=rng.randint(1, 4))): [i] for i in range(20)
+        }
+        text = "".join(rng.choices("abc", k=60))
+        assert sorted(AhoCorasick(patterns).search(text)) == _naive(patterns, text)
+
+
+def _rule(rule_id, pattern, field="message", platform=None):
+    return AlertRule(id=rule_id, pattern=pattern, field=field, platform=platform)
+
+
+def test_matcher_rules():
+    matcher = AlertMatcher(
+        [
+            _rule(1, "Free Nitro"),
+            _rule(2, "nitro"),
+            _rule(3, "SpamBot", field="author"),
+            _rule(4, "raid", platform=PlatformType.YOUTUBE.value),
+        ]
+    )
+
+    assert matcher.match(1, "get FREE NITRO now, nitro!") == [1, 2]
+    assert matcher.match(1, "hello", ["someone", "spambot"]) == [3]
+    assert matcher.match(1, "raid incoming") == []
+    assert matcher.match(2, "raid incoming") == [4]
+    assert matcher.match(1, None, [None]) == []
+    assert not AlertMatcher()
+
+
+def _message(i, text, name="viewer"):
+    return {
+        "message_type": "text_message",
+        "message_id": f"m{i}",
+        "timestamp": 1_735_725_600_000_000 + i,
+        "message": text,
+        "author": {"id": name, "name": name, "display_name": name.title()},
+    }
+
+
+def _stream(db):
+    stream = Stream(url="https://www.twitch.tv/videos/1", platform=1, download_status="downloading")
+    db.add(stream)
+    db.commit()
+    return stream.id
+
+
+def test_handler_records_hits(file_db):
+    stream_id = _stream(file_db)
+    file_db.add_all([_rule(None, "giveaway"), _rule(None, "mallory", field="author")])
+    file_db.commit()
+    alerts.rules.refresh(file_db, force=True)
+    giveaway, mallory = [rule.id for rule in file_db.query(AlertRule).order_by(AlertRule.id)]
+
+    handler = TwitchDataHandler(file_db)
+    for i, (text, name) in enumerate(
+        [("hi", "alice"), ("GIVEAWAY here", "bob"), ("giveaway giveaway", "mallory"), ("bye", "carol")]
+    ):
+        handler.save_message(_message(i, text, name), stream_id)
+    handler.close()
+
+    hits = [(h.rule_id, h.message_id, h.author) for h in alerts.list_hits(file_db, stream_id=stream_id)]
+    assert hits == [(mallory, "m2", "Mallory"), (giveaway, "m2", "Mallory"), (giveaway, "m1", "Bob")]
+    assert [h.message_id for h in alerts.list_hits(file_db, rule_id=mallory)] == ["m2"]
+
+
+def test_removals_and_bans_do_not_fire_again(file_db):
+    stream = Stream(url="https://www.youtube.com/watch?v=1", platform=2, download_status="downloading")
+    file_db.add(stream)
+    file_db.add(_rule(None, "giveaway"))
+    file_db.commit()
+    alerts.rules.refresh(file_db, force=True)
+
+    handler = YouTubeDataHandler(file_db)
+    handler.save_message(_message(0, "giveaway here"), stream.id)
+    # the removal record carries the removed message's text
+    handler.save_message(
+        {"action_type": "remove_chat_item", "message_type": "ban_user", "target_message_id": "m0"},
+        stream.id,
+    )
+    handler.save_message({**_message(1, "giveaway ban"), "message_type": "ban_user"}, stream.id)
+    handler.close()
+
+    assert [h.message_id for h in alerts.list_hits(file_db, stream_id=stream.id)] == ["m0"]
+
+
+def test_rules_are_refreshed_outside_the_write_lock(file_db, monkeypatch):
+    stream_id = _stream(file_db)
+    held = []
+    monkeypatch.setattr(
+        alerts.rules,
+        "refresh",
+        lambda db: held.append(database.write_coordinator(db).lock.held_by_current_thread()),
+    )
+
+    handler = TwitchDataHandler(file_db)
+    handler.save_message(_message(0, "hi"), stream_id)
+    handler.close()
+
+    assert held == [False]
+
+
+def test_alert_endpoints(file_client, file_db):
+    stream_id = _stream(file_db)
+    assert file_client.post("/alerts/rules", json={"pattern": "x", "field": "colour"}).status_code == 400
+    assert file_client.post("/alerts/rules", json={"pattern": "  "}).status_code == 400
+    rule = file_client.post("/alerts/rules", json={"pattern": "pog"}).json()
+    assert [r["pattern"] for r in file_client.get("/alerts/rules").json()] == ["pog"]
+
+    handler = TwitchDataHandler(file_db)
+    for i in range(3):
+        handler.save_message(_message(i, "POG"), stream_id)
+    handler.close()
+
+    page = file_client.get("/alerts/hits", params={"ruleId": rule["id"], "limit": 2}).json()
+    assert [h["message_id"] for h in page["hits"]] == ["m2", "m1"]
+    page = file_client.get("/alerts/hits", params={"cursor": page["next_cursor"]}).json()
+    assert ([h["message_id"] for h in page["hits"]], page["next_cursor"]) == (["m0"], None)
+
+    assert file_client.delete(f"/alerts/rules/{rule['id']}").status_code == 200
+    assert file_client.delete(f"/alerts/rules/{rule['id']}").status_code == 404
+    assert file_db.query(AlertHit).count() == 0
+    assert not alerts.rules.matcher
+
+
+class _Request:
+    async def is_disconnected(self):
+        return False
+
+
+def test_event_stream_pushes_new_hits(file_db):
+    stream_id = _stream(file_db)
+    file_db.add(_rule(None, "pog"))
+    file_db.commit()
+    alerts.rules.refresh(file_db, force=True)
+
+    async def read_two():
+        events = main.alert_events(_Request(), 0, None, stream_id)
+        first = await events.__anext__()
+        # the handler commits while the stream waits for the next hit
+        loop = asyncio.get_running_loop()
+        loop.run_in_executor(None, _write, file_db, stream_id, 1)
+        second = await asyncio.wait_for(events.__anext__(), 5)
+        await events.aclose()
+        return first, second
+
+    _write(file_db, stream_id, 0)
+    first, second = asyncio.run(read_two())
+
+    assert first.startswith("id: 1\nevent: hit\n") and '"message_id":"m0"' in first
+    assert second.startswith("id: 2\n") and '"message_id":"m1"' in second
+    assert not alerts.broker.subscribers
+
+
+def _write(db, stream_id, i):
+    handler = TwitchDataHandler()
+    handler.save_message(_message(i, "pog"), stream_id)
+    handler.close()
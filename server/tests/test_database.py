@@ -0,0 +1,203 @@
+import os
+import sqlite3
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import database
+from main import app
+from models.schema import Stream, TwitchChatMessage
+from models.dicts import PlatformType
+from models import stream_purge
+from models.stream_purge import purge_stream
+from models.tw_data_handler import TwitchDataHandler
+
+
+def _twitch_message(i):
+    return {
+        "message_type": "text_message",
+        "message_id": f"msg-{i}",
+        "timestamp": 1_700_000_000_000_000 + i * 1_000_000,
+        "author": {"name": f"user{i}"},
+        "message": f"message {i}",
+    }
+
+
+def test_sharded_storage(sharded_db):
+    streams = [
+        Stream(
+            url=f"https://www.twitch.tv/videos/{i}",
+            platform=PlatformType.TWITCH.value,
+            download_status="completed",
+        )
+        for i in range(2)
+    ]
+    sharded_db.add_all(streams)
+    sharded_db.commit()
+
+    for stream in streams:
+        handler = TwitchDataHandler(
+            sharded_db, message_db=database.open_message_db(stream.id)
+        )
+        for i in range(3):
+            handler.save_message(_twitch_message(i), stream_id=stream.id)
+        handler.close()
+
+    assert os.path.exists(database.shards.path(streams[0].id))
+    stream = sharded_db.query(Stream).filter(Stream.id == streams[0].id).one()
+    assert stream.message_count == 3
+
+    with database.message_session(streams[0].id, sharded_db) as message_db:
+        assert message_db.query(TwitchChatMessage).count() == 3
+
+    client = TestClient(app)
+    response = client.get(f"/streams/{streams[1].id}/messages")
+    assert response.status_code == 200
+    assert response.json()["pagination"]["total_count"] == 3
+
+    purge_stream(sharded_db, streams[0].id, pause=0)
+
+    assert not os.path.exists(database.shards.path(streams[0].id))
+    assert sharded_db.query(Stream).filter(Stream.id == streams[0].id).first() is None
+    with database.message_session(streams[1].id, sharded_db) as message_db:
+        assert message_db.query(TwitchChatMessage).count() == 3
+
+
+def test_shard_cache_is_bounded(sharded_db):
+    database.shards.capacity = 2
+    for stream_id in (1, 2, 3):
+        database.open_message_db(stream_id).close()
+
+    assert list(database.shards.handles) == [2, 3]
+    database.open_message_db(2).close()
+    database.open_message_db(4).close()
+    assert list(database.shards.handles) == [2, 4]
+
+
+def test_read_engine_is_read_only(file_db):
+    read_db = database.ReadSessionLocal()
+    try:
+        assert read_db.execute(text("PRAGMA query_only")).scalar() == 1
+        with pytest.raises(OperationalError):
+            read_db.execute(
+                text(
+                    "INSERT INTO streams (url, platform, download_status, message_count) "
+                    "VALUES ('https://www.twitch.tv/videos/1', 1, 'completed', 0)"
+                )
+            )
+    finally:
+        read_db.close()
+
+
+def test_reads_do_not_wait_for_writers(file_db):
+    file_db.add(
+        Stream(
+            url="https://www.twitch.tv/videos/1",
+            platform=PlatformType.TWITCH.value,
+            download_status="completed",
+        )
+    )
+    file_db.commit()
+
+    writer = database.engine.raw_connection()
+    try:
+        writer.execute("BEGIN IMMEDIATE")
+        writer.execute("UPDATE streams SET download_status = 'downloading'")
+
+        read_db = database.ReadSessionLocal()
+        try:
+            started = time.perf_counter()
+            stream = read_db.query(Stream).one()
+            assert time.perf_counter() - started < 1
+            assert stream.download_status == "completed"
+        finally:
+            read_db.close()
+    finally:
+        writer.rollback()
+        writer.close()
+
+
+def test_writer_transactions_roll_back(file_db):
+    file_db.add(
+        Stream(
+            url="https://www.twitch.tv/videos/1",
+            platform=PlatformType.TWITCH.value,
+            download_status="completed",
+        )
+    )
+    file_db.flush()
+    file_db.rollback()
+
+    assert file_db.query(Stream).count() == 0
+
+
+def test_engine_settings_from_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'sql_app.db'}")
+    monkeypatch.setenv("DB_READ_POOL_SIZE", "3")
+    monkeypatch.setenv("DB_WRITE_CACHE_SIZE", "1234")
+    database.init_db()
+    try:
+        assert database.read_engine.pool.size() == 3
+        assert database.engine.pool.size() == database.WRITE_ENGINE_DEFAULTS["pool_size"]
+        with database.engine.connect() as conn:
+            assert conn.execute(text("PRAGMA cache_size")).scalar() == 1234
+    finally:
+        database.close_db()
+
+
+def test_purge_drops_the_shard_after_the_stream_row(sharded_db, monkeypatch):
+    stream = Stream(url="https://www.twitch.tv/videos/1", platform=PlatformType.TWITCH.value)
+    sharded_db.add(stream)
+    sharded_db.commit()
+    stream_id = stream.id
+    run_write = stream_purge.run_write
+
+    def open_meanwhile(db, operation, owner, *args):
+        # a request that still sees the stream row opens its shard
+        if db.query(Stream).filter(Stream.id == stream_id).first() is not None:
+            database.open_message_db(stream_id).close()
+        return run_write(db, operation, owner, *args)
+
+    monkeypatch.setattr(stream_purge, "run_write", open_meanwhile)
+    purge_stream(sharded_db, stream_id, pause=0)
+
+    assert not os.path.exists(database.shards.path(stream_id))
+
+
+def test_retried_catalog_commit_does_not_repeat_shard_rows(sharded_db, monkeypatch):
+    stream = Stream(url="https://www.twitch.tv/videos/1", platform=PlatformType.TWITCH.value)
+    sharded_db.add(stream)
+    sharded_db.commit()
+    handler = TwitchDataHandler(sharded_db, message_db=database.open_message_db(stream.id))
+    commit = sharded_db.commit
+    failures = [
+        OperationalError("COMMIT", {}, sqlite3.OperationalError("database is locked")),
+        OperationalError("COMMIT", {}, sqlite3.OperationalError("disk I/O error")),
+    ]
+
+    def failing_commit():
+        # the shard is committed by now, the catalog commit fails
+        if failures:
+            raise failures.pop(0)
+        commit()
+
+    monkeypatch.setattr(sharded_db, "commit", failing_commit)
+    for i in range(3):
+        handler.save_message(_twitch_message(i), stream_id=stream.id)
+    # retried after the lock error, then given up on
+    handler.flush_batch()
+    assert len(handler.message_batch) == 3
+
+    handler.save_message(_twitch_message(3), stream_id=stream.id)
+    handler.flush_batch()
+    handler.close()
+
+    with database.message_session(stream.id, sharded_db) as message_db:
+        assert message_db.query(TwitchChatMessage).count() == 4
+    sharded_db.expire_all()
+    assert sharded_db.get(Stream, stream.id).message_count == 4
+    stats = database.write_stats()[sharded_db.get_bind().url.database]
+    assert stats["attempts"] - stats["transactions"] == 2
@@ -0,0 +1,88 @@
+import random
+
+from models.duplicates import DuplicateDetector, signature
+from models.schema import Stream, TwitchChatMessage
+from models.tw_data_handler import TwitchDataHandler
+
+WAVE = "COPY THIS IF YOU LOVE THE STREAM ❤️ PogChamp PogChamp"
+
+
+def test_near_duplicates_share_a_cluster():
+    detector = DuplicateDetector()
+
+    wave = [
+        detector.assign(WAVE),
+        detector.assign(WAVE.lower()),
+        detector.assign(WAVE + " !!"),
+        detector.assign("COPY THIS IF YOU LOVE THE STREAM PogChamp PogChamp"),
+        detector.assign("COPY  THIS IF YOU LOOOOVE THE STREAM ❤️ PogChamp PogChamp"),
+    ]
+    other = detector.assign("what time does the stream start tomorrow?")
+
+    assert len(set(wave)) == 1
+    assert other not in wave
+    assert detector.assign("gg") == detector.assign("GG")
+    assert detector.assign("gg") != detector.assign("lol")
+    assert detector.assign("") is None
+    assert signature("   ") is None
+
+
+def test_memory_is_bounded_by_the_window():
+    detector = DuplicateDetector(window=10)
+    rng = random.Random(3)
+    words = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel"]
+
+    for _ in range(1000):
+        detector.assign(" ".join(rng.choices(words, k=6)) + str(rng.random()))
+
+    assert len(detector.buckets) <= 10 * 4
+    # an active cluster survives everything else passing through
+    detector = DuplicateDetector(window=10)
+    first = detector.assign(WAVE)
+    for i in range(50):
+        detector.assign(f"unrelated message number {i} {rng.random()}")
+        assert detector.assign(WAVE) == first
+
+
+def _message(i, text):
+    return {
+        "message_type": "text_message",
+        "message_id": f"m{i}",
+        "timestamp": 1_735_725_600_000_000 + i * 1_000_000,
+        "message": text,
+        "author": {"id": str(i), "name": f"user{i}"},
+    }
+
+
+def test_top_clusters_endpoint(file_client, file_db):
+    stream = Stream(url="https://www.twitch.tv/videos/1", platform=1, download_status="completed")
+    file_db.add(stream)
+    file_db.commit()
+    stream_id = stream.id
+    texts = [WAVE] * 5 + ["hello there"] * 3 + ["unique message"] + [WAVE + " !"] * 2
+    handler = TwitchDataHandler(file_db)
+    for i, text in enumerate(texts):
+        handler.save_message(_message(i, text), stream_id)
+    handler.close()
+
+    clusters = file_client.get(f"/streams/{stream_id}/clusters").json()["clusters"]
+
+    assert [(c["count"], c["message"]) for c in clusters] == [(7, WAVE), (3, "hello there")]
+    stored = {
+        m.message_id: m.cluster_id
+        for m in file_db.query(TwitchChatMessage).filter(TwitchChatMessage.stream_id == stream_id)
+    }
+    assert all(stored.values())
+    messages = file_client.get(
+        f"/streams/{stream_id}/messages", params={"clusterId": clusters[1]["cluster_id"]}
+    ).json()["messages"]
+    assert sorted(m["uuid"] for m in messages) == ["m5", "m6", "m7"]
+    assert messages[0]["clusterId"] == clusters[1]["cluster_id"]
+
+    # the window covers only the first half of the wave
+    window = file_client.get(
+        f"/streams/{stream_id}/clusters",
+        params={"dateTo": "2025-01-01T10:00:03", "minSize": 1},
+    ).json()["clusters"]
+    assert [c["count"] for c in window] == [3]
+    assert file_client.get("/streams/999/clusters").status_code == 404
@@ -0,0 +1,38 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+import main
+from models import exporter
+
+
+def _job(name, rows):
+    return exporter.ExportJob(name, "ndjson", lambda: (rows, ["message"]))
+
+
+@pytest.mark.parametrize("archive_format", ["tar", "zip"])
+def test_members_are_streamed_in_chunks(archive_format):
+    rows = [{"message": "x" * 1000}] * 10_000
+    jobs = [_job("big", rows), _job("small", rows[:2])]
+
+    chunks = list(exporter.stream_archive(jobs, archive_format, max_workers=1))
+
+    # a 10 MB member never sits in memory as one piece
+    assert max(len(chunk) for chunk in chunks) < 8 * 1024 * 1024
+    data = io.BytesIO(b"".join(chunks))
+    if archive_format == "tar":
+        assert len(data.getvalue()) % tarfile.RECORDSIZE == 0
+        with tarfile.open(fileobj=data) as archive:
+            assert archive.getnames() == ["big.ndjson", "small.ndjson"]
+            assert len(archive.extractfile("big.ndjson").read().splitlines()) == 10_000
+            assert len(archive.extractfile("small.ndjson").read().splitlines()) == 2
+    else:
+        with zipfile.ZipFile(data) as archive:
+            assert len(archive.read("big.ndjson").splitlines()) == 10_000
+
+
+def test_stream_deleted_during_export_gives_no_rows(file_db):
+    request = main.BulkExportRequest(stream_ids=[999])
+    assert list(main.produce_export_rows(999, request)) == []
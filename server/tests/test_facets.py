@@ -0,0 +1,140 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+from main import app
+from models import facets
+from models.dicts import MessageGroup, PlatformType
+from models.schema import Stream
+from models.tw_data_handler import TwitchDataHandler
+
+START_US = 1_735_725_600_000_000
+
+
+@pytest.fixture(autouse=True)
+def facet_cache(monkeypatch):
+    monkeypatch.setattr(facets, "cache", facets.FacetCache())
+
+
+def _chat(i, name, text, moderator=False, subscriber=False):
+    return {
+        "message_type": "text_message",
+        "message_id": f"m{i}",
+        "timestamp": START_US + i * 1_000_000,
+        "message": text,
+        "author": {"id": name, "name": name, "is_moderator": moderator, "is_subscriber": subscriber},
+    }
+
+
+def _messages():
+    messages = [
+        _chat(0, "mod", "hello chat", moderator=True, subscriber=True),
+        _chat(1, "sub", "hello", subscriber=True),
+        _chat(2, "troll", "spam spam"),
+        _chat(3, "troll", "more spam"),
+        _chat(4, "viewer", "gg"),
+        {
+            "message_type": "ban_user",
+            "timestamp": START_US + 5_000_000,
+            "banned_user": "troll",
+            "ban_type": "permaban",
+            "author": {"target_id": "troll"},
+        },
+    ]
+    return messages
+
+
+def _stream(db, messages, bulk=False):
+    stream = Stream(url="https://www.twitch.tv/videos/1", platform=PlatformType.TWITCH.value, download_status="completed")
+    db.add(stream)
+    db.commit()
+    handler = TwitchDataHandler(db, message_db=database.open_message_db(stream.id), bulk=bulk)
+    for message in messages:
+        handler.save_message(message, stream.id)
+    return stream.id, handler
+
+
+@pytest.mark.parametrize("storage", ["file_db", "sharded_db"])
+def test_one_pass_counts(request, storage):
+    db = request.getfixturevalue(storage)
+    stream_id, handler = _stream(db, _messages())
+    handler.close()
+    stream = db.get(Stream, stream_id)
+
+    with database.message_session(stream_id, db) as message_db:
+        counts = facets.count_facets(message_db, stream, [])
+        filtered = facets.count_facets(message_db, stream, [], include_banned_users=False, message="hello")
+
+    assert counts == {
+        MessageGroup.messages.value: (5, 1, 2, 2),
+        MessageGroup.bans.value: (1, 0, 0, 1),
+    }
+    assert facets.totals(counts) == (6, 1, 2, 3)
+    assert filtered == {MessageGroup.messages.value: (2, 1, 2, 0)}
+
+
+@pytest.mark.parametrize("storage", ["file_db", "sharded_db"])
+@pytest.mark.parametrize("group_ids", ["", "1", "2", "1,2", "3"])
+@pytest.mark.parametrize("include_banned", [True, False])
+@pytest.mark.parametrize("moderators", [False, True])
+def test_totals_match_the_message_list(request, storage, group_ids, include_banned, moderators):
+    db = request.getfixturevalue(storage)
+    stream_id, handler = _stream(db, _messages())
+    handler.close()
+    client = TestClient(app)
+    params = {"includeBannedUsers": include_banned, "moderators": moderators}
+    if group_ids:
+        params["messageGroupIds"] = group_ids
+
+    listed = client.get(f"/streams/{stream_id}/messages", params=params).json()
+    counted = client.get(f"/streams/{stream_id}/facets", params=params).json()
+
+    assert counted["total_count"] == listed["pagination"]["total_count"]
+    assert sum(g["count"] for g in counted["message_groups"]) == counted["total_count"]
+
+
+def test_endpoint_is_cached_until_the_watermark_moves(file_db, monkeypatch):
+    stream_id, handler = _stream(file_db, _messages())
+    handler.flush_batch()
+    passes = []
+    count_facets = facets.count_facets
+    monkeypatch.setattr(facets, "count_facets", lambda *args: passes.append(1) or count_facets(*args))
+    client = TestClient(app)
+
+    first = client.get(f"/streams/{stream_id}/facets")
+    second = client.get(f"/streams/{stream_id}/facets", params={"messageGroupIds": "1"})
+
+    assert first.status_code == 200
+    assert first.json()["total_count"] == 6
+    again = client.get(f"/streams/{stream_id}/facets")
+    assert second.json()["total_count"] == 5
+    assert [g["message_group_id"] for g in second.json()["message_groups"]] == [1]
+    assert again.json() == first.json()
+    # the second selection is a filter set of its own, the repeat is cached
+    assert len(passes) == 2
+
+    handler.save_message(_chat(6, "viewer", "new"), stream_id)
+    handler.flush_batch()
+    third = client.get(f"/streams/{stream_id}/facets")
+
+    assert third.json()["total_count"] == 7
+    assert len(passes) == 3
+    handler.close()
+
+    assert client.get(f"/streams/{stream_id}/facets", params={"messageGroupIds": "x"}).status_code == 400
+    assert client.get("/streams/999/facets").status_code == 404
+
+
+def test_merging_staged_rows_moves_the_watermark(file_db):
+    stream_id, handler = _stream(file_db, _messages(), bulk=True)
+    handler.flush_batch()
+    client = TestClient(app)
+
+    # staged rows are not listed yet
+    assert client.get(f"/streams/{stream_id}/facets").json()["total_count"] == 0
+
+    handler.merge_staged()
+    file_db.expire_all()
+
+    assert client.get(f"/streams/{stream_id}/facets").json()["total_count"] == 6
+    handler.close()
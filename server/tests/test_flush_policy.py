@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+import time
+
+import database
+from models import spool
+from models.flush_policy import AdaptiveFlushPolicy
+from models.schema import Stream, TwitchChatMessage
+from models.tw_data_handler import TwitchDataHandler
+
+TW_MESSAGES_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "data", "tw_messages.json"
+)
+
+with open(TW_MESSAGES_PATH) as f:
+    TW_MESSAGES_DATA = json.load(f)
+
+
+def _observe(policy, rate, commit_seconds, flushes=10):
+    # feed flushes as if messages had arrived at the given rate
+    for _ in range(flushes):
+        policy.last_flush_at = time.monotonic() - 1.0
+        policy.record_flush(int(rate), commit_seconds)
+
+
+def test_quiet_stream_flushes_quickly():
+    policy = AdaptiveFlushPolicy(max_delay=5)
+    _observe(policy, rate=0.5, commit_seconds=0.005)
+
+    assert policy.linger < 1
+    assert policy.batch_size == policy.min_batch
+    assert policy.due(1, policy.linger)
+    assert not policy.due(1, policy.linger / 2)
+    assert not policy.due(0, 60)
+
+
+def test_busy_stream_batches_up_to_max_delay():
+    policy = AdaptiveFlushPolicy(max_delay=5, max_batch=2000)
+    _observe(policy, rate=50, commit_seconds=0.005)
+
+    assert policy.linger == 5
+    assert 200 <= policy.batch_size <= 250
+    assert policy.due(policy.batch_size, 0)
+
+    _observe(policy, rate=5000, commit_seconds=0.005)
+    assert policy.batch_size == 2000
+
+
+def test_slow_commits_stretch_the_linger():
+    policy = AdaptiveFlushPolicy(max_delay=5)
+    _observe(policy, rate=0.5, commit_seconds=0.2)
+    assert 1.9 <= policy.linger <= 2.1
+
+    policy.configure(max_delay=1)
+    assert policy.linger == 1
+    assert policy.state()["max_delay"] == 1
+
+
+def test_consumer_writes_quiet_messages_without_new_arrivals(file_db):
+    stream = Stream(url="https://www.twitch.tv/videos/1", platform=1, download_status="downloading")
+    file_db.add(stream)
+    file_db.commit()
+    stream_id = stream.id
+    directory = spool.stream_directory(database.spool_dir, stream_id)
+    writer = spool.SpoolWriter(directory)
+    handler = TwitchDataHandler(file_db, policy=AdaptiveFlushPolicy(min_linger=0.05))
+    consumer = threading.Thread(
+        target=spool.consume,
+        args=(handler, spool.SpoolReader(directory), writer, stream_id),
+    )
+    consumer.start()
+    try:
+        writer.append(TW_MESSAGES_DATA[0])
+        # nothing else arrives, the linger alone has to flush the message
+        deadline = time.monotonic() + 5
+        while stream_id not in handler.spool_checkpoint and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert stream_id in handler.spool_checkpoint
+    finally:
+        writer.close()
+        consumer.join()
+        handler.close()
+
+    assert file_db.query(TwitchChatMessage).count() == 1
+
+
+def test_flush_policy_endpoints(file_db, file_client):
+    stream = Stream(url="https://www.twitch.tv/videos/1", platform=1, download_status="completed")
+    file_db.add(stream)
+    file_db.commit()
+
+    response = file_client.patch(
+        f"/streams/{stream.id}/flush-policy", json={"max_delay": 2.5, "max_batch": 500}
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        "stream_id": stream.id,
+        "max_delay": 2.5,
+        "max_batch": 500,
+        "active": None,
+    }
+
+    file_client.patch(f"/streams/{stream.id}/flush-policy", json={"max_delay": None})
+    body = file_client.get(f"/streams/{stream.id}/flush-policy").json()
+    assert body["max_delay"] is None
+    assert body["max_batch"] == 500
+
+    assert (
+        file_client.patch(f"/streams/{stream.id}/flush-policy", json={"max_batch": 0}).status_code
+        == 400
+    )
+    assert file_client.get("/streams/999999/flush-policy").status_code == 404
@@ -0,0 +1,121 @@
+import io
+import json
+import os
+import time
+
+import pytest
+from sqlalchemy import func, select
+
+import main
+from models.dicts import PlatformType
+from models.importer import MessageReader, guess_platform, run_import
+from models.schema import Stream, TwitchChatMessage, YouTubeChatMessage
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+
+
+def _load(name):
+    with open(os.path.join(DATA_DIR, name), "rb") as f:
+        return f.read()
+
+
+def _count(db, model, stream_id):
+    return db.execute(
+        select(func.count()).select_from(model).where(model.stream_id == stream_id)
+    ).scalar()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_reader_matches_json_load(chunk_size):
+    raw = _load("moderation_log3.json")
+
+    reader = MessageReader(io.BytesIO(raw), chunk_size=chunk_size)
+
+    assert list(reader) == json.loads(raw)
+    assert reader.bytes_read == len(raw)
+
+
+def test_reader_handles_ndjson_and_multibyte_text():
+    messages = [{"message": "héllo 👋", "i": i} for i in range(5)]
+    raw = "\n".join(json.dumps(m, ensure_ascii=False) for m in messages).encode("utf-8")
+
+    assert list(MessageReader(io.BytesIO(raw), chunk_size=1)) == messages
+    assert list(MessageReader(io.BytesIO(b"[]"))) == []
+    assert list(MessageReader(io.BytesIO(b""))) == []
+
+
+@pytest.mark.parametrize("raw", [b'[{"a": 1}, {"a": ', b'[{"a": 1} {"a": 2}]', b'{"a": 1}\n{"a" 2}', b'[{"a": 1}] x'])
+def test_reader_rejects_broken_files(raw):
+    with pytest.raises(ValueError):
+        list(MessageReader(io.BytesIO(raw), chunk_size=4))
+
+
+def test_guess_platform():
+    assert guess_platform(json.loads(_load("tw_messages.json"))[0]) == PlatformType.TWITCH
+    assert guess_platform(json.loads(_load("yt_messages.json"))[0]) == PlatformType.YOUTUBE
+
+
+def test_import_creates_a_completed_stream(file_db):
+    ndjson = b"\n".join(
+        json.dumps(m).encode() for name in ("tw_messages.json", "tw_subscriptions.json")
+        for m in json.loads(_load(name))
+    )
+    reports = []
+
+    stream_id = run_import(
+        file_db,
+        io.BytesIO(ndjson),
+        title="archive",
+        progress=lambda reader, imported: reports.append((reader.bytes_read, imported)),
+    )
+
+    file_db.expire_all()
+    stream = file_db.get(Stream, stream_id)
+    assert (stream.platform, stream.title, stream.status) == (1, "archive", "past")
+    assert stream.download_status == "completed"
+    assert stream.message_count == 20
+    assert _count(file_db, TwitchChatMessage, stream_id) == 20
+    assert reports[-1] == (len(ndjson), 20)
+
+
+def test_upload_endpoint_imports_in_the_background(file_client, file_db):
+    raw = _load("moderation_log3.json")
+
+    response = file_client.post("/streams/import?title=moderation", content=raw)
+
+    assert response.status_code == 200
+    stream = response.json()
+    assert stream["platform"] == PlatformType.YOUTUBE.value
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        progress = file_client.get(f"/streams/{stream['id']}/import").json()
+        if progress["done"] or progress["error"]:
+            break
+        time.sleep(0.05)
+    assert progress["error"] is None
+    assert progress["bytes_read"] == progress["total_bytes"] == len(raw)
+    file_db.expire_all()
+    assert file_db.get(Stream, stream["id"]).download_status == "completed"
+    # removals by author are accepted without adding a row
+    assert 0 < _count(file_db, YouTubeChatMessage, stream["id"]) <= progress["messages"]
+
+
+def test_upload_endpoint_rejects_what_it_cannot_read(file_client):
+    assert file_client.post("/streams/import", content=b"").status_code == 400
+    assert file_client.post("/streams/import", content=b"[{").status_code == 400
+    assert file_client.post("/streams/import?platform=kick", content=b"[]").status_code == 400
+
+
+def test_finished_imports_are_forgotten(file_client, monkeypatch):
+    def entry(stream_id, finished_at):
+        return {"stream_id": stream_id, "done": finished_at is not None, "finished_at": finished_at}
+
+    monkeypatch.setattr(main, "imports", {
+        1: entry(1, time.time() - main.IMPORT_PROGRESS_TTL - 1),
+        2: entry(2, None),
+        3: entry(3, time.time()),
+    })
+
+    assert file_client.get("/streams/2/import").status_code == 200
+    assert file_client.get("/streams/1/import").status_code == 404
+    assert sorted(main.imports) == [2, 3]
@@ -0,0 +1,147 @@
+import functools
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import func, select
+
+from models import ingest_process, spool
+from models.schema import Stream, TwitchChatMessage, YouTubeChatMessage
+from models.tw_data_handler import TwitchDataHandler
+import database
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+
+
+class FakeChat:
+    title = "fake"
+    id = "fake-id"
+    status = "live"
+    duration = 60.0
+
+    def __init__(self, messages, block_after=None):
+        self.messages = messages
+        self.block_after = block_after
+
+    def __iter__(self):
+        for i, message in enumerate(self.messages):
+            if i == self.block_after:
+                # a live chat with nothing new to say
+                time.sleep(60)
+            yield message
+
+
+# these run in the spawned child, so they have to be importable from there
+def twitch_chat(url, platform):
+    with open(os.path.join(DATA_DIR, "tw_messages.json")) as f:
+        return FakeChat(json.load(f) * 5)
+
+
+def quiet_twitch_chat(url, platform):
+    with open(os.path.join(DATA_DIR, "tw_messages.json")) as f:
+        return FakeChat(json.load(f) * 3, block_after=15)
+
+
+def youtube_chat(url, platform):
+    messages = []
+    for name in ("yt_messages.json", "yt_superchats.json"):
+        with open(os.path.join(DATA_DIR, name)) as f:
+            messages.extend(json.load(f))
+    return FakeChat(messages)
+
+
+def _stream(db, platform):
+    stream = Stream(url=f"https://example.com/{platform}", platform=platform, download_status="downloading")
+    db.add(stream)
+    db.commit()
+    stream_id = stream.id
+    db.expunge_all()
+    return stream_id
+
+
+def _count(db, model, stream_id):
+    return db.execute(
+        select(func.count()).select_from(model).where(model.stream_id == stream_id)
+    ).scalar()
+
+
+def _stored(handler_class, messages):
+    return sum(
+        1
+        for m in messages
+        if not handler_class.requires_session(m) and handler_class.build_record(m, 1)
+    )
+
+
+def test_child_normalizes_and_parent_writes(file_db):
+    stream_id = _stream(file_db, 1)
+    directory = spool.stream_directory(database.spool_dir, stream_id)
+    ingest = ingest_process.ProcessIngest(
+        stream_id, "https://example.com/1", 1, directory, 0, chat_factory=twitch_chat
+    )
+    chat = ingest.started(threading.Event())
+    handler = TwitchDataHandler(file_db)
+    ingest.consume(handler, threading.Event())
+    ingest.close()
+
+    assert chat.title == "fake"
+    assert ingest.finished
+    expected = _stored(TwitchDataHandler, twitch_chat(None, 1).messages)
+    assert _count(file_db, TwitchChatMessage, stream_id) == expected
+    stream = file_db.get(Stream, stream_id)
+    assert stream.message_count == expected
+    # the checkpoint is the end of the spool the child wrote
+    assert list(spool.SpoolReader(directory, handler.spool_checkpoint[stream_id]).read()) == []
+    handler.close()
+
+
+def test_process_mode_download(file_db, monkeypatch):
+    import main
+
+    stream_id = _stream(file_db, 2)
+    monkeypatch.setattr(ingest_process, "INGEST_MODE", "process")
+    monkeypatch.setattr(
+        ingest_process,
+        "ProcessIngest",
+        functools.partial(ingest_process.ProcessIngest, chat_factory=youtube_chat),
+    )
+
+    main.start_download(stream_id, threading.Event())
+
+    file_db.expire_all()
+    stream = file_db.get(Stream, stream_id)
+    assert stream.download_status == "completed"
+    assert stream.title == "fake"
+    from models.yt_data_handler import YouTubeDataHandler
+
+    expected = _stored(YouTubeDataHandler, youtube_chat(None, 2).messages)
+    assert expected
+    assert _count(file_db, YouTubeChatMessage, stream_id) == expected
+    assert not os.path.exists(spool.stream_directory(database.spool_dir, stream_id))
+
+
+def test_stop_hands_over_what_was_spooled(file_db, monkeypatch):
+    import main
+
+    stream_id = _stream(file_db, 1)
+    monkeypatch.setattr(ingest_process, "INGEST_MODE", "process")
+    monkeypatch.setattr(
+        ingest_process,
+        "ProcessIngest",
+        functools.partial(ingest_process.ProcessIngest, chat_factory=quiet_twitch_chat),
+    )
+    stop_event = threading.Event()
+    # pause once the first messages are in, the chat then blocks for a minute
+    threading.Timer(1.5, stop_event.set).start()
+
+    started = time.monotonic()
+    main.start_download(stream_id, stop_event)
+
+    assert time.monotonic() - started < 30
+    file_db.expire_all()
+    assert file_db.get(Stream, stream_id).download_status == "downloading"
+    assert _count(file_db, TwitchChatMessage, stream_id) == _stored(
+        TwitchDataHandler, quiet_twitch_chat(None, 1).messages[:15]
+    )
+    assert not os.path.exists(spool.stream_directory(database.spool_dir, stream_id))
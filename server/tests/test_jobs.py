@@ -0,0 +1,140 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from models import jobs
+from models.dicts import JobState
+from models.schema import DownloadJob, Stream
+import database
+
+
+def _streams(db, count):
+    streams = [
+        Stream(url=f"https://www.twitch.tv/videos/{i}", platform=1, download_status="downloading")
+        for i in range(count)
+    ]
+    db.add_all(streams)
+    db.flush()
+    for stream in streams:
+        jobs.request_state(db, stream.id, JobState.RUN)
+    db.commit()
+    return [stream.id for stream in streams]
+
+
+def _job(db, stream_id):
+    db.expire_all()
+    return db.get(DownloadJob, stream_id)
+
+
+def test_each_job_is_claimed_once(file_db):
+    stream_ids = _streams(file_db, 3)
+
+    first = jobs.claim(file_db, "a", 2)
+    second = jobs.claim(file_db, "b", 5)
+    file_db.commit()
+
+    assert len(first) == 2
+    assert sorted(first + second) == sorted(stream_ids)
+    assert jobs.claim(file_db, "c", 5) == []
+
+
+def test_expired_lease_is_reclaimed(file_db):
+    (stream_id,) = _streams(file_db, 1)
+    assert jobs.claim(file_db, "a", 1, lease_seconds=30) == [stream_id]
+    file_db.execute(
+        DownloadJob.__table__.update().values(lease_expires_at=datetime.now() - timedelta(seconds=1))
+    )
+
+    assert jobs.claim(file_db, "b", 1) == [stream_id]
+    # the old owner finds out at its next heartbeat
+    assert jobs.renew(file_db, "a", [stream_id]) == {}
+    assert jobs.renew(file_db, "b", [stream_id]) == {stream_id: "run"}
+    file_db.commit()
+    assert _job(file_db, stream_id).attempts == 2
+
+
+def test_signals_reach_the_owner_through_renew(file_db):
+    (stream_id,) = _streams(file_db, 1)
+    jobs.claim(file_db, "a", 1)
+    jobs.request_state(file_db, stream_id, JobState.PAUSE)
+
+    assert jobs.renew(file_db, "a", [stream_id]) == {stream_id: "pause"}
+    # a paused job is not claimed again after its owner lets go
+    jobs.release(file_db, "a", stream_id, finished=True)
+    assert jobs.claim(file_db, "b", 1) == []
+    file_db.commit()
+    assert _job(file_db, stream_id).desired_state == "pause"
+
+
+def test_release(file_db):
+    done_id, interrupted_id = _streams(file_db, 2)
+    jobs.claim(file_db, "a", 2)
+
+    jobs.release(file_db, "a", done_id, finished=True)
+    jobs.release(file_db, "a", interrupted_id, finished=False)
+    # only the owner can let go of a job
+    jobs.release(file_db, "b", done_id, finished=False)
+    file_db.commit()
+
+    assert _job(file_db, done_id).desired_state == "done"
+    assert _job(file_db, interrupted_id).desired_state == "run"
+    assert _job(file_db, interrupted_id).owner is None
+    assert jobs.claim(file_db, "b", 5) == [interrupted_id]
+
+
+def test_workers_split_jobs_and_stop_on_signal(file_db):
+    stream_ids = _streams(file_db, 3)
+    started = {}
+
+    def fake_download(stream_id, stop_event):
+        started[stream_id] = threading.current_thread().name
+        stop_event.wait(5)
+
+    a = jobs.JobWorker(database.SessionLocal, fake_download, capacity=2)
+    b = jobs.JobWorker(database.SessionLocal, fake_download, capacity=2)
+    a.heartbeat(file_db)
+    b.heartbeat(file_db)
+
+    assert len(a.running) == 2 and len(b.running) == 1
+    assert sorted(started) == sorted(stream_ids)
+
+    (paused_id,) = b.running
+    database.run_write(
+        file_db, lambda: jobs.request_state(file_db, paused_id, JobState.PAUSE), "test"
+    )
+    b.heartbeat(file_db)
+    deadline = time.monotonic() + 5
+    while b.is_running(paused_id) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert not b.is_running(paused_id)
+    job = _job(file_db, paused_id)
+    assert (job.desired_state, job.owner) == ("pause", None)
+
+    # a is still busy, b has room but nothing left to claim
+    b.heartbeat(file_db)
+    assert not b.running
+    for thread, stop_event in list(a.running.values()):
+        stop_event.set()
+        thread.join()
+
+
+def test_pause_and_resume_go_through_the_job(file_client, file_db, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main.job_worker, "wake", lambda: None)
+    response = file_client.post("/streams/", json={"url": "https://www.twitch.tv/videos/5"})
+    stream_id = response.json()["id"]
+    assert _job(file_db, stream_id).desired_state == "run"
+
+    assert file_client.patch(f"/streams/{stream_id}/resume").status_code == 400
+    assert file_client.patch(f"/streams/{stream_id}/pause").status_code == 200
+    assert _job(file_db, stream_id).desired_state == "pause"
+    assert file_client.patch(f"/streams/{stream_id}/pause").status_code == 400
+
+    assert file_client.patch(f"/streams/{stream_id}/resume").status_code == 200
+    assert _job(file_db, stream_id).desired_state == "run"
+    listed = file_client.get("/jobs").json()
+    assert [(j["stream_id"], j["desired_state"], j["leased"]) for j in listed] == [
+        (stream_id, "run", False)
+    ]
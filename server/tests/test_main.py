@@ -1,6 +1,21 @@
+import asyncio
+import csv
+import io
+import json
+import tarfile
+import threading
+import time
+import zipfile
 from datetime import datetime
-from models.schema import Stream, YouTubeChatMessage
+
+import httpx
+
+from main import app
+from models import exporter
+from models.tw_data_handler import TwitchDataHandler
+from models.schema import ChatAuthor, Stream, TwitchChatMessage, YouTubeChatMessage
 from models.dicts import PlatformType, MessageGroup
+from models.timestamps import to_micros
 
 
 def test_create_stream(client, db_session, monkeypatch):
@@ -39,30 +54,38 @@ def test_get_stream_messages(client, db_session):
             "message": "message 1",
             "author_name": "user2",
             "message_group_id": MessageGroup.messages.value,
-            "timestamp": datetime(2025, 1, 1, 12, 0, 0),
+            "timestamp": to_micros(datetime(2025, 1, 1, 12, 0, 0)),
         },
         {
             "message": "sub message",
             "author_name": "user2",
             "message_group_id": MessageGroup.subs.value,
-            "timestamp": datetime(2025, 1, 1, 12, 1, 0),
+            "timestamp": to_micros(datetime(2025, 1, 1, 12, 1, 0)),
         },
         {
             "message": "message 2 asd",
             "author_name": "user1",
             "message_group_id": MessageGroup.messages.value,
-            "timestamp": datetime(2025, 1, 1, 12, 2, 0),
+            "timestamp": to_micros(datetime(2025, 1, 1, 12, 2, 0)),
         },
         {
             "message": "user1 banned",
             "author_name": "user1",
             "message_group_id": MessageGroup.bans.value,
-            "timestamp": datetime(2025, 1, 1, 12, 3, 0),
+            "timestamp": to_micros(datetime(2025, 1, 1, 12, 3, 0)),
         },
     ]
 
+    authors = {
+        name: ChatAuthor(platform=PlatformType.YOUTUBE.value, name=name)
+        for name in ("user1", "user2")
+    }
     for msg_data in messages_data:
-        msg = YouTubeChatMessage(stream_id=test_stream.id, **msg_data)
+        msg = YouTubeChatMessage(
+            stream_id=test_stream.id,
+            author=authors[msg_data.pop("author_name")],
+            **msg_data,
+        )
         db_session.add(msg)
     db_session.commit()
 
@@ -101,3 +124,275 @@ def test_get_stream_messages(client, db_session):
     assert response.status_code == 200
     data = response.json()
     assert len(data["messages"]) == 2
+
+    # date range
+    response = client.get(
+        f"/streams/{test_stream.id}/messages"
+        "?dateFrom=2025-01-01T12:00:30&dateTo=2025-01-01T12:02:30"
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert [msg["message"] for msg in data["messages"]] == ["message 2 asd", "sub message"]
+    assert data["messages"][0]["timestamp"] == "2025-01-01T12:02:00"
+
+
+def test_bulk_export_streams(file_client, file_db):
+    yt_stream = Stream(
+        url="https://www.youtube.com/watch?v=bulk",
+        stream_id="bulk",
+        platform=PlatformType.YOUTUBE.value,
+        download_status="completed",
+    )
+    tw_stream = Stream(
+        url="https://www.twitch.tv/videos/1",
+        stream_id="1",
+        platform=PlatformType.TWITCH.value,
+        download_status="completed",
+    )
+    file_db.add_all([yt_stream, tw_stream])
+    file_db.commit()
+
+    for i in range(3):
+        file_db.add(
+            YouTubeChatMessage(
+                stream_id=yt_stream.id,
+                author=ChatAuthor(
+                    platform=PlatformType.YOUTUBE.value, name=f"yt_user{i}"
+                ),
+                message=f"yt message {i}",
+                message_group_id=MessageGroup.messages.value,
+                timestamp=to_micros(datetime(2025, 1, 1, 12, i, 0)),
+            )
+        )
+        file_db.add(
+            TwitchChatMessage(
+                stream_id=tw_stream.id,
+                author=ChatAuthor(
+                    platform=PlatformType.TWITCH.value, name=f"tw_user{i}"
+                ),
+                message=f"tw message {i}",
+                message_group_id=MessageGroup.messages.value,
+                timestamp=to_micros(datetime(2025, 1, 1, 12, i, 0)),
+            )
+        )
+    file_db.commit()
+
+    response = file_client.post(
+        "/streams/export",
+        json={
+            "stream_ids": [yt_stream.id, tw_stream.id],
+            "format": "ndjson",
+            "formats": {str(tw_stream.id): "csv"},
+        },
+    )
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    names = sorted(archive.namelist())
+    assert names == sorted([f"{yt_stream.id}_bulk.ndjson", f"{tw_stream.id}_1.csv"])
+
+    yt_rows = [
+        json.loads(line)
+        for line in archive.read(f"{yt_stream.id}_bulk.ndjson").decode().splitlines()
+    ]
+    assert [row["message"] for row in yt_rows] == [
+        "yt message 2",
+        "yt message 1",
+        "yt message 0",
+    ]
+    tw_rows = list(
+        csv.DictReader(io.StringIO(archive.read(f"{tw_stream.id}_1.csv").decode()))
+    )
+    assert len(tw_rows) == 3
+    assert tw_rows[0]["author_name"] == "tw_user2"
+
+    # tar archive with message filter
+    response = file_client.post(
+        "/streams/export",
+        json={"stream_ids": [yt_stream.id], "archive": "tar", "message": "message 1"},
+    )
+    assert response.status_code == 200
+    tar = tarfile.open(fileobj=io.BytesIO(response.content))
+    content = tar.extractfile(f"{yt_stream.id}_bulk.ndjson").read().decode()
+    assert len(content.splitlines()) == 1
+
+    response = file_client.post("/streams/export", json={"stream_ids": [999]})
+    assert response.status_code == 404
+
+    response = file_client.post(
+        "/streams/export", json={"stream_ids": [yt_stream.id], "format": "xml"}
+    )
+    assert response.status_code == 400
+
+
+def test_delete_stream_marks_deleting(client, db_session, monkeypatch):
+    purged = []
+    monkeypatch.setattr("main.start_purge", lambda stream_id: purged.append(stream_id))
+
+    test_stream = Stream(
+        url="https://www.youtube.com/watch?v=delete",
+        platform=PlatformType.YOUTUBE.value,
+        download_status="completed",
+    )
+    db_session.add(test_stream)
+    db_session.commit()
+
+    response = client.delete(f"/streams/{test_stream.id}")
+    assert response.status_code == 200
+    assert response.json() == {"status": "deleting", "stream_id": test_stream.id}
+    assert purged == [test_stream.id]
+    assert test_stream.download_status == "deleting"
+
+    response = client.get("/streams/")
+    assert test_stream.id not in [stream["id"] for stream in response.json()]
+
+    response = client.delete(f"/streams/{test_stream.id}")
+    assert response.json()["status"] == "deleting"
+    assert purged == [test_stream.id]
+
+
+def test_endpoints_stay_responsive_during_export_and_ingest(file_db, monkeypatch):
+    export_stream = Stream(
+        url="https://www.twitch.tv/videos/2",
+        platform=PlatformType.TWITCH.value,
+        download_status="completed",
+    )
+    live_stream = Stream(
+        url="https://www.twitch.tv/videos/3",
+        platform=PlatformType.TWITCH.value,
+        download_status="downloading",
+    )
+    file_db.add_all([export_stream, live_stream])
+    file_db.commit()
+    export_stream_id, live_stream_id = export_stream.id, live_stream.id
+    file_db.add(
+        TwitchChatMessage(
+            stream_id=export_stream_id,
+            author=ChatAuthor(platform=PlatformType.TWITCH.value, name="exported"),
+            message="exported",
+            message_group_id=MessageGroup.messages.value,
+            timestamp=to_micros(datetime(2025, 1, 1, 12, 0, 0)),
+        )
+    )
+    file_db.commit()
+
+    # the export blocks inside the endpoint until released, like a slow query
+    export_started = threading.Event()
+    release = threading.Event()
+    timeout = threading.Timer(10, release.set)
+    timeout.start()
+    export_row = exporter.export_row
+
+    def slow_export_row(msg, platform):
+        export_started.set()
+        release.wait()
+        return export_row(msg, platform)
+
+    monkeypatch.setattr(exporter, "export_row", slow_export_row)
+
+    def ingest():
+        handler = TwitchDataHandler()
+        for i in range(2000):
+            handler.save_message(
+                {
+                    "message_id": f"ingest-{i}",
+                    "message_type": "text_message",
+                    "timestamp": to_micros(datetime(2025, 1, 1, 13, 0, 0)) + i,
+                    "message": f"ingest {i}",
+                    "author": {"id": str(i % 50), "name": f"ingest_user{i % 50}"},
+                },
+                live_stream_id,
+            )
+        handler.close()
+
+    ingest_thread = threading.Thread(target=ingest)
+    ingest_thread.start()
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            export = asyncio.create_task(
+                ac.get(f"/streams/{export_stream_id}/export?format=csv")
+            )
+            while not export_started.is_set():
+                await asyncio.sleep(0.01)
+
+            started = time.perf_counter()
+            health = await ac.get("/health")
+            page = await ac.get(f"/streams/{live_stream_id}/messages?limit=50")
+            elapsed = time.perf_counter() - started
+            export_pending = not export.done()
+
+            release.set()
+            return health, page, elapsed, export_pending, await export
+
+    try:
+        health, page, elapsed, export_pending, export = asyncio.run(scenario())
+    finally:
+        release.set()
+        timeout.cancel()
+        ingest_thread.join()
+
+    assert health.status_code == 200
+    assert page.status_code == 200
+    assert export_pending
+    assert elapsed < 5
+    assert export.status_code == 200
+    assert "exported" in export.text
+    file_db.expire_all()
+    assert file_db.get(Stream, live_stream_id).message_count == 2000
+
+
+class FakeChat:
+    title = "fake"
+    id = "fake-id"
+    duration = 60.0
+
+    def __init__(self, messages, status="live", stop_after=None, stop_event=None):
+        self.messages = messages
+        self.status = status
+        self.stop_after = stop_after
+        self.stop_event = stop_event
+
+    def __iter__(self):
+        for i, message in enumerate(self.messages):
+            if i == self.stop_after:
+                self.stop_event.set()
+            yield message
+
+
+def _tw_message(i):
+    return {
+        "message_id": f"download-{i}",
+        "message_type": "text_message",
+        "timestamp": 1_750_000_000_000_000 + i * 1_000_000,
+        "message": f"message {i}",
+        "author": {"id": str(i % 7), "name": f"user{i % 7}"},
+    }
+
+
+def test_start_download_keeps_no_orm_rows(file_db, monkeypatch):
+    import main
+
+    stream = Stream(
+        url="https://www.twitch.tv/videos/42",
+        platform=PlatformType.TWITCH.value,
+        download_status="downloading",
+    )
+    file_db.add(stream)
+    file_db.commit()
+    stream_id = stream.id
+
+    stop_event = threading.Event()
+    chat = FakeChat([_tw_message(i) for i in range(30)], stop_after=20, stop_event=stop_event)
+    monkeypatch.setattr(main.ingest_process, "get_chat", lambda *args, **kwargs: chat)
+    main.start_download(stream_id, stop_event)
+
+    file_db.expire_all()
+    stream = file_db.get(Stream, stream_id)
+    assert stream.title == "fake"
+    assert stream.status == "live"
+    assert stream.message_count == 20
+    assert stream.download_status == "downloading"
+    assert stream.resume_timestamp == stream.last_message_timestamp
+    assert stream.last_message_timestamp == datetime.fromtimestamp(1_750_000_019)
+    assert stream_id not in main.running_handlers
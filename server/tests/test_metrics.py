@@ -0,0 +1,116 @@
+import gc
+import json
+import os
+import threading
+
+import metrics
+from models.flush_policy import FixedFlushPolicy
+from models.schema import Stream
+from models.tw_data_handler import TwitchDataHandler
+
+TW_MESSAGES_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "data", "tw_messages.json"
+)
+
+with open(TW_MESSAGES_PATH) as f:
+    TW_MESSAGES_DATA = json.load(f)
+
+
+def _sample(text: str, prefix: str) -> float:
+    for line in text.splitlines():
+        if line.startswith(prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    raise AssertionError(f"{prefix} not in output")
+
+
+def test_counter_sums_increments_from_all_threads():
+    counter = metrics.Counter("test_total", "test", ["kind"])
+
+    def work():
+        for _ in range(10000):
+            counter.inc(1, "a")
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc(2.5, "b")
+
+    assert counter.values() == {("a",): 80000, ("b",): 2.5}
+    assert counter.render() == [
+        "# HELP test_total test",
+        "# TYPE test_total counter",
+        'test_total{kind="a"} 80000',
+        'test_total{kind="b"} 2.5',
+    ]
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("test_seconds", "test", ["route"], buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, '/a"b')
+
+    assert histogram.render()[2:] == [
+        'test_seconds_bucket{route="/a\\"b",le="0.1"} 2',
+        'test_seconds_bucket{route="/a\\"b",le="1"} 3',
+        'test_seconds_bucket{route="/a\\"b",le="+Inf"} 4',
+        'test_seconds_sum{route="/a\\"b"} 3.65',
+        'test_seconds_count{route="/a\\"b"} 4',
+    ]
+
+
+def test_exited_threads_leave_their_totals_behind():
+    counter = metrics.Counter("test_total", "test", ["kind"])
+    histogram = metrics.Histogram("test_seconds", "test", buckets=(1,))
+
+    def work():
+        counter.inc(1, "a")
+        histogram.observe(0.5)
+
+    for _ in range(50):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    gc.collect()
+
+    # only the retired totals are left, not one dict per thread that ever ran
+    assert len(counter._shards._shards) == 0
+    assert len(histogram._shards._shards) == 0
+    assert counter.values() == {("a",): 50}
+    assert histogram.values() == {(): [50, 0, 25.0, 50]}
+    counter.inc(1, "a")
+    assert counter.values() == {("a",): 51}
+
+
+def test_metrics_endpoint(file_db, file_client):
+    file_db.add(Stream(id=9001, url="https://www.twitch.tv/videos/9001", platform=1))
+    file_db.commit()
+    handler = TwitchDataHandler(file_db, policy=FixedFlushPolicy(1000))
+    for message_data in TW_MESSAGES_DATA:
+        handler.save_message(message_data, stream_id=9001)
+    before = metrics.REGISTRY.render()
+    assert 'chat_pending_messages{stream_id="9001"}' in before
+    handler.close()
+
+    file_client.get("/health")
+    file_client.get("/streams/9001/messages")
+    response = file_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert _sample(text, 'chat_ingest_messages_total{stream_id="9001"}') == len(TW_MESSAGES_DATA)
+    assert 'chat_pending_messages{stream_id="9001"}' not in text
+    assert _sample(text, 'chat_flush_batch_size_count{platform="twitch"}') >= 1
+    assert _sample(text, 'db_file_size_bytes{file="main"}') > 0
+    assert 'db_file_size_bytes{file="wal"}' in text
+    assert _sample(text, "chat_active_downloads") == 0
+    assert (
+        _sample(
+            text,
+            'http_request_duration_seconds_count{method="GET",route="/health",status="200"}',
+        )
+        >= 1
+    )
+    assert 'route="/streams/{stream_id}/messages"' in text
@@ -0,0 +1,191 @@
+import sqlite3
+from datetime import datetime
+
+from sqlalchemy import text
+
+import database
+from models.timestamps import to_micros
+
+# schema as created by Base.metadata.create_all before migrations were introduced
+LEGACY_SCHEMA = """
+CREATE TABLE streams (
+    id INTEGER NOT NULL, url VARCHAR NOT NULL, title TEXT, stream_id VARCHAR,
+    platform INTEGER NOT NULL, status VARCHAR, download_status VARCHAR, error TEXT,
+    duration FLOAT, created_at DATETIME, updated_at DATETIME, resume_timestamp DATETIME,
+    last_message_timestamp DATETIME, message_count INTEGER NOT NULL, PRIMARY KEY (id)
+);
+CREATE TABLE twitch_chat_messages (
+    id INTEGER NOT NULL, message_id VARCHAR, message_group_id INTEGER NOT NULL,
+    timestamp DATETIME NOT NULL, stream_id INTEGER, author_name VARCHAR, author_id VARCHAR,
+    author_display_name VARCHAR, is_moderator BOOLEAN, is_subscriber BOOLEAN, colour VARCHAR,
+    message TEXT, ban_duration INTEGER, ban_type VARCHAR, cumulative_months INTEGER,
+    system_message TEXT, created_at DATETIME, PRIMARY KEY (id),
+    FOREIGN KEY(stream_id) REFERENCES streams (id)
+);
+CREATE INDEX ix_twitch_chat_message_group_id ON twitch_chat_messages (message_group_id);
+CREATE INDEX ix_twitch_chat_is_moderator ON twitch_chat_messages (is_moderator);
+CREATE INDEX ix_twitch_chat_timestamp ON twitch_chat_messages (timestamp);
+CREATE INDEX ix_twitch_chat_stream_id ON twitch_chat_messages (stream_id);
+CREATE INDEX ix_twitch_chat_author_name ON twitch_chat_messages (author_name);
+CREATE INDEX ix_twitch_chat_author_display_name ON twitch_chat_messages (author_display_name);
+CREATE INDEX ix_twitch_chat_message ON twitch_chat_messages (message);
+CREATE TABLE youtube_chat_messages (
+    id INTEGER NOT NULL, message_id VARCHAR, message_group_id INTEGER NOT NULL,
+    timestamp DATETIME, stream_id INTEGER, author_name VARCHAR, author_id VARCHAR,
+    is_moderator BOOLEAN NOT NULL, is_member BOOLEAN NOT NULL, message TEXT,
+    target_message_id VARCHAR, header_primary_text TEXT, header_secondary_text TEXT,
+    money JSON, deleted BOOLEAN NOT NULL, created_at DATETIME, PRIMARY KEY (id),
+    FOREIGN KEY(stream_id) REFERENCES streams (id)
+);
+CREATE INDEX ix_youtube_chat_message ON youtube_chat_messages (message);
+CREATE INDEX ix_youtube_chat_message_group_id ON youtube_chat_messages (message_group_id);
+CREATE INDEX ix_youtube_chat_stream_id ON youtube_chat_messages (stream_id);
+CREATE INDEX ix_youtube_chat_deleted ON youtube_chat_messages (deleted);
+CREATE INDEX ix_youtube_chat_is_moderator ON youtube_chat_messages (is_moderator);
+CREATE INDEX ix_youtube_chat_author_name ON youtube_chat_messages (author_name);
+CREATE INDEX ix_youtube_chat_author_id ON youtube_chat_messages (author_id);
+CREATE INDEX ix_youtube_chat_is_member ON youtube_chat_messages (is_member);
+CREATE INDEX ix_youtube_chat_target_message_id ON youtube_chat_messages (target_message_id);
+CREATE INDEX ix_youtube_chat_timestamp ON youtube_chat_messages (timestamp);
+"""
+
+
+def _create_legacy_db(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.execute(
+        "INSERT INTO streams (id, url, platform, download_status, message_count) "
+        "VALUES (1, 'https://www.twitch.tv/videos/1', 1, 'completed', 2)"
+    )
+    conn.executemany(
+        "INSERT INTO twitch_chat_messages "
+        "(message_group_id, timestamp, stream_id, author_name, message, created_at) "
+        "VALUES (1, ?, 1, 'user', ?, ?)",
+        [
+            ("2025-01-01 12:00:00.250000", "first", "2025-01-01 12:00:01.000000"),
+            ("2025-01-01 12:05:00.000000", "second", None),
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_legacy_database_is_migrated(tmp_path, monkeypatch):
+    db_path = tmp_path / "sql_app.db"
+    _create_legacy_db(db_path)
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{db_path}")
+
+    database.init_db()
+    try:
+        with database.engine.connect() as conn:
+            rows = conn.execute(
+                text(
+                    "SELECT timestamp, created_at, typeof(timestamp) "
+                    "FROM twitch_chat_messages ORDER BY id"
+                )
+            ).all()
+            authors = conn.execute(
+                text(
+                    "SELECT a.platform, a.name FROM twitch_chat_messages m "
+                    "JOIN chat_authors a ON a.id = m.author_ref"
+                )
+            ).all()
+            # stored messages are in the full-text index
+            matched = conn.execute(
+                text(
+                    "SELECT m.message FROM twitch_chat_messages_fts f "
+                    "JOIN twitch_chat_messages m ON m.id = f.rowid "
+                    "WHERE twitch_chat_messages_fts MATCH 'second'"
+                )
+            ).scalars().all()
+            assert conn.execute(text("SELECT version_num FROM alembic_version")).scalar()
+    finally:
+        database.close_db()
+
+    assert matched == ["second"]
+    assert rows[0] == (
+        to_micros(datetime(2025, 1, 1, 12, 0, 0, 250000)),
+        to_micros(datetime(2025, 1, 1, 12, 0, 1)),
+        "integer",
+    )
+    assert rows[1][0] == to_micros(datetime(2025, 1, 1, 12, 5, 0))
+    assert rows[1][1] is None
+    assert authors == [(1, "user"), (1, "user")]
+
+
+def test_fresh_database_is_stamped(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'sql_app.db'}")
+
+    database.init_db()
+    try:
+        with database.engine.connect() as conn:
+            version = conn.execute(text("SELECT version_num FROM alembic_version")).scalar()
+            auto_vacuum = conn.execute(text("PRAGMA auto_vacuum")).scalar()
+    finally:
+        database.close_db()
+
+    assert version
+    assert auto_vacuum == 2
+
+
+def test_running_downloads_become_jobs(tmp_path, monkeypatch):
+    db_path = tmp_path / "sql_app.db"
+    _create_legacy_db(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO streams (id, url, platform, download_status, message_count) "
+        "VALUES (?, ?, 1, ?, 0)",
+        [(2, "https://www.twitch.tv/videos/2", "downloading"), (3, "https://www.twitch.tv/videos/3", "paused")],
+    )
+    conn.commit()
+    conn.close()
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{db_path}")
+
+    database.init_db()
+    try:
+        with database.engine.connect() as conn:
+            jobs = conn.execute(
+                text("SELECT stream_id, desired_state, owner FROM download_jobs ORDER BY stream_id")
+            ).all()
+    finally:
+        database.close_db()
+
+    assert jobs == [(2, "run", None), (3, "pause", None)]
+
+
+def test_paid_messages_and_subs_are_backfilled(tmp_path, monkeypatch):
+    db_path = tmp_path / "sql_app.db"
+    _create_legacy_db(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO twitch_chat_messages (message_group_id, timestamp, stream_id, system_message) "
+        "VALUES (3, '2025-01-01 12:10:00.000000', 1, ?)",
+        [
+            ("a subscribed with Prime. They've subscribed for 3 months!",),
+            ("b gifted a Tier 2 sub to c!",),
+            ("d is gifting 5 Tier 1 Subs to someone's community!",),
+        ],
+    )
+    conn.execute(
+        "INSERT INTO youtube_chat_messages (message_group_id, stream_id, is_moderator, is_member, money, deleted) "
+        "VALUES (3, 1, 0, 0, ?, 0)",
+        ('{"amount": 1.99, "currency": "USD", "text": "$1.99"}',),
+    )
+    conn.commit()
+    conn.close()
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{db_path}")
+
+    database.init_db()
+    try:
+        with database.engine.connect() as conn:
+            subs = conn.execute(
+                text("SELECT sub_tier, sub_prime FROM twitch_chat_messages WHERE message_group_id = 3 ORDER BY id")
+            ).all()
+            money = conn.execute(
+                text("SELECT money_amount, money_currency FROM youtube_chat_messages")
+            ).all()
+    finally:
+        database.close_db()
+
+    assert subs == [(1, 1), (2, 0), (None, None)]
+    assert money == [(199, "USD")]
@@ -0,0 +1,57 @@
+import pytest
+from datetime import datetime
+from sqlalchemy import func, select, text
+
+from models.dicts import MessageGroup, PlatformType
+from models.queries import build_messages_query, get_model_class
+from models.schema import Stream, YouTubeChatMessage
+
+QUERY_CASES = [
+    {},
+    {"message_group_ids": [MessageGroup.messages.value, MessageGroup.bans.value]},
+    {"message_group_ids": [MessageGroup.bans.value]},
+    {"includeBannedUsers": False},
+    {"moderators": True},
+    {"username": "user"},
+    {"message": "hello"},
+    {"dateFrom": datetime(2025, 1, 1), "dateTo": datetime(2025, 2, 1)},
+]
+
+
+def _plan(db, statement):
+    sql = str(
+        statement.compile(db.get_bind(), compile_kwargs={"literal_binds": True})
+    )
+    return [row[3] for row in db.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+
+
+@pytest.mark.parametrize("platform", [PlatformType.TWITCH, PlatformType.YOUTUBE])
+@pytest.mark.parametrize("case", QUERY_CASES)
+def test_message_queries_use_indexes(db_session, platform, case):
+    stream = Stream(url="https://example.com", platform=platform.value, download_status="completed")
+    db_session.add(stream)
+    db_session.flush()
+
+    model_class = get_model_class(platform.value)
+    case = dict(case)
+    query = build_messages_query(
+        db_session, stream, case.pop("message_group_ids", []), **case
+    )
+    statements = [
+        query.order_by(model_class.timestamp.desc()).limit(500).statement,
+        query.statement.with_only_columns(func.count()),
+    ]
+
+    for statement in statements:
+        plan = _plan(db_session, statement)
+        assert not [
+            step for step in plan if step.startswith(f"SCAN {model_class.__tablename__}")
+        ], plan
+
+
+def test_message_removal_lookup_uses_index(db_session):
+    plan = _plan(
+        db_session,
+        select(YouTubeChatMessage).where(YouTubeChatMessage.message_id == "abc"),
+    )
+    assert any("ix_youtube_chat_message_id" in step for step in plan), plan
@@ -0,0 +1,86 @@
+import pytest
+from sqlalchemy import text
+
+import query_log
+from models.schema import TwitchChatMessage
+
+
+@pytest.fixture
+def slow_log():
+    log = query_log.log
+    saved = (log.threshold_ms, log.sample_rate, log.size)
+    log.clear()
+    yield log
+    log.configure(*saved)
+    log.clear()
+
+
+def test_records_statement_parameters_and_plan(file_db, slow_log):
+    slow_log.configure(threshold_ms=0)
+
+    file_db.query(TwitchChatMessage).filter(
+        TwitchChatMessage.stream_id == 7, TwitchChatMessage.timestamp > 5
+    ).all()
+
+    entries = [e for e in slow_log.snapshot() if "twitch_chat_messages" in e["statement"]]
+    assert entries
+    entry = entries[0]
+    assert entry["parameters"] == ["7", "5"]
+    assert entry["database"].endswith("sql_app.db")
+    assert any("ix_twitch_chat_stream_timestamp" in line for line in entry["plan"])
+
+
+def test_threshold_sampling_and_size(file_db, slow_log):
+    slow_log.configure(threshold_ms=0, sample_rate=0)
+    file_db.execute(text("SELECT 1"))
+    assert slow_log.snapshot() == []
+
+    slow_log.configure(sample_rate=1, size=3)
+    for i in range(5):
+        file_db.execute(text("SELECT :i"), {"i": i})
+    assert len(slow_log.snapshot()) == 3
+
+    slow_log.configure(threshold_ms=60_000)
+    slow_log.clear()
+    file_db.execute(text("SELECT 1"))
+    assert slow_log.snapshot() == []
+
+
+def test_keeps_the_slowest_statements(slow_log, monkeypatch):
+    class Engine:
+        class url:
+            database = "sql_app.db"
+
+    class Conn:
+        engine = Engine
+        info = {}
+
+    slow_log.configure(threshold_ms=0, sample_rate=1, size=2)
+    for i, seconds in enumerate((0.5, 0.001, 0.002, 0.003, 0.004)):
+        Conn.info["query_started"] = 0
+        monkeypatch.setattr(query_log.time, "perf_counter", lambda: seconds)
+        slow_log._after_execute(Conn, None, f"SELECT {i}", (), None, True)
+    monkeypatch.undo()
+
+    # the outlier survives the burst of faster ones that came after it
+    assert [e["statement"] for e in slow_log.snapshot()] == ["SELECT 0", "SELECT 4"]
+
+    slow_log.configure(size=1)
+    assert [e["statement"] for e in slow_log.snapshot()] == ["SELECT 0"]
+
+
+def test_slow_query_endpoints(file_db, file_client, slow_log):
+    response = file_client.patch("/debug/slow-queries", json={"threshold_ms": 0})
+    assert response.status_code == 200
+    assert response.json()["threshold_ms"] == 0
+
+    file_client.get("/streams/")
+    queries = file_client.get("/debug/slow-queries").json()["queries"]
+    assert any("FROM streams" in q["statement"] for q in queries)
+    durations = [q["duration_ms"] for q in queries]
+    assert durations == sorted(durations, reverse=True)
+
+    assert file_client.patch("/debug/slow-queries", json={"sample_rate": 2}).status_code == 400
+    assert file_client.delete("/debug/slow-queries").status_code == 200
+    file_client.patch("/debug/slow-queries", json={"threshold_ms": 60_000})
+    assert file_client.get("/debug/slow-queries").json()["queries"] == []
@@ -0,0 +1,135 @@
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+import database
+from main import app
+from models import revenue
+from models.dicts import PlatformType
+from models.schema import Stream, StreamRevenue, TwitchChatMessage, YouTubeChatMessage
+from models.stream_purge import purge_stream
+from models.tw_data_handler import TwitchDataHandler
+from models.yt_data_handler import YouTubeDataHandler
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+
+
+def _load(name):
+    with open(os.path.join(DATA_DIR, name)) as f:
+        return json.load(f)
+
+
+def _stream(db, platform, messages, batch=None):
+    stream = Stream(url=f"https://example.com/{platform.value}", platform=platform.value, download_status="completed")
+    db.add(stream)
+    db.commit()
+    stream_id = stream.id
+    handler_class = TwitchDataHandler if platform == PlatformType.TWITCH else YouTubeDataHandler
+    handler = handler_class(db, message_db=database.open_message_db(stream_id))
+    for i, message in enumerate(messages):
+        handler.save_message(message, stream_id)
+        if batch and i % batch == 0:
+            handler.flush_batch()
+    handler.close()
+    db.expunge_all()
+    return stream_id
+
+
+def _totals(db, stream_id):
+    return sorted(
+        (row.currency, row.tier, row.count, row.prime_count, row.amount, row.first_timestamp, row.last_timestamp)
+        for row in db.query(StreamRevenue).filter(StreamRevenue.stream_id == stream_id)
+        if row.count
+    )
+
+
+def test_plans_and_money_are_parsed():
+    assert revenue.sub_plan({"message_type": "resubscription", "subscription_type": "Prime"}) == (1, True)
+    assert revenue.sub_plan({"message_type": "subscription", "subscription_plan": "3000"}) == (3, False)
+    assert revenue.sub_plan({"message_type": "mystery_subscription_gift", "subscription_type": "Tier 1"}) == (None, None)
+    assert revenue.sub_plan({"message_type": "standard_pay_forward"}) == (None, None)
+    assert revenue.money_value({"amount": 1.99, "currency": "USD"}) == (199, "USD")
+    assert revenue.money_value({"amount": 500, "currency": "JPY"}) == (50000, "JPY")
+    assert revenue.money_value({"text": "$5.00"}) == (None, None)
+    assert revenue.money_value(None) == (None, None)
+
+
+@pytest.mark.parametrize("storage", ["file_db", "sharded_db"])
+def test_youtube_paid_messages_are_summed_up(request, storage):
+    db = request.getfixturevalue(storage)
+    stream_id = _stream(db, PlatformType.YOUTUBE, _load("yt_superchats.json"), batch=3)
+
+    with database.message_session(stream_id, db) as message_db:
+        paid = message_db.execute(
+            select(YouTubeChatMessage.money_amount, YouTubeChatMessage.money_currency)
+            .where(YouTubeChatMessage.money_currency.is_not(None))
+            .order_by(YouTubeChatMessage.id)
+        ).all()
+    assert paid == [(500, "USD"), (199, "USD")]
+
+    totals = _totals(db, stream_id)
+    assert [row[:5] for row in totals] == [("", 0, 18, 0, 0), ("USD", 0, 2, 0, 699)]
+
+    # the incrementally kept totals are what a rebuild from the rows gives
+    with database.message_session(stream_id, db) as message_db:
+        revenue.rebuild_revenue(db, message_db, stream_id, PlatformType.YOUTUBE.value)
+    assert _totals(db, stream_id) == totals
+
+
+@pytest.mark.parametrize("storage", ["file_db", "sharded_db"])
+def test_twitch_subs_are_summed_up_by_tier(request, storage):
+    db = request.getfixturevalue(storage)
+    stream_id = _stream(db, PlatformType.TWITCH, _load("tw_subscriptions.json"), batch=2)
+
+    with database.message_session(stream_id, db) as message_db:
+        tiers = message_db.execute(
+            select(TwitchChatMessage.sub_tier, TwitchChatMessage.sub_prime).order_by(TwitchChatMessage.id)
+        ).all()
+    assert tiers == [(1, True)] * 2 + [(None, None)] + [(1, False)] * 7
+
+    totals = _totals(db, stream_id)
+    assert [row[:5] for row in totals] == [("", 1, 9, 2, 0)]
+
+    with database.message_session(stream_id, db) as message_db:
+        revenue.rebuild_revenue(db, message_db, stream_id, PlatformType.TWITCH.value)
+    assert _totals(db, stream_id) == totals
+
+
+def test_streams_without_totals_are_summed_up_once(file_db):
+    stream_id = _stream(file_db, PlatformType.YOUTUBE, _load("yt_superchats.json"))
+    quiet_id = _stream(
+        file_db,
+        PlatformType.TWITCH,
+        [{"message_type": "text_message", "message_id": "m", "timestamp": 1, "message": "hi", "author": {"id": "1", "name": "a"}}],
+    )
+    expected = _totals(file_db, stream_id)
+    file_db.query(StreamRevenue).delete()
+    file_db.commit()
+
+    revenue.index_missing_revenue(file_db)
+
+    assert _totals(file_db, stream_id) == expected
+    # a stream without revenue keeps an empty row, so it is not read again
+    assert _totals(file_db, quiet_id) == []
+    assert file_db.query(StreamRevenue).filter(StreamRevenue.stream_id == quiet_id).count() == 1
+
+
+def test_revenue_endpoint_and_purge(file_db):
+    stream_id = _stream(file_db, PlatformType.YOUTUBE, _load("yt_superchats.json"))
+    client = TestClient(app)
+
+    response = client.get(f"/streams/{stream_id}/revenue")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [(p["currency"], p["count"], p["amount"]) for p in body["paid_messages"]] == [("USD", 2, 6.99)]
+    assert [(s["tier"], s["count"]) for s in body["subscriptions"]] == [(0, 18)]
+    messages = client.get(f"/streams/{stream_id}/messages", params={"messageGroupIds": "3"}).json()["messages"]
+    assert sorted(m["amount"] for m in messages if m["amount"]) == [1.99, 5.0]
+    assert client.get("/streams/999/revenue").status_code == 404
+
+    purge_stream(file_db, stream_id, pause=0)
+    assert file_db.query(StreamRevenue).count() == 0
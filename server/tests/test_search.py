@@ -0,0 +1,154 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+import database
+from main import app
+from models import search
+from models.dicts import PlatformType
+from models.schema import AuthorStream, Stream
+from models.stream_purge import purge_stream
+from models.tw_data_handler import TwitchDataHandler
+from models.yt_data_handler import YouTubeDataHandler
+
+START_US = 1_735_725_600_000_000
+
+
+def _message(author, text, i):
+    return {
+        "message_type": "text_message",
+        "message_id": f"{author}-{i}",
+        "timestamp": START_US + i * 1_000_000,
+        "message": text,
+        "author": {"id": f"id-{author}", "name": author, "display_name": author.title()},
+    }
+
+
+def _stream(db, platform, messages):
+    stream = Stream(url=f"https://example.com/{platform.value}", platform=platform.value, download_status="completed")
+    db.add(stream)
+    db.commit()
+    stream_id = stream.id
+    handler_class = TwitchDataHandler if platform == PlatformType.TWITCH else YouTubeDataHandler
+    handler = handler_class(db, message_db=database.open_message_db(stream_id))
+    for i, (author, text) in enumerate(messages):
+        handler.save_message(_message(author, text, i), stream_id)
+    handler.close()
+    db.expunge_all()
+    return stream_id
+
+
+@pytest.fixture(params=["file_db", "sharded_db"])
+def streams(request):
+    db = request.getfixturevalue(request.param)
+    ids = [
+        _stream(db, PlatformType.TWITCH, [("alice", "hello world"), ("bob", "Héllo there"), ("alice", "bye")]),
+        _stream(db, PlatformType.YOUTUBE, [("bob", "nothing to see"), ("carol", "hello again")]),
+        _stream(db, PlatformType.TWITCH, [("alice", "still here"), ("alice", "hello hello")]),
+    ]
+    return db, ids
+
+
+def _summary(results):
+    return [(stream.id, count, [m.message for m in messages]) for stream, count, messages in results]
+
+
+def test_search_by_author_groups_per_stream(streams):
+    db, (first, second, third) = streams
+
+    results, next_before = search.search(db, author="ALICE", per_stream=1)
+
+    # newest stream first, newest message of each
+    assert _summary(results) == [(third, 2, ["hello hello"]), (first, 2, ["bye"])]
+    assert next_before is None
+    assert _summary(search.search(db, author="id-bob")[0]) == [
+        (second, 1, ["nothing to see"]),
+        (first, 1, ["Héllo there"]),
+    ]
+
+
+def test_search_by_text_and_author(streams):
+    db, (first, second, third) = streams
+
+    results, _ = search.search(db, text="hello")
+    assert [(stream_id, count) for stream_id, count, _ in _summary(results)] == [
+        (third, 1),
+        (second, 1),
+        (first, 2),
+    ]
+
+    results, _ = search.search(db, author="alice", text="hello", platform=PlatformType.TWITCH.value)
+    assert _summary(results) == [(third, 1, ["hello hello"]), (first, 1, ["hello world"])]
+    assert search.search(db, author="carol", text="bye")[0] == []
+
+
+def test_search_pages_by_cursor(streams):
+    db, (first, second, third) = streams
+    pages = []
+    before = None
+    while True:
+        results, before = search.search(db, text="hello", before=before, limit=1)
+        pages.extend(stream.id for stream, _, _ in results)
+        if before is None:
+            break
+
+    assert pages == [third, second, first]
+
+
+def test_search_stops_at_the_scan_limit(streams, monkeypatch):
+    db, (first, second, third) = streams
+    monkeypatch.setattr(search, "SEARCH_SCAN_STREAMS", 1)
+
+    results, before = search.search(db, author="bob")
+
+    # one stream looked at, the rest is left to the next page
+    assert _summary(results) == [(second, 1, ["nothing to see"])]
+    assert before == second
+    results, before = search.search(db, author="bob", before=before)
+    assert _summary(results) == [(first, 1, ["Héllo there"])]
+    assert search.search(db, author="bob", before=before) == ([], None)
+
+
+def test_rejects_searches_without_words():
+    with pytest.raises(ValueError):
+        search.search(None, text="!!")
+    with pytest.raises(ValueError):
+        search.search(None)
+
+
+def test_missing_author_index_is_rebuilt(streams):
+    db, (first, second, third) = streams
+    expected = db.execute(select(AuthorStream).order_by(AuthorStream.stream_id)).scalars().all()
+    expected = [(a.stream_id, a.author_id, a.name, a.message_count) for a in expected]
+    db.query(AuthorStream).filter(AuthorStream.stream_id == first).delete()
+    db.commit()
+
+    search.index_missing_authors(db)
+
+    rebuilt = db.execute(select(AuthorStream).order_by(AuthorStream.stream_id)).scalars().all()
+    assert sorted((a.stream_id, a.author_id, a.name, a.message_count) for a in rebuilt) == sorted(expected)
+
+
+def test_purge_drops_the_author_index(streams):
+    db, (first, second, third) = streams
+
+    purge_stream(db, first, pause=0)
+
+    assert db.query(AuthorStream).filter(AuthorStream.stream_id == first).count() == 0
+    assert [stream.id for stream, _, _ in search.search(db, author="alice")[0]] == [third]
+
+
+def test_search_endpoint(file_db):
+    stream_id = _stream(file_db, PlatformType.TWITCH, [("alice", "hello world")])
+    client = TestClient(app)
+
+    response = client.get("/search", params={"author": "alice"})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["next_cursor"] is None
+    [result] = body["results"]
+    assert (result["stream"]["id"], result["count"]) == (stream_id, 1)
+    assert result["messages"][0]["author"]["name"] == "Alice"
+    assert client.get("/search").status_code == 400
+    assert client.get("/search", params={"q": "hi", "cursor": "x"}).status_code == 400
@@ -0,0 +1,65 @@
+import gc
+import os
+
+import pytest
+
+from models.flush_policy import AdaptiveFlushPolicy
+from models.schema import Stream
+from models.tw_data_handler import TwitchDataHandler
+
+# opt-in: SOAK_MESSAGES=20000000 python -m pytest tests/test_soak.py -s
+SOAK_MESSAGES = int(os.environ.get("SOAK_MESSAGES", "0"))
+SOAK_RSS_MB = float(os.environ.get("SOAK_RSS_MB", "64"))
+AUTHORS = 200_000
+START_US = 1_735_725_600_000_000
+
+
+# resident minus file-backed pages: the mmap'd database file is page cache,
+# not memory the process holds on to
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        fields = f.read().split()
+    pages = int(fields[1]) - int(fields[2])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+@pytest.mark.skipif(not SOAK_MESSAGES, reason="set SOAK_MESSAGES to run")
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="needs /proc")
+def test_download_memory_stays_flat(file_db):
+    stream = Stream(url="https://www.twitch.tv/videos/1", platform=1, download_status="downloading")
+    file_db.add(stream)
+    file_db.commit()
+    stream_id = stream.id
+    file_db.expunge_all()
+
+    handler = TwitchDataHandler(file_db, policy=AdaptiveFlushPolicy(max_batch=2000))
+    # sqlite's page cache and the author cache fill up first, both are bounded
+    warmup = max(SOAK_MESSAGES // 5, 100_000)
+    checkpoint = max(SOAK_MESSAGES // 10, 1)
+    baseline = None
+    samples = []
+    author = {"id": "", "name": ""}
+    message = {"message_type": "text_message", "author": author}
+
+    for i in range(SOAK_MESSAGES):
+        n = (i * 7919) % AUTHORS
+        author["id"] = str(n)
+        author["name"] = f"chatter_{n}"
+        message["message_id"] = str(i)
+        message["timestamp"] = START_US + i * 1_000
+        message["message"] = f"soak message {i % 1000}"
+        handler.track_timestamp(stream_id, message["timestamp"])
+        handler.save_message(message, stream_id)
+
+        if i + 1 == warmup:
+            gc.collect()
+            baseline = _rss_mb()
+        elif baseline is not None and (i + 1) % checkpoint == 0:
+            gc.collect()
+            samples.append(_rss_mb())
+            print(f"{i + 1} messages: {samples[-1]:.1f} MB (baseline {baseline:.1f} MB)")
+
+    handler.close()
+
+    assert file_db.get(Stream, stream_id).message_count == SOAK_MESSAGES
+    assert max(samples, default=baseline) - baseline < SOAK_RSS_MB
@@ -0,0 +1,208 @@
+import os
+import threading
+
+from sqlalchemy import func, select
+
+from models import spool
+from models.schema import Stream, TwitchChatMessage
+from models.tw_data_handler import TwitchDataHandler
+import database
+
+
+def _message(i):
+    return {
+        "message_id": f"spool-{i}",
+        "message_type": "text_message",
+        "timestamp": 1_750_000_000_000_000 + i * 1_000_000,
+        "message": f"message {i}",
+        "author": {"id": str(i % 5), "name": f"user{i % 5}"},
+    }
+
+
+def _stream(db):
+    stream = Stream(url="https://www.twitch.tv/videos/7", platform=1, download_status="downloading")
+    db.add(stream)
+    db.commit()
+    stream_id = stream.id
+    db.expunge_all()
+    return stream_id
+
+
+def _message_ids(db, stream_id):
+    return db.execute(
+        select(TwitchChatMessage.message_id)
+        .where(TwitchChatMessage.stream_id == stream_id)
+        .order_by(TwitchChatMessage.timestamp)
+    ).scalars().all()
+
+
+def test_roundtrip_across_segments(tmp_path):
+    writer = spool.SpoolWriter(str(tmp_path), segment_bytes=300)
+    for i in range(20):
+        writer.append(_message(i))
+
+    reader = spool.SpoolReader(str(tmp_path))
+    read = list(reader.read())
+    writer.close()
+
+    assert [m["message_id"] for m, _ in read] == [f"spool-{i}" for i in range(20)]
+    assert len(spool.list_segments(str(tmp_path))) > 3
+    # positions only move forward, and a reader resumes right after one
+    positions = [position for _, position in read]
+    assert positions == sorted(positions)
+    resumed = spool.SpoolReader(str(tmp_path), positions[9])
+    assert [m["message_id"] for m, _ in resumed.read()] == [f"spool-{i}" for i in range(10, 20)]
+
+
+def test_remove_consumed_keeps_the_checkpoint_segment(tmp_path):
+    writer = spool.SpoolWriter(str(tmp_path), segment_bytes=300)
+    for i in range(20):
+        writer.append(_message(i))
+    writer.close()
+    read = list(spool.SpoolReader(str(tmp_path)).read())
+
+    checkpoint = read[12][1]
+    spool.remove_consumed(str(tmp_path), checkpoint)
+
+    assert spool.list_segments(str(tmp_path))[0] == checkpoint[0]
+    rest = spool.SpoolReader(str(tmp_path), checkpoint)
+    assert [m["message_id"] for m, _ in rest.read()] == [f"spool-{i}" for i in range(13, 20)]
+
+
+def test_new_writer_never_reuses_a_segment(tmp_path):
+    writer = spool.SpoolWriter(str(tmp_path))
+    writer.append(_message(0))
+    writer.close()
+
+    assert spool.SpoolWriter(str(tmp_path)).segment == 1
+    assert spool.SpoolWriter(str(tmp_path / "other"), first_segment=5).segment == 5
+
+
+def test_torn_tail_is_not_read_until_complete(tmp_path):
+    writer = spool.SpoolWriter(str(tmp_path))
+    writer.append(_message(0))
+    writer.close()
+    path = spool.segment_path(str(tmp_path), 0)
+    with open(path, "rb") as f:
+        record = f.read()
+
+    # half of a second record, as a crash mid-write leaves it
+    with open(path, "ab") as f:
+        f.write(record[: len(record) // 2])
+    reader = spool.SpoolReader(str(tmp_path))
+    assert [m["message_id"] for m, _ in reader.read()] == ["spool-0"]
+
+    with open(path, "ab") as f:
+        f.write(record[len(record) // 2:])
+    assert [m["message_id"] for m, _ in reader.read()] == ["spool-0"]
+
+
+def test_corrupt_record_skips_the_rest_of_the_segment(tmp_path):
+    writer = spool.SpoolWriter(str(tmp_path), segment_bytes=300)
+    for i in range(10):
+        writer.append(_message(i))
+    writer.close()
+    first = spool.segment_path(str(tmp_path), 0)
+    with open(first, "r+b") as f:
+        f.seek(spool.HEADER.size + 5)
+        f.write(b"X")
+
+    ids = [m["message_id"] for m, _ in spool.SpoolReader(str(tmp_path)).read()]
+
+    assert "spool-0" not in ids
+    assert ids == sorted(ids, key=lambda i: int(i.split("-")[1]))
+    assert ids[-1] == "spool-9"
+
+
+def test_drain_reads_nothing_while_the_batch_is_full(file_db, monkeypatch):
+    stream_id = _stream(file_db)
+    directory = spool.stream_directory(database.spool_dir, stream_id)
+    writer = spool.SpoolWriter(directory)
+    for i in range(5):
+        writer.append(_message(i))
+    writer.close()
+    monkeypatch.setattr(spool, "SPOOL_MAX_PENDING", 3)
+    handler = TwitchDataHandler(file_db)
+    reader = spool.SpoolReader(directory)
+
+    assert not spool.drain(handler, reader, stream_id)
+    assert len(handler.message_batch) == 3
+    position = (reader.segment, reader.offset)
+    # a full batch is not added to, and the reader does not move
+    assert not spool.drain(handler, reader, stream_id)
+    assert (reader.segment, reader.offset) == position
+    assert len(handler.message_batch) == 3
+
+    handler.flush_batch()
+    assert spool.drain(handler, reader, stream_id)
+    assert _message_ids(file_db, stream_id) == [f"spool-{i}" for i in range(3)]
+    assert len(handler.message_batch) == 2
+    handler.close()
+
+
+def test_consumer_commits_everything_and_checkpoints(file_db):
+    stream_id = _stream(file_db)
+    directory = spool.stream_directory(database.spool_dir, stream_id)
+    writer = spool.SpoolWriter(directory, segment_bytes=2000)
+    handler = TwitchDataHandler(file_db)
+    consumer = threading.Thread(
+        target=spool.consume,
+        args=(handler, spool.SpoolReader(directory), writer, stream_id),
+    )
+    consumer.start()
+    for i in range(300):
+        writer.append(_message(i))
+    writer.close()
+    consumer.join()
+
+    stream = file_db.get(Stream, stream_id)
+    assert stream.message_count == 300
+    assert _message_ids(file_db, stream_id) == [f"spool-{i}" for i in range(300)]
+    # committed segments were truncated as the consumer went
+    assert spool.list_segments(directory) == [stream.spool_segment]
+    assert (stream.spool_segment, stream.spool_offset) == handler.spool_checkpoint[stream_id]
+    assert list(spool.SpoolReader(directory, handler.spool_checkpoint[stream_id]).read()) == []
+    handler.close()
+
+
+def test_replay_after_crash_loses_and_repeats_nothing(file_db):
+    import main
+
+    stream_id = _stream(file_db)
+    directory = spool.stream_directory(database.spool_dir, stream_id)
+    writer = spool.SpoolWriter(directory)
+    for i in range(50):
+        writer.append(_message(i))
+
+    # the consumer committed 20, queued 10 more, and then the process died
+    handler = TwitchDataHandler(file_db)
+    reader = spool.SpoolReader(directory)
+    for n, (message, position) in enumerate(reader.read()):
+        if n == 30:
+            break
+        handler.track_spool_position(stream_id, position)
+        handler.save_message(message, stream_id)
+        if n == 19:
+            handler.flush_batch()
+    handler.message_batch.clear()
+    file_db.expunge_all()
+
+    main.replay_spools(file_db)
+
+    file_db.expire_all()
+    assert _message_ids(file_db, stream_id) == [f"spool-{i}" for i in range(50)]
+    assert file_db.get(Stream, stream_id).message_count == 50
+    assert not os.path.exists(directory)
+
+
+def test_replay_drops_spools_of_deleted_streams(file_db):
+    import main
+
+    directory = spool.stream_directory(database.spool_dir, 999)
+    writer = spool.SpoolWriter(directory)
+    writer.append(_message(0))
+    writer.close()
+
+    main.replay_spools(file_db)
+
+    assert not os.path.exists(directory)
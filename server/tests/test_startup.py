@@ -0,0 +1,71 @@
+import os
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+import main
+import startup
+from benchmarks import bench_startup
+
+# opt-in, spawns a real server: STARTUP_BENCHMARK=1 python -m pytest tests/test_startup.py
+STARTUP_BENCHMARK = os.environ.get("STARTUP_BENCHMARK") == "1"
+
+
+@pytest.fixture
+def app_db(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'sql_app.db'}")
+    monkeypatch.setattr(startup, "state", startup.Startup())
+    yield
+    database.close_db()
+
+
+def test_health_answers_before_maintenance_is_done(app_db, monkeypatch):
+    release = threading.Event()
+    replay_spools = main.replay_spools
+    monkeypatch.setattr(main, "replay_spools", lambda db: release.wait(10) and replay_spools(db))
+
+    with TestClient(main.app) as client:
+        health = client.get("/health")
+        assert health.status_code == 200
+        assert health.json()["status"] == "starting"
+
+        responses = []
+        waiting = threading.Thread(target=lambda: responses.append(client.get("/streams/")))
+        waiting.start()
+        waiting.join(0.3)
+        # requests that need the database wait for the startup steps
+        assert waiting.is_alive()
+
+        release.set()
+        waiting.join(10)
+        assert responses[0].status_code == 200
+        health = client.get("/health").json()
+        assert health["status"] == "ok"
+        assert list(health["startup"])[:2] == ["database", "merge_interrupted_downloads"]
+
+
+def test_failed_startup_is_reported(app_db, monkeypatch):
+    def fail(db):
+        raise RuntimeError("disk gone")
+
+    monkeypatch.setattr(main, "cleanup_running_streams", fail)
+
+    with TestClient(main.app) as client:
+        assert client.get("/streams/").status_code == 503
+        health = client.get("/health")
+        assert health.status_code == 503
+        assert health.json()["status"] == "error"
+
+
+@pytest.mark.skipif(not STARTUP_BENCHMARK, reason="set STARTUP_BENCHMARK=1 to run")
+def test_startup_benchmark(tmp_path):
+    # the tracked numbers, with budgets far above what a healthy build takes
+    seconds, loaded = bench_startup.import_time(str(tmp_path / "import.db"))
+    times = bench_startup.serve_times(str(tmp_path / "sql_app.db"))
+
+    assert not loaded
+    assert seconds < 10
+    assert times["healthy"] <= times["ready"] < 30
+    assert "database" in times["steps"]
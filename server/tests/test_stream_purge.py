@@ -0,0 +1,141 @@
+from datetime import datetime
+import os
+
+import pytest
+from sqlalchemy import text
+
+import database
+
+from models.schema import ChatAuthor, Stream, TwitchChatMessage, YouTubeChatMessage
+from models.dicts import PlatformType, MessageGroup, DownloadStatus
+from models.timestamps import to_micros
+from models import stream_purge
+from models.stream_purge import purge_stream
+from models.tw_data_handler import TwitchDataHandler
+
+
+def _add_stream(db_session, platform, count):
+    stream = Stream(
+        url=f"https://example/{platform}/{count}",
+        platform=platform.value,
+        download_status=DownloadStatus.DELETING.value,
+    )
+    db_session.add(stream)
+    db_session.commit()
+
+    model_class = (
+        TwitchChatMessage if platform == PlatformType.TWITCH else YouTubeChatMessage
+    )
+    db_session.add_all(
+        [
+            model_class(
+                stream_id=stream.id,
+                author=ChatAuthor(platform=platform.value, name=f"user{stream.id}-{i}"),
+                message=f"message {i}",
+                message_group_id=MessageGroup.messages.value,
+                timestamp=to_micros(datetime(2025, 1, 1, 12, 0, i % 60)),
+            )
+            for i in range(count)
+        ]
+    )
+    db_session.commit()
+    return stream
+
+
+def test_purge_stream_in_batches(db_session):
+    doomed = _add_stream(db_session, PlatformType.TWITCH, 25)
+    kept = _add_stream(db_session, PlatformType.TWITCH, 5)
+    doomed_id = doomed.id
+
+    deleted = purge_stream(db_session, doomed_id, batch_size=4, pause=0)
+
+    assert deleted == 25
+    assert db_session.query(Stream).filter(Stream.id == doomed_id).first() is None
+    assert (
+        db_session.query(TwitchChatMessage)
+        .filter(TwitchChatMessage.stream_id == doomed_id)
+        .count()
+        == 0
+    )
+    assert (
+        db_session.query(TwitchChatMessage)
+        .filter(TwitchChatMessage.stream_id == kept.id)
+        .count()
+        == 5
+    )
+
+
+def test_flush_skips_streams_being_deleted(db_session):
+    stream = _add_stream(db_session, PlatformType.TWITCH, 0)
+    handler = TwitchDataHandler(db_session)
+
+    handler.save_message(
+        {
+            "message_type": "text_message",
+            "message_id": "late",
+            "timestamp": 1_700_000_000_000_000,
+            "author": {"name": "late_user"},
+            "message": "arrived after delete",
+        },
+        stream_id=stream.id,
+    )
+    handler.flush_batch()
+
+    assert (
+        db_session.query(TwitchChatMessage)
+        .filter(TwitchChatMessage.stream_id == stream.id)
+        .count()
+        == 0
+    )
+
+
+def test_incremental_vacuum_is_bounded(file_db, monkeypatch):
+    stream = _add_stream(file_db, PlatformType.TWITCH, 2000)
+    file_db.query(TwitchChatMessage).filter(TwitchChatMessage.stream_id == stream.id).delete()
+    file_db.commit()
+    free = file_db.execute(text("PRAGMA freelist_count")).scalar()
+    assert free > 10
+    steps = []
+    run_write = stream_purge.run_write
+    monkeypatch.setattr(
+        stream_purge, "run_write", lambda db, op, owner: steps.append(owner) or run_write(db, op, owner)
+    )
+
+    assert stream_purge.incremental_vacuum(file_db, pages_per_step=10, pause=0, max_seconds=0) == 0
+    assert stream_purge.incremental_vacuum(file_db, pages_per_step=10, pause=0) == free
+
+    assert file_db.execute(text("PRAGMA freelist_count")).scalar() == 0
+    # every step frees as many pages as it was given
+    assert len(steps) == -(-free // 10)
+
+
+@pytest.mark.parametrize("storage", ["file_db", "sharded_db"])
+def test_flush_after_the_purge_writes_nothing(request, storage):
+    db = request.getfixturevalue(storage)
+    stream = Stream(url="https://www.twitch.tv/videos/1", platform=PlatformType.TWITCH.value)
+    db.add(stream)
+    db.commit()
+    stream_id = stream.id
+    handler = TwitchDataHandler(db, message_db=database.open_message_db(stream_id))
+    handler.save_message(
+        {
+            "message_type": "text_message",
+            "message_id": "pending",
+            "timestamp": 1_700_000_000_000_000,
+            "author": {"name": "late_user"},
+            "message": "still queued when the purge ran",
+        },
+        stream_id=stream_id,
+    )
+
+    # the download has not stopped yet when its stream is purged
+    purge_stream(db, stream_id, pause=0)
+    handler.flush_batch()
+
+    assert not handler.message_batch
+    if database.is_sharded():
+        handler.close()
+        assert not os.path.exists(database.shards.path(stream_id))
+    else:
+        assert db.query(TwitchChatMessage).filter(TwitchChatMessage.stream_id == stream_id).count() == 0
+        handler.close()
@@ -0,0 +1,124 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+from main import app
+from models import timeline
+from models.dicts import MessageGroup, PlatformType
+from models.schema import Stream
+from models.tw_data_handler import TwitchDataHandler
+from models.yt_data_handler import YouTubeDataHandler
+
+START_US = 1_735_725_600_000_000
+
+
+def _stream(db, platform, timestamps):
+    stream = Stream(url=f"https://example.com/{platform.value}", platform=platform.value, download_status="completed")
+    db.add(stream)
+    db.commit()
+    stream_id = stream.id
+    handler_class = TwitchDataHandler if platform == PlatformType.TWITCH else YouTubeDataHandler
+    handler = handler_class(db, message_db=database.open_message_db(stream_id))
+    for i, timestamp in enumerate(timestamps):
+        handler.save_message(
+            {
+                "message_type": "text_message",
+                "message_id": f"{stream_id}-{i}",
+                "timestamp": START_US + timestamp,
+                "message": f"{stream_id}:{i}",
+                "author": {"id": "1", "name": "someone"},
+            },
+            stream_id,
+        )
+    handler.close()
+    db.expunge_all()
+    return stream_id
+
+
+@pytest.fixture(params=["file_db", "sharded_db"])
+def streams(request):
+    db = request.getfixturevalue(request.param)
+    # ties within and across streams, and one stream that ends early
+    ids = [
+        _stream(db, PlatformType.TWITCH, [0, 5, 5, 10, 20, 30, 40]),
+        _stream(db, PlatformType.YOUTUBE, [5, 10, 10, 15]),
+        _stream(db, PlatformType.TWITCH, [1, 5, 25, 26, 27, 28, 29, 50]),
+    ]
+    return db, [db.get(Stream, stream_id) for stream_id in ids]
+
+
+def _expected(db, streams):
+    rows = []
+    for stream in streams:
+        with database.message_session(stream.id, db) as message_db:
+            rows.extend(
+                (position, row.message)
+                for position, row in timeline.stream_messages(message_db, stream, [])
+            )
+    return [message for _, message in sorted(rows)]
+
+
+@pytest.mark.parametrize("limit,fetch_rows", [(3, 1), (4, 2), (100, 200)])
+def test_pages_follow_the_merged_order(streams, monkeypatch, limit, fetch_rows):
+    db, stream_list = streams
+    monkeypatch.setattr(timeline, "TIMELINE_FETCH_ROWS", fetch_rows)
+    seen = []
+    after = None
+    while True:
+        page, after = timeline.merged_messages(db, stream_list, [], limit, after)
+        assert len(page) <= limit
+        seen.extend(row.message for _, row in page)
+        if after is None:
+            break
+
+    assert seen == _expected(db, stream_list)
+    assert len(seen) == 19
+
+
+def test_filters_apply_to_every_stream(streams):
+    db, stream_list = streams
+
+    page, after = timeline.merged_messages(
+        db, stream_list, [MessageGroup.bans.value], 10
+    )
+    assert (page, after) == ([], None)
+
+    page, _ = timeline.merged_messages(db, stream_list[1:2], [], 2)
+    assert [(stream.id, row.message) for stream, row in page] == [
+        (stream_list[1].id, f"{stream_list[1].id}:0"),
+        (stream_list[1].id, f"{stream_list[1].id}:1"),
+    ]
+
+
+def test_timeline_endpoint(file_db):
+    twitch = _stream(file_db, PlatformType.TWITCH, [0, 2])
+    youtube = _stream(file_db, PlatformType.YOUTUBE, [1])
+    client = TestClient(app)
+
+    response = client.get("/timeline", params={"streamIds": f"{twitch},{youtube}", "limit": 2})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [(m["streamId"], m["platform"]) for m in body["messages"]] == [(twitch, 1), (youtube, 2)]
+    response = client.get(
+        "/timeline", params={"streamIds": f"{twitch},{youtube}", "cursor": body["next_cursor"]}
+    )
+    assert [m["message"] for m in response.json()["messages"]] == [f"{twitch}:1"]
+    assert response.json()["next_cursor"] is None
+    assert client.get("/timeline", params={"streamIds": f"{twitch},999"}).status_code == 404
+    assert client.get("/timeline", params={"streamIds": "a"}).status_code == 400
+    response = client.get("/timeline", params={"streamIds": f"{twitch}", "messageGroupIds": "x"})
+    assert response.status_code == 400
+
+
+def test_timeline_rejects_too_many_streams(file_db, monkeypatch):
+    twitch = _stream(file_db, PlatformType.TWITCH, [0])
+    youtube = _stream(file_db, PlatformType.YOUTUBE, [1])
+    monkeypatch.setattr(timeline, "TIMELINE_MAX_STREAMS", 1)
+    client = TestClient(app)
+
+    response = client.get("/timeline", params={"streamIds": f"{twitch},{youtube}"})
+
+    assert response.status_code == 400
+    # repeated ids count once
+    assert client.get("/timeline", params={"streamIds": f"{twitch},{twitch}"}).status_code == 200
@@ -2,7 +2,8 @@ import pytest
 import json
 import os
 from models.tw_data_handler import TwitchDataHandler
-from models.schema import TwitchChatMessage
+from models.schema import Stream, TwitchChatMessage, TwitchChatMessageStaging
+from sqlalchemy import func, select
 
 TW_MESSAGES_PATH = os.path.join(
     os.path.dirname(__file__), "..", "data", "tw_messages.json"
@@ -22,8 +23,15 @@ with open(TW_SUBS_PATH) as f:
     TW_SUBS_DATA = json.load(f)
 
 
+@pytest.fixture
+def stream(db_session):
+    # flushes only write rows for streams in the catalog
+    db_session.add(Stream(id=1, url="https://www.twitch.tv/videos/1", platform=1))
+    db_session.commit()
+
+
 @pytest.mark.parametrize("message_data", TW_MESSAGES_DATA)
-def test_save_twitch_message(db_session, message_data):
+def test_save_twitch_message(db_session, stream, message_data):
     handler = TwitchDataHandler(db_session)
 
     success = handler.save_message(message_data, stream_id=1)
@@ -42,7 +50,7 @@ def test_save_twitch_message(db_session, message_data):
 
 
 @pytest.mark.parametrize("ban_data", TW_BANS_DATA)
-def test_save_twitch_bans(db_session, ban_data):
+def test_save_twitch_bans(db_session, stream, ban_data):
     handler = TwitchDataHandler(db_session)
 
     success = handler.save_message(ban_data, stream_id=1)
@@ -60,7 +68,7 @@ def test_save_twitch_bans(db_session, ban_data):
 
 
 @pytest.mark.parametrize("sub_data", TW_SUBS_DATA)
-def test_save_twitch_subscription(db_session, sub_data):
+def test_save_twitch_subscription(db_session, stream, sub_data):
     handler = TwitchDataHandler(db_session)
 
     success = handler.save_message(sub_data, stream_id=1)
@@ -75,3 +83,51 @@ def test_save_twitch_subscription(db_session, sub_data):
     )
     assert message_in_db is not None
     assert message_in_db.system_message is not None
+
+
+def test_bulk_mode_merges_staged_messages_in_order(db_session, stream):
+    handler = TwitchDataHandler(db_session, bulk=True)
+    messages = sorted(TW_MESSAGES_DATA, key=lambda m: m["timestamp"], reverse=True)
+
+    for message_data in messages:
+        assert handler.save_message(message_data, stream_id=1)
+    handler.flush_batch()
+
+    assert db_session.query(TwitchChatMessage).count() == 0
+    assert (
+        db_session.execute(select(func.count()).select_from(TwitchChatMessageStaging)).scalar()
+        == len(messages)
+    )
+
+    handler.close()
+
+    merged = db_session.query(TwitchChatMessage).order_by(TwitchChatMessage.id).all()
+    assert [m.timestamp for m in merged] == sorted(m["timestamp"] for m in messages)
+    assert merged[0].author_name is not None
+    assert merged[0].created_at is not None
+    assert (
+        db_session.execute(select(func.count()).select_from(TwitchChatMessageStaging)).scalar()
+        == 0
+    )
+
+
+def test_flush_leaves_nothing_in_the_session(file_db):
+    stream = Stream(url="https://www.twitch.tv/videos/7", platform=1, download_status="downloading")
+    file_db.add(stream)
+    file_db.commit()
+    stream_id = stream.id
+    file_db.expunge_all()
+
+    handler = TwitchDataHandler(file_db)
+    for message_data in TW_MESSAGES_DATA:
+        handler.track_timestamp(stream_id, message_data["timestamp"])
+        assert handler.save_message(message_data, stream_id=stream_id)
+    handler.flush_batch()
+
+    assert len(file_db.identity_map) == 0
+    assert not file_db.new and not file_db.dirty
+    handler.recycle_sessions()
+    stream = file_db.get(Stream, stream_id)
+    assert stream.message_count == len(TW_MESSAGES_DATA)
+    assert stream.last_message_timestamp is not None
+    handler.close()
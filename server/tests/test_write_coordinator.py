@@ -0,0 +1,167 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+import database
+from write_coordinator import FairLock, WriteCoordinator, backoff_delay, is_lock_error
+
+
+@pytest.fixture
+def no_wait_engine(tmp_path):
+    path = tmp_path / "writes.db"
+    engine = database._create_sqlite_engine(
+        f"sqlite:///{path}", dict(database.WRITE_ENGINE_DEFAULTS, busy_timeout=0)
+    )
+    with engine.connect() as conn:
+        conn.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY, value INTEGER)"))
+        conn.commit()
+    yield engine, path
+    engine.dispose()
+
+
+def test_is_lock_error_uses_error_codes(no_wait_engine):
+    _, path = no_wait_engine
+    holder = sqlite3.connect(path)
+    other = sqlite3.connect(path, timeout=0)
+    try:
+        holder.execute("BEGIN IMMEDIATE")
+        with pytest.raises(sqlite3.OperationalError) as locked:
+            other.execute("BEGIN IMMEDIATE")
+        with pytest.raises(sqlite3.OperationalError) as missing:
+            other.execute("SELECT * FROM missing_table")
+    finally:
+        holder.rollback()
+        holder.close()
+        other.close()
+
+    assert is_lock_error(OperationalError("BEGIN IMMEDIATE", {}, locked.value))
+    assert not is_lock_error(OperationalError("SELECT", {}, missing.value))
+    assert not is_lock_error(ValueError("database is locked"))
+
+
+def test_backoff_is_bounded_and_grows():
+    for attempt in range(1, 12):
+        delays = [backoff_delay(attempt, 0.05, 2.0) for _ in range(50)]
+        assert all(0 <= d <= min(2.0, 0.05 * 2 ** attempt) for d in delays)
+    assert max(backoff_delay(1, 0.05, 2.0) for _ in range(50)) <= 0.1
+
+
+def test_fair_lock_serves_waiters_in_arrival_order():
+    lock = FairLock()
+    lock.acquire("main")
+    order = []
+
+    def waiter(i):
+        lock.acquire(f"waiter-{i}")
+        order.append(i)
+        lock.release()
+
+    threads = []
+    for i in range(5):
+        thread = threading.Thread(target=waiter, args=(i,))
+        thread.start()
+        threads.append(thread)
+        while lock.queued < i + 2:
+            time.sleep(0.001)
+
+    assert lock.holder == "main"
+    lock.release()
+    for thread in threads:
+        thread.join()
+    assert order == [0, 1, 2, 3, 4]
+    assert lock.holder is None
+
+
+def test_run_retries_while_another_connection_holds_the_lock(no_wait_engine):
+    engine, path = no_wait_engine
+    session = sessionmaker(bind=engine)()
+    coordinator = WriteCoordinator("test", base_delay=0.01, max_delay=0.05, max_retries=50)
+
+    holder = sqlite3.connect(path, check_same_thread=False)
+    holder.execute("BEGIN IMMEDIATE")
+    release = threading.Timer(0.2, holder.rollback)
+    release.start()
+    try:
+        coordinator.run(
+            session,
+            lambda: session.execute(text("INSERT INTO items (value) VALUES (1)")),
+            "test",
+        )
+    finally:
+        release.join()
+        holder.close()
+        session.close()
+
+    stats = coordinator.stats()
+    assert stats["retries"] >= 1
+    assert stats["lock_errors"] == stats["retries"]
+    assert stats["failures"] == 0
+    assert stats["attempts"] == stats["retries"] + 1
+    assert stats["transactions"] == 1
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM items")).scalar() == 1
+
+
+def test_concurrent_writers_are_serialized(no_wait_engine):
+    engine, _ = no_wait_engine
+    factory = sessionmaker(bind=engine)
+    coordinator = WriteCoordinator("test")
+    errors = []
+
+    def writer(n):
+        session = factory()
+        try:
+            for i in range(20):
+                coordinator.run(
+                    session,
+                    lambda: session.execute(
+                        text("INSERT INTO items (value) VALUES (:value)"), {"value": i}
+                    ),
+                    f"writer-{n}",
+                )
+        except Exception as e:
+            errors.append(e)
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    stats = coordinator.stats()
+    assert stats["transactions"] == 160
+    assert stats["lock_errors"] == 0
+    assert stats["holder"] is None
+    assert stats["wait_seconds_max"] >= stats["wait_seconds_p50"]
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM items")).scalar() == 160
+
+
+def test_nested_runs_join_the_outer_transaction(no_wait_engine):
+    engine, _ = no_wait_engine
+    session = sessionmaker(bind=engine)()
+    coordinator = WriteCoordinator("test")
+
+    def outer():
+        session.execute(text("INSERT INTO items (value) VALUES (1)"))
+        coordinator.run(
+            session, lambda: session.execute(text("INSERT INTO items (value) VALUES (2)"))
+        )
+        raise RuntimeError("abort")
+
+    with pytest.raises(RuntimeError):
+        coordinator.run(session, outer)
+    session.close()
+
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM items")).scalar() == 0
+    stats = coordinator.stats()
+    assert (stats["attempts"], stats["transactions"]) == (1, 0)
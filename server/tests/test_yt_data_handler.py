@@ -3,7 +3,8 @@ import json
 import os
 
 from models.yt_data_handler import YouTubeDataHandler
-from models.schema import YouTubeChatMessage
+from models.schema import ChatAuthor, Stream, YouTubeChatMessage
+from models.dicts import PlatformType
 
 YT_MESSAGES_PATH = os.path.join(
     os.path.dirname(__file__), "..", "data", "yt_messages.json"
@@ -23,8 +24,15 @@ with open(YT_SUPERCHATS_PATH) as f:
     YT_SUPERCHATS_DATA = json.load(f)
 
 
+@pytest.fixture
+def stream(db_session):
+    # flushes only write rows for streams in the catalog
+    db_session.add(Stream(id=1, url="https://www.youtube.com/watch?v=1", platform=2))
+    db_session.commit()
+
+
 @pytest.mark.parametrize("message_data", YT_MESSAGES_DATA)
-def test_save_youtube_message(db_session, message_data):
+def test_save_youtube_message(db_session, stream, message_data):
     handler = YouTubeDataHandler(db_session)
 
     success = handler.save_message(message_data, stream_id=1)
@@ -43,14 +51,14 @@ def test_save_youtube_message(db_session, message_data):
 
 
 @pytest.mark.parametrize("ban_data", YT_BANS_DATA)
-def test_save_youtube_bans(db_session, ban_data):
+def test_save_youtube_bans(db_session, stream, ban_data):
     handler = YouTubeDataHandler(db_session)
 
     if ban_data.get("target_message_id"):
         banned_message = YouTubeChatMessage(
             message_id=ban_data["target_message_id"],
             stream_id=1,
-            author_name="test_user",
+            author=ChatAuthor(platform=PlatformType.YOUTUBE.value, name="test_user"),
             message_group_id=1,
             message="mssage to ban",
         )
@@ -72,7 +80,7 @@ def test_save_youtube_bans(db_session, ban_data):
 
 
 @pytest.mark.parametrize("superchat_data", YT_SUPERCHATS_DATA)
-def test_save_youtube_superchat(db_session, superchat_data):
+def test_save_youtube_superchat(db_session, stream, superchat_data):
     handler = YouTubeDataHandler(db_session)
 
     success = handler.save_message(superchat_data, stream_id=1)
@@ -86,3 +94,27 @@ def test_save_youtube_superchat(db_session, superchat_data):
         .first()
     )
     assert message_in_db is not None
+
+
+def test_badge_flags_are_read_in_one_pass(db_session, stream):
+    handler = YouTubeDataHandler(db_session)
+    message = dict(YT_MESSAGES_DATA[0], message_id="badge-test")
+    message["author"] = dict(
+        message["author"],
+        badges=[
+            {"icon_name": "moderator", "title": "Moderator"},
+            {"title": "Member (2 years)"},
+            {"icon_name": "verified"},
+        ],
+    )
+
+    assert handler.save_message(message, stream_id=1)
+    queued = handler.message_batch[0]
+    assert not hasattr(queued, "__dict__")
+    handler.flush_batch()
+
+    message_in_db = db_session.query(YouTubeChatMessage).filter_by(message_id="badge-test").one()
+    assert message_in_db.is_moderator
+    assert message_in_db.is_member
+    assert not message_in_db.deleted
+    assert message_in_db.created_at is not None
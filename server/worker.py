@@ -0,0 +1,39 @@
+# Ingest-only process: claims download jobs from the shared database and runs
+# them without serving the API. Start as many as there are cores to spare, and
+# set DOWNLOAD_WORKERS=0 on API processes that should not download themselves.
+#
+#   cd server && DOWNLOAD_WORKERS=8 python -m worker
+import signal
+import sys
+import threading
+
+import database
+import main
+from models import alerts
+
+
+def run():
+    database.init_db()
+    db = database.SessionLocal()
+    try:
+        main.merge_interrupted_downloads(db)
+        alerts.rules.refresh(db, force=True)
+        main.replay_spools(db)
+    finally:
+        db.close()
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+
+    main.job_worker.start()
+    print(f"Ingest worker {main.job_worker.owner} running {main.job_worker.capacity} downloads")
+    sys.stdout.flush()
+    stopped.wait()
+    print("Shutting down...")
+    main.job_worker.stop()
+    database.close_db()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,216 @@
+from collections import deque
+from contextlib import contextmanager
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from typing import Callable, Optional
+import random
+import sys
+import threading
+import time
+
+SQLITE_BUSY = 5
+SQLITE_LOCKED = 6
+
+SLOW_WAIT_SECONDS = 1.0
+
+
+def is_lock_error(error: BaseException) -> bool:
+    if not isinstance(error, OperationalError):
+        return False
+    orig = error.orig
+    code = getattr(orig, "sqlite_errorcode", None)
+    if code is not None:
+        # extended codes such as SQLITE_BUSY_SNAPSHOT keep the primary code in the low byte
+        return code & 0xFF in (SQLITE_BUSY, SQLITE_LOCKED)
+    message = str(orig).lower()
+    return "database is locked" in message or "database table is locked" in message
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    # full jitter: spreads competing writers out instead of retrying in lockstep
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+# reentrant lock handed out in arrival order, remembers who holds it
+class FairLock:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._thread = None
+        self._depth = 0
+        self.holder: Optional[str] = None
+        self.held_since: Optional[float] = None
+
+    def acquire(self, owner: str) -> Optional[float]:
+        me = threading.get_ident()
+        with self._condition:
+            if self._thread == me:
+                self._depth += 1
+                return None
+            started = time.monotonic()
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while ticket != self._serving:
+                self._condition.wait()
+            self._thread = me
+            self._depth = 1
+            self.holder = owner
+            self.held_since = time.monotonic()
+            return self.held_since - started
+
+    def release(self) -> bool:
+        with self._condition:
+            self._depth -= 1
+            if self._depth:
+                return False
+            self._thread = None
+            self.holder = None
+            self.held_since = None
+            self._serving += 1
+            self._condition.notify_all()
+            return True
+
+    @property
+    def queued(self) -> int:
+        return self._next_ticket - self._serving
+
+    def held_by_current_thread(self) -> bool:
+        return self._thread == threading.get_ident()
+
+
+class WriteCoordinator:
+    def __init__(
+        self,
+        name: str,
+        max_retries: int = 8,
+        base_delay: float = 0.05,
+        max_delay: float = 2.0,
+        history: int = 1024,
+    ):
+        self.name = name
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = FairLock()
+        self.stats_lock = threading.Lock()
+        # attempts counts every BEGIN, transactions only the ones that committed
+        self.attempts = 0
+        self.transactions = 0
+        self.retries = 0
+        self.lock_errors = 0
+        self.failures = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.hold_seconds_total = 0.0
+        self.hold_seconds_max = 0.0
+        self.recent_waits = deque(maxlen=history)
+
+    @contextmanager
+    def hold(self, owner: Optional[str] = None):
+        owner = owner or threading.current_thread().name
+        waited = self.lock.acquire(owner)
+        if waited is not None:
+            self._record_wait(owner, waited)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - started
+            if self.lock.release():
+                self._record_hold(held)
+
+    def run(
+        self,
+        session: Session,
+        operation: Callable,
+        owner: Optional[str] = None,
+        on_rollback: Optional[Callable[[], None]] = None,
+    ):
+        # nested calls from the thread that already holds the lock join the open transaction
+        if self.lock.held_by_current_thread():
+            return operation()
+
+        attempt = 0
+        while True:
+            try:
+                with self.hold(owner):
+                    self._count("attempts")
+                    try:
+                        _begin_immediate(session)
+                        result = operation()
+                        session.commit()
+                        self._count("transactions")
+                        return result
+                    except BaseException:
+                        session.rollback()
+                        if on_rollback:
+                            on_rollback()
+                        raise
+            except OperationalError as e:
+                if not is_lock_error(e):
+                    self._count("failures")
+                    raise
+                self._count("lock_errors")
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+            attempt += 1
+            self._count("retries")
+            time.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+
+    def _count(self, name: str):
+        with self.stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _record_wait(self, owner: str, waited: float):
+        with self.stats_lock:
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            self.recent_waits.append(waited)
+        if waited >= SLOW_WAIT_SECONDS:
+            print(
+                f"{owner} waited {waited:.2f}s for the {self.name} write lock",
+                file=sys.stderr,
+            )
+
+    def _record_hold(self, held: float):
+        with self.stats_lock:
+            self.hold_seconds_total += held
+            self.hold_seconds_max = max(self.hold_seconds_max, held)
+
+    def stats(self) -> dict:
+        with self.stats_lock:
+            waits = sorted(self.recent_waits)
+            holder = self.lock.holder
+            held_since = self.lock.held_since
+            return {
+                "attempts": self.attempts,
+                "transactions": self.transactions,
+                "retries": self.retries,
+                "lock_errors": self.lock_errors,
+                "failures": self.failures,
+                "queued": self.lock.queued,
+                "holder": holder,
+                "held_for": time.monotonic() - held_since if held_since else 0.0,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+                "wait_seconds_p50": _percentile(waits, 0.5),
+                "wait_seconds_p99": _percentile(waits, 0.99),
+                "hold_seconds_total": self.hold_seconds_total,
+                "hold_seconds_max": self.hold_seconds_max,
+            }
+
+
+def _percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def _begin_immediate(session: Session):
+    # take the sqlite write lock up front, a deferred transaction that reads
+    # first can fail to upgrade with SQLITE_BUSY regardless of the busy timeout
+    connection = session.connection()
+    if not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql("BEGIN IMMEDIATE")